@@ -0,0 +1,149 @@
+# Chuỗi thời gian hoạt động theo giờ của sự kiện (vé bán, lượt xem, review) cho điểm trending.
+#
+# Mỗi hoạt động được cộng vào bucket của giờ hiện tại (EventActivityBucket) bằng một UPDATE F().
+# Lệnh `python manage.py close_activity_buckets` (chạy mỗi giờ bằng Cron Jobs) đóng các bucket đã
+# qua giờ: cộng chúng vào tổng suy giảm theo hàm mũ lưu trên EventTrendingLog (recent_sales,
+# recent_views, recent_reviews, tính tại decayed_through) rồi tính lại điểm cho đúng các sự kiện có
+# bucket mới. Khi đọc, tổng được suy giảm tiếp tới hiện tại (EventTrendingLog.recent_activity) nên
+# sự kiện không có hoạt động mới không cần cập nhật mà điểm vẫn giảm dần khi `rescore_trending` chạy.
+#
+# Bucket giờ cũ hơn ACTIVITY_HOURLY_RETENTION_DAYS được gộp thành bucket ngày, bucket ngày cũ hơn
+# ACTIVITY_DAILY_RETENTION_DAYS bị xóa để bảng không lớn dần.
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import EventActivityBucket, EventTrendingLog, decay_factor
+
+HOUR = timedelta(hours=1)
+HOURLY_RETENTION = timedelta(days=getattr(settings, 'ACTIVITY_HOURLY_RETENTION_DAYS', 7))
+DAILY_RETENTION = timedelta(days=getattr(settings, 'ACTIVITY_DAILY_RETENTION_DAYS', 90))
+ACTIVITY_FIELDS = ('sales', 'views', 'reviews')
+
+
+def bucket_start(at=None):
+    return (at or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+
+def record(event_id, sales=0, views=0, reviews=0):
+    """Cộng hoạt động vào bucket của giờ hiện tại; thường chỉ một câu UPDATE."""
+    values = {'sales': sales, 'views': views, 'reviews': reviews}
+    increments = {field: F(field) + value for field, value in values.items() if value}
+    if not increments:
+        return
+    buckets = EventActivityBucket.objects.filter(event_id=event_id, span=EventActivityBucket.HOURLY, start=bucket_start())
+    if buckets.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            EventActivityBucket.objects.create(event_id=event_id, start=bucket_start(), **values)
+    except IntegrityError:
+        # Request khác vừa tạo bucket của giờ này
+        buckets.update(**increments)
+
+
+def close_buckets(now=None):
+    """
+    Cộng các bucket giờ đã đóng (chưa được tính) vào tổng suy giảm của sự kiện, đồng thời cộng lượt
+    xem vào view_count. Trả về danh sách event_id đã cập nhật.
+    """
+    closed_through = bucket_start(now)
+    candidates = set(
+        EventActivityBucket.objects.filter(span=EventActivityBucket.HOURLY, start__lt=closed_through)
+        .filter(Q(event__trending_log__decayed_through__isnull=True) |
+                Q(start__gte=F('event__trending_log__decayed_through')))
+        .order_by().values_list('event_id', flat=True).distinct()
+    )
+    if not candidates:
+        return []
+
+    with transaction.atomic():
+        # Sự kiện cũ chưa có trending log
+        EventTrendingLog.objects.bulk_create(
+            [EventTrendingLog(event_id=event_id) for event_id in candidates], ignore_conflicts=True
+        )
+        logs = list(
+            EventTrendingLog.objects.select_for_update().filter(event_id__in=candidates)
+            .only('event_id', 'view_count', 'recent_sales', 'recent_views', 'recent_reviews', 'decayed_through')
+        )
+        # Đọc lại bucket sau khi đã khóa, theo decayed_through của log đã khóa: lần chạy chồng lên
+        # phải chờ lần trước commit rồi chỉ thấy các bucket chưa được cộng
+        unfolded = Q()
+        for log in logs:
+            if log.decayed_through is None:
+                unfolded |= Q(event_id=log.event_id)
+            else:
+                unfolded |= Q(event_id=log.event_id, start__gte=log.decayed_through)
+        rows = (
+            EventActivityBucket.objects.filter(span=EventActivityBucket.HOURLY, start__lt=closed_through)
+            .filter(unfolded).order_by().values_list('event_id', 'start', *ACTIVITY_FIELDS)
+        )
+        closed = defaultdict(list)
+        for event_id, start, *values in rows:
+            closed[event_id].append((start, values))
+
+        logs = [log for log in logs if log.event_id in closed]
+        for log in logs:
+            totals = list(log.recent_activity(closed_through))
+            for start, values in closed[log.event_id]:
+                factor = decay_factor(closed_through - (start + HOUR))
+                for index, value in enumerate(values):
+                    totals[index] += value * factor
+                log.view_count += values[1]
+            log.recent_sales, log.recent_views, log.recent_reviews = totals
+            log.decayed_through = closed_through
+        EventTrendingLog.objects.bulk_update(
+            logs, ['view_count', 'recent_sales', 'recent_views', 'recent_reviews', 'decayed_through']
+        )
+    return list(closed)
+
+
+def roll_up_buckets(now=None):
+    """
+    Gộp bucket giờ của những ngày cũ hơn HOURLY_RETENTION (đã được tính vào tổng suy giảm) thành
+    bucket ngày và xóa bucket ngày quá DAILY_RETENTION. Trả về (số bucket giờ đã gộp, số bucket ngày đã xóa).
+    """
+    now = now or timezone.now()
+    day_cutoff = bucket_start(now - HOURLY_RETENTION).replace(hour=0)
+    hourly = (
+        EventActivityBucket.objects.filter(span=EventActivityBucket.HOURLY, start__lt=day_cutoff)
+        .filter(start__lt=F('event__trending_log__decayed_through'))
+    )
+    with transaction.atomic():
+        days = (
+            hourly.order_by().annotate(day=TruncDay('start', tzinfo=dt_timezone.utc))
+            .values('event_id', 'day')
+            .annotate(total_sales=Sum('sales'), total_views=Sum('views'), total_reviews=Sum('reviews'))
+        )
+        keys = {(row['event_id'], row['day']): row for row in days}
+        existing = {
+            (bucket.event_id, bucket.start): bucket
+            for bucket in EventActivityBucket.objects.filter(
+                span=EventActivityBucket.DAILY, event_id__in={event_id for event_id, _ in keys},
+                start__in={day for _, day in keys},
+            )
+        }
+        created, updated = [], []
+        for key, row in keys.items():
+            bucket = existing.get(key)
+            if bucket is None:
+                bucket = EventActivityBucket(event_id=key[0], span=EventActivityBucket.DAILY, start=key[1])
+                created.append(bucket)
+            else:
+                updated.append(bucket)
+            bucket.sales += row['total_sales']
+            bucket.views += row['total_views']
+            bucket.reviews += row['total_reviews']
+        EventActivityBucket.objects.bulk_create(created)
+        EventActivityBucket.objects.bulk_update(updated, ACTIVITY_FIELDS)
+        rolled_up, _ = hourly.delete()
+
+    expired, _ = EventActivityBucket.objects.filter(
+        span=EventActivityBucket.DAILY, start__lt=now - DAILY_RETENTION
+    ).delete()
+    return rolled_up, expired
@@ -5,9 +5,11 @@ from django.utils.safestring import mark_safe
 from django import forms
 from ckeditor_uploader.widgets import CKEditorUploadingWidget
 from django.urls import path
+from .qr import render_qr
+from .ticket_tokens import ticket_qr_data
 from .models import (
     User, Event, Tag, Ticket, Payment, Review, DiscountCode, Notification,
-    ChatMessage, EventTrendingLog, UserNotification
+    ChatMessage, EventTrendingLog, UserNotification, NotificationFanout
 )
 
 # Form tùy chỉnh cho Event
@@ -56,7 +58,7 @@ class EventAdmin(admin.ModelAdmin):
     list_display = ['id', 'title', 'category', 'start_time', 'organizer', 'is_active', 'total_tickets', 'sold_tickets']
     search_fields = ['title', 'description', 'location']
     list_filter = ['category', 'is_active', 'start_time']
-    readonly_fields = ['poster_view', 'sold_tickets']
+    readonly_fields = ['poster_view', 'sold_tickets', 'reserved_tickets']
     form = EventForm
     list_per_page = 20
 
@@ -89,9 +91,8 @@ class TicketAdmin(admin.ModelAdmin):
     list_per_page = 20
 
     def qr_code_view(self, ticket):
-        if ticket.qr_code:
-            return mark_safe(f"<img src='{ticket.qr_code.url}' width='100' />")
-        return "Không có QR code"
+        # Vẽ theo yêu cầu (xem events.qr), nhúng thẳng SVG để không phải gọi thêm request
+        return mark_safe(render_qr(ticket_qr_data(ticket), 'svg', 100).decode())
     qr_code_view.short_description = "QR Code"
 
     def get_queryset(self, request):
@@ -128,9 +129,9 @@ class DiscountCodeAdmin(admin.ModelAdmin):
 
 # Admin cho Notification
 class NotificationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'event', 'notification_type', 'title', 'created_at', 'get_ticket_owners', 'get_is_read_status']
+    list_display = ['id', 'event', 'notification_type', 'title', 'is_broadcast', 'created_at', 'get_ticket_owners', 'get_is_read_status']
     search_fields = ['title', 'message']
-    list_filter = ['notification_type', 'created_at']
+    list_filter = ['notification_type', 'is_broadcast', 'created_at']
     form = NotificationForm
     list_per_page = 20
 
@@ -146,6 +147,8 @@ class NotificationAdmin(admin.ModelAdmin):
         Hiển thị trạng thái is_read của thông báo dựa trên UserNotification.
         Nếu có ít nhất một UserNotification liên quan chưa đọc, trả về 'Chưa đọc'.
         """
+        if obj.is_broadcast:
+            return "Thông báo chung"
         user_notifications = obj.user_notifications.all()
         if not user_notifications.exists():
             return "Không có người nhận"
@@ -231,6 +234,16 @@ class MyAdminSite(admin.AdminSite):
 # Khởi tạo admin site
 admin_site = MyAdminSite(name='event_admin')
 
+# Admin cho NotificationFanout: theo dõi tiến độ gửi thông báo chạy nền
+class NotificationFanoutAdmin(admin.ModelAdmin):
+    list_display = ['notification', 'status', 'delivered', 'total', 'attempts', 'locked_until', 'updated_at']
+    list_filter = ['status']
+    readonly_fields = ['last_user_id', 'delivered', 'total', 'attempts', 'locked_until']
+    list_per_page = 20
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('notification')
+
 # Đăng ký các model
 admin_site.register(User, UserAdmin)
 admin_site.register(Event, EventAdmin)
@@ -242,4 +255,5 @@ admin_site.register(DiscountCode, DiscountCodeAdmin)
 admin_site.register(Notification, NotificationAdmin)
 admin_site.register(ChatMessage, ChatMessageAdmin)
 admin_site.register(EventTrendingLog, EventTrendingLogAdmin)
-admin_site.register(UserNotification, UserNotificationAdmin)
\ No newline at end of file
+admin_site.register(UserNotification, UserNotificationAdmin)
+admin_site.register(NotificationFanout, NotificationFanoutAdmin)
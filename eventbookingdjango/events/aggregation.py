@@ -0,0 +1,128 @@
+# Gom các thay đổi trạng thái vé trong một transaction rồi áp dụng một lần khi commit.
+#
+# Signal của Ticket chỉ ghi nhận (không truy vấn): vé chuyển sang đã thanh toán, bị hủy thanh toán,
+# bị xóa... Khi transaction commit, mỗi sự kiện bị ảnh hưởng được cập nhật bộ đếm tồn kho và doanh
+# thu một lần, điểm trending được tính lại một lần cho cả lô. Số truy vấn chỉ phụ thuộc số sự kiện,
+# không phụ thuộc số vé.
+#
+# Mỗi thao tác được đăng ký bằng transaction.on_commit() trong đúng savepoint ghi nhận nó, nên
+# savepoint bị rollback thì Django bỏ thao tác đó; thao tác còn lại được gom khi commit.
+import threading
+import weakref
+from collections import Counter, defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F
+
+from . import activity
+from .counters import get_counter
+from .models import Event, EventTrendingLog
+
+# Các thao tác trên bộ đếm tồn kho (events.counters) và ảnh hưởng tới số vé đã bán
+COUNTER_MOVES = {'commit': 1, 'uncommit': -1, 'remove_sold': -1, 'release': 0}
+
+
+_local = threading.local()
+
+
+def _pending(using):
+    """Các thao tác đang chờ commit trên kết nối `using` của thread hiện tại."""
+    if not hasattr(_local, 'pending'):
+        _local.pending = {}
+    return _local.pending.setdefault(using or DEFAULT_DB_ALIAS, weakref.WeakSet())
+
+
+class PendingMove:
+    """
+    Một thao tác chờ commit, được đăng ký làm callback on_commit. Chỉ danh sách on_commit của Django
+    giữ tham chiếu (_pending là WeakSet): thao tác của savepoint bị rollback hoặc transaction bị
+    rollback bị Django bỏ khỏi danh sách và giải phóng ngay, nên không còn trong _pending.
+    """
+
+    def __init__(self, event_id, move, quantity, using=None):
+        self.event_id = event_id
+        self.move = move
+        self.quantity = quantity
+        self.using = using
+        self.applied = False
+
+    def __call__(self):
+        if self.applied:
+            return
+        # Callback chạy đầu tiên sau commit áp dụng cả lô: mọi thao tác còn sống đều đã được commit
+        moves = defaultdict(Counter)
+        for pending in list(_pending(self.using)):
+            if not pending.applied:
+                pending.applied = True
+                moves[pending.event_id][pending.move] += pending.quantity
+        apply_moves(moves, using=self.using)
+
+
+def record(event_id, move, quantity=1, using=None):
+    """
+    Ghi nhận một thao tác (`commit`, `uncommit`, `remove_sold`, `release`) cho sự kiện.
+    Trong transaction: áp dụng khi commit cùng các thay đổi khác (bỏ qua nếu savepoint ghi nhận nó
+    bị rollback). Ngoài transaction: áp dụng ngay.
+    """
+    if not transaction.get_connection(using).in_atomic_block:
+        apply_moves({event_id: Counter({move: quantity})}, using=using)
+        return
+    pending = PendingMove(event_id, move, quantity, using)
+    _pending(using).add(pending)
+    transaction.on_commit(pending, using=using)
+
+
+def apply_moves(moves, using=None):
+    """Áp dụng {event_id: Counter(move=số vé)}: bộ đếm, doanh thu, rồi tính lại điểm trending."""
+    counter = get_counter()
+    with transaction.atomic(using=using):
+        for event_id, counts in moves.items():
+            for move, quantity in counts.items():
+                if quantity:
+                    getattr(counter, move)(event_id, quantity)
+        # Trả lại chỗ giữ (release) không đổi số vé đã bán nên không cần tính lại điểm
+        sold_changes = {
+            event_id: sum(COUNTER_MOVES[move] * quantity for move, quantity in counts.items())
+            for event_id, counts in moves.items()
+            if any(counts[move] for move in COUNTER_MOVES if move != 'release')
+        }
+        if sold_changes:
+            rescore_events(sold_changes.keys(), revenue_tickets=sold_changes)
+        # Vé bán được tính vào bucket hoạt động của giờ hiện tại (events.activity)
+        for event_id, counts in moves.items():
+            if counts['commit']:
+                activity.record(event_id, sales=counts['commit'])
+
+
+def rescore_events(event_ids, revenue_tickets=None):
+    """
+    Tính lại điểm trending cho các sự kiện, cộng doanh thu của `revenue_tickets` ({event_id: số vé})
+    bằng F-expression. Một SELECT sự kiện kèm số review, một UPDATE doanh thu cho mỗi sự kiện có thay
+    đổi, một SELECT trending log và một bulk_update điểm.
+    """
+    revenue_tickets = revenue_tickets or {}
+    events = (
+        Event.objects.filter(pk__in=event_ids)
+        .annotate(review_count=Count('reviews'))
+        .only('pk', 'sold_tickets', 'total_tickets', 'ticket_price')
+        .in_bulk()
+    )
+    EventTrendingLog.objects.bulk_create(
+        [EventTrendingLog(event_id=event_id) for event_id in events], ignore_conflicts=True
+    )
+    for event_id, tickets in revenue_tickets.items():
+        if tickets and event_id in events:
+            EventTrendingLog.objects.filter(event_id=event_id).update(
+                total_revenue=F('total_revenue') + events[event_id].ticket_price * tickets
+            )
+
+    logs = list(
+        EventTrendingLog.objects.filter(event_id__in=events)
+        .only('event_id', 'recent_sales', 'recent_views', 'recent_reviews', 'decayed_through')
+    )
+    for log in logs:
+        event = events[log.event_id]
+        log.trending_score, log.interest_score = EventTrendingLog.compute_scores(
+            event.sold_tickets, event.total_tickets, event.review_count, *log.recent_activity()
+        )
+    EventTrendingLog.objects.bulk_update(logs, ['trending_score', 'interest_score'])
@@ -0,0 +1,112 @@
+# Đặt vé theo lô: giữ chỗ cho mọi sự kiện trong một transaction rồi bulk_create vé
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Event, Ticket, EventTrendingLog, TICKET_HOLD_TTL
+from .counters import get_counter
+
+# Số vé tối đa trong một lần đặt
+MAX_TICKETS_PER_BOOKING = getattr(settings, 'MAX_TICKETS_PER_BOOKING', 10)
+
+
+def parse_booking_items(data):
+    """
+    Chuẩn hóa dữ liệu đặt vé thành dict {event_id: quantity}.
+    Nhận {"event_id": 1, "quantity": 3} hoặc {"items": [{"event_id": 1, "quantity": 3}, ...]}.
+    """
+    items = data.get('items')
+    if items is None:
+        items = [{'event_id': data.get('event_id'), 'quantity': data.get('quantity', 1)}]
+    if not isinstance(items, list) or not items:
+        raise ValidationError("Danh sách vé không hợp lệ.")
+
+    quantities = {}
+    for item in items:
+        try:
+            event_id = int(item.get('event_id'))
+            quantity = int(item.get('quantity', 1))
+        except (AttributeError, TypeError, ValueError):
+            raise ValidationError("event_id và quantity phải là số nguyên.")
+        if quantity < 1:
+            raise ValidationError("Số lượng vé phải lớn hơn 0.")
+        quantities[event_id] = quantities.get(event_id, 0) + quantity
+
+    if sum(quantities.values()) > MAX_TICKETS_PER_BOOKING:
+        raise ValidationError(f"Chỉ được đặt tối đa {MAX_TICKETS_PER_BOOKING} vé mỗi lần.")
+    return quantities
+
+
+def book_tickets(user, quantities):
+    """
+    Đặt vé cho `user` theo dict {event_id: quantity}.
+    Số truy vấn không phụ thuộc số vé: một UPDATE giữ chỗ cho mỗi sự kiện, một bulk_create cho tất cả vé.
+    Raise Event.DoesNotExist nếu có sự kiện không khả dụng, ValidationError nếu hết vé.
+    """
+    counter = get_counter()
+    reserved = []
+    with transaction.atomic():
+        events = Event.objects.on_sale().filter(id__in=quantities.keys()).in_bulk()
+        if len(events) != len(quantities):
+            raise Event.DoesNotExist("Sự kiện không tồn tại hoặc không khả dụng.")
+
+        try:
+            for event_id, quantity in quantities.items():
+                if not counter.reserve(event_id, quantity):
+                    # Rollback toàn bộ chỗ đã giữ cho các sự kiện trước đó
+                    raise ValidationError(f"Sự kiện {events[event_id].title} không còn đủ vé.")
+                reserved.append((event_id, quantity))
+
+            # bulk_create không gọi Ticket.save và signal post_save: chỗ đã được giữ ở trên,
+            # vé chưa thanh toán không làm thay đổi sold_tickets/doanh thu
+            hold_expires_at = timezone.now() + TICKET_HOLD_TTL
+            tickets = [
+                Ticket(user=user, event=events[event_id], hold_expires_at=hold_expires_at)
+                for event_id, quantity in quantities.items()
+                for _ in range(quantity)
+            ]
+            Ticket.objects.bulk_create(tickets)
+            EventTrendingLog.objects.bulk_create(
+                [EventTrendingLog(event_id=event_id) for event_id in events],
+                ignore_conflicts=True
+            )
+        except Exception:
+            # Bộ đếm nằm ngoài DB (Redis) không rollback cùng transaction
+            for event_id, quantity in reserved:
+                counter.cancel_reservation(event_id, quantity)
+            raise
+
+    # MySQL không trả về pk sau bulk_create nên nạp lại theo uuid (đã sinh phía Python)
+    return list(
+        Ticket.objects.filter(uuid__in=[ticket.uuid for ticket in tickets]).select_related('event', 'user')
+    )
+
+
+def release_expired_holds(batch_size=1000, now=None):
+    """
+    Hủy các vé giữ chỗ đã hết hạn theo từng lô và trả lại chỗ cho sự kiện.
+    Mỗi lô: một SELECT theo index (is_paid, hold_expires_at), một DELETE, một UPDATE cho mỗi sự kiện.
+    Vé đã gắn với một Payment đang chờ xác nhận không bị hủy.
+    Trả về tổng số vé đã hủy.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked: nhiều tiến trình dọn dẹp chạy song song không tranh nhau cùng lô
+            batch = list(
+                Ticket.objects.expired_holds(now).order_by()
+                .select_for_update(skip_locked=True)
+                .values_list('pk', 'event_id')[:batch_size]
+            )
+            if not batch:
+                break
+            # Signal post_delete trả lại chỗ qua events.aggregation, được gộp thành một UPDATE
+            # cho mỗi sự kiện khi transaction commit
+            Ticket.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+        released += len(batch)
+        if len(batch) < batch_size:
+            break
+    return released
@@ -0,0 +1,379 @@
+# Bộ đếm tồn kho vé có thể thay thế (giữ chỗ / bán / trả chỗ).
+#
+# Cấu hình trong settings, mặc định dùng dòng Event:
+#   INVENTORY_COUNTER = {
+#       'BACKEND': 'events.counters.ShardedCounter',
+#       'OPTIONS': {'shards': 16},
+#   }
+# Với ShardedCounter và RedisCounter, Event.sold_tickets / reserved_tickets chỉ được cập nhật
+# khi chạy reconcile (python manage.py reconcile_inventory).
+import random
+import threading
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F, Sum
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Event, InventoryShard
+
+
+class BaseInventoryCounter:
+    def reserve(self, event_id, quantity=1):
+        """Giữ chỗ `quantity` vé, trả về True nếu còn đủ vé."""
+        raise NotImplementedError
+
+    def cancel_reservation(self, event_id, quantity=1):
+        """
+        Hoàn tác reserve() khi transaction đặt vé thất bại. Bộ đếm nằm trong DB được rollback
+        cùng transaction nên không cần làm gì.
+        """
+
+    def release(self, event_id, quantity=1):
+        """Trả lại chỗ đã giữ."""
+        raise NotImplementedError
+
+    def commit(self, event_id, quantity=1):
+        """Chuyển chỗ đã giữ thành vé đã bán."""
+        raise NotImplementedError
+
+    def uncommit(self, event_id, quantity=1):
+        """Chuyển vé đã bán về trạng thái giữ chỗ."""
+        raise NotImplementedError
+
+    def remove_sold(self, event_id, quantity=1):
+        """Giảm số vé đã bán (vé đã thanh toán bị xóa)."""
+        raise NotImplementedError
+
+    def totals(self, event_id):
+        """Trả về (reserved, sold) hiện tại của sự kiện."""
+        raise NotImplementedError
+
+    def reconcile(self, event_ids=None):
+        """Gộp bộ đếm về Event.sold_tickets / reserved_tickets, trả về số sự kiện đã cập nhật."""
+        return 0
+
+
+class EventRowCounter(BaseInventoryCounter):
+    """Mỗi thao tác là một UPDATE có điều kiện trên dòng Event (xem EventQuerySet)."""
+
+    def reserve(self, event_id, quantity=1):
+        return Event.objects.reserve_tickets(event_id, quantity)
+
+    def release(self, event_id, quantity=1):
+        Event.objects.release_tickets(event_id, quantity)
+
+    def commit(self, event_id, quantity=1):
+        Event.objects.commit_tickets(event_id, quantity)
+
+    def uncommit(self, event_id, quantity=1):
+        Event.objects.uncommit_tickets(event_id, quantity)
+
+    def remove_sold(self, event_id, quantity=1):
+        Event.objects.remove_sold_tickets(event_id, quantity)
+
+    def totals(self, event_id):
+        return tuple(Event.objects.values_list('reserved_tickets', 'sold_tickets').get(pk=event_id))
+
+
+class ShardedCounter(BaseInventoryCounter):
+    """
+    Chia số vé còn lại của sự kiện cho N dòng InventoryShard. Mỗi lượt đặt vé chọn ngẫu nhiên
+    một shard và chỉ khóa dòng đó, nên số lượt đặt đồng thời tăng theo số shard.
+    Không bán vượt: mỗi shard tự kiểm tra capacity của mình trong câu UPDATE có điều kiện.
+    Khi một shard hết chỗ, lượt đặt thử lần lượt các shard còn lại; nếu không shard nào đủ chỗ cho
+    cả lượt đặt thì chia lượt đặt cho nhiều shard (_reserve_split). Reconcile chia lại chỗ trống.
+    """
+
+    def __init__(self, shards=8):
+        self.shards = shards
+
+    def ensure_shards(self, event_id):
+        # Chia phần vé còn trống trên dòng Event cho các shard; tạo đồng thời cũng an toàn
+        # nhờ unique (event, shard) + ignore_conflicts
+        total, sold, reserved = Event.objects.values_list(
+            'total_tickets', 'sold_tickets', 'reserved_tickets'
+        ).get(pk=event_id)
+        free = max(total - sold - reserved, 0)
+        InventoryShard.objects.bulk_create([
+            InventoryShard(
+                event_id=event_id, shard=i,
+                capacity=self._share(free, i, self.shards) + (sold + reserved if i == 0 else 0),
+                reserved=reserved if i == 0 else 0,
+                sold=sold if i == 0 else 0,
+            )
+            for i in range(self.shards)
+        ], ignore_conflicts=True)
+
+    @staticmethod
+    def _share(amount, index, count):
+        return amount // count + (1 if index < amount % count else 0)
+
+    def _shard_order(self):
+        start = random.randrange(self.shards)
+        return [(start + i) % self.shards for i in range(self.shards)]
+
+    def _apply(self, event_id, guard, **updates):
+        """Áp dụng cập nhật lên shard đầu tiên thỏa điều kiện `guard`, trả về True nếu thành công."""
+        shards = InventoryShard.objects.filter(event_id=event_id)
+        for shard in self._shard_order():
+            if shards.filter(shard=shard, **guard).update(**updates):
+                return True
+        return False
+
+    def reserve(self, event_id, quantity=1):
+        guard = {'capacity__gte': F('sold') + F('reserved') + quantity}
+        updates = {'reserved': F('reserved') + quantity}
+        if self._apply(event_id, guard, **updates):
+            return True
+        if not InventoryShard.objects.filter(event_id=event_id).exists():
+            self.ensure_shards(event_id)
+            if self._apply(event_id, guard, **updates):
+                return True
+        return self._reserve_split(event_id, quantity)
+
+    def _reserve_split(self, event_id, quantity):
+        """
+        Không shard nào còn đủ `quantity` chỗ: lấy phần còn trống của từng shard, nếu cộng lại vẫn
+        không đủ thì trả lại các phần đã lấy.
+        """
+        shards = InventoryShard.objects.filter(event_id=event_id)
+        free = dict(shards.annotate(free=F('capacity') - F('sold') - F('reserved')).values_list('shard', 'free'))
+        claimed, remaining = [], quantity
+        for shard in self._shard_order():
+            take = min(free.get(shard, 0), remaining)
+            # Shard có thể vừa bị lượt đặt khác lấy bớt: UPDATE có điều kiện sẽ không khớp
+            if take > 0 and shards.filter(shard=shard, capacity__gte=F('sold') + F('reserved') + take).update(
+                reserved=F('reserved') + take
+            ):
+                claimed.append((shard, take))
+                remaining -= take
+                if not remaining:
+                    return True
+        for shard, take in claimed:
+            shards.filter(shard=shard).update(reserved=F('reserved') - take)
+        return False
+
+    def _move(self, event_id, quantity, source, target):
+        # Trừ ở shard còn đủ `source`; nếu không shard nào đủ thì trừ từng vé một
+        updates = {source: F(source) - quantity}
+        source_updates = {source: F(source) - 1}
+        if target:
+            updates[target] = F(target) + quantity
+            source_updates[target] = F(target) + 1
+        if self._apply(event_id, {f'{source}__gte': quantity}, **updates):
+            return
+        for _ in range(quantity):
+            if not self._apply(event_id, {f'{source}__gte': 1}, **source_updates):
+                break
+
+    def release(self, event_id, quantity=1):
+        self._move(event_id, quantity, 'reserved', None)
+
+    def commit(self, event_id, quantity=1):
+        self._move(event_id, quantity, 'reserved', 'sold')
+
+    def uncommit(self, event_id, quantity=1):
+        self._move(event_id, quantity, 'sold', 'reserved')
+
+    def remove_sold(self, event_id, quantity=1):
+        self._move(event_id, quantity, 'sold', None)
+
+    def totals(self, event_id):
+        sums = InventoryShard.objects.filter(event_id=event_id).aggregate(
+            reserved=Sum('reserved'), sold=Sum('sold')
+        )
+        return sums['reserved'] or 0, sums['sold'] or 0
+
+    def reconcile(self, event_ids=None):
+        shards = InventoryShard.objects.all()
+        if event_ids is not None:
+            shards = shards.filter(event_id__in=event_ids)
+        updated = 0
+        for event_id in shards.values_list('event_id', flat=True).distinct().iterator():
+            with transaction.atomic():
+                rows = list(InventoryShard.objects.select_for_update().filter(event_id=event_id).order_by('shard'))
+                total = Event.objects.values_list('total_tickets', flat=True).get(pk=event_id)
+                reserved = sum(row.reserved for row in rows)
+                sold = sum(row.sold for row in rows)
+                Event.objects.filter(pk=event_id).update(reserved_tickets=reserved, sold_tickets=sold)
+                # Chia lại chỗ trống đều cho các shard (kể cả khi total_tickets thay đổi)
+                free = max(total - reserved - sold, 0)
+                for i, row in enumerate(rows):
+                    row.capacity = row.sold + row.reserved + self._share(free, i, len(rows))
+                InventoryShard.objects.bulk_update(rows, ['capacity'])
+            updated += 1
+        return updated
+
+
+class ExternalInventoryCounter(BaseInventoryCounter):
+    """
+    Bộ đếm nằm ngoài DB nên không rollback cùng transaction: reserve() chạy ngay (để kiểm tra
+    còn vé), các thao tác còn lại chỉ áp dụng sau khi transaction của Django commit.
+    """
+
+    def _move(self, event_id, quantity, source, target=None):
+        raise NotImplementedError
+
+    def cancel_reservation(self, event_id, quantity=1):
+        self._move(event_id, quantity, 'reserved')
+
+    def release(self, event_id, quantity=1):
+        transaction.on_commit(partial(self._move, event_id, quantity, 'reserved'))
+
+    def commit(self, event_id, quantity=1):
+        transaction.on_commit(partial(self._move, event_id, quantity, 'reserved', 'sold'))
+
+    def uncommit(self, event_id, quantity=1):
+        transaction.on_commit(partial(self._move, event_id, quantity, 'sold', 'reserved'))
+
+    def remove_sold(self, event_id, quantity=1):
+        transaction.on_commit(partial(self._move, event_id, quantity, 'sold'))
+
+
+class RedisCounter(ExternalInventoryCounter):
+    """
+    Bộ đếm trên Redis: mỗi sự kiện là một hash {capacity, reserved, sold},
+    kiểm tra và tăng trong cùng một script Lua nên nguyên tử mà không khóa dòng nào trong DB.
+    """
+
+    RESERVE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+    local state = redis.call('HMGET', KEYS[1], 'capacity', 'reserved', 'sold')
+    local quantity = tonumber(ARGV[1])
+    if tonumber(state[2]) + tonumber(state[3]) + quantity > tonumber(state[1]) then return 0 end
+    redis.call('HINCRBY', KEYS[1], 'reserved', quantity)
+    return 1
+    """
+    MOVE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+    local quantity = math.min(tonumber(ARGV[1]), tonumber(redis.call('HGET', KEYS[1], ARGV[2])))
+    redis.call('HINCRBY', KEYS[1], ARGV[2], -quantity)
+    if ARGV[3] ~= '' then redis.call('HINCRBY', KEYS[1], ARGV[3], quantity) end
+    return 1
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='inventory', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._reserve = client.register_script(self.RESERVE_SCRIPT)
+        self._move_script = client.register_script(self.MOVE_SCRIPT)
+
+    def key(self, event_id):
+        return f'{self.prefix}:{event_id}'
+
+    def _load(self, event_id):
+        total, sold, reserved = Event.objects.values_list(
+            'total_tickets', 'sold_tickets', 'reserved_tickets'
+        ).get(pk=event_id)
+        pipe = self.client.pipeline()
+        pipe.hsetnx(self.key(event_id), 'capacity', total)
+        pipe.hsetnx(self.key(event_id), 'reserved', reserved)
+        pipe.hsetnx(self.key(event_id), 'sold', sold)
+        pipe.execute()
+
+    def _call(self, script, event_id, *args):
+        result = script(keys=[self.key(event_id)], args=args)
+        if result == -1:
+            self._load(event_id)
+            result = script(keys=[self.key(event_id)], args=args)
+        return result
+
+    def reserve(self, event_id, quantity=1):
+        return self._call(self._reserve, event_id, quantity) == 1
+
+    def _move(self, event_id, quantity, source, target=None):
+        self._call(self._move_script, event_id, quantity, source, target or '')
+
+    def totals(self, event_id):
+        reserved, sold = self.client.hmget(self.key(event_id), 'reserved', 'sold')
+        return int(reserved or 0), int(sold or 0)
+
+    def reconcile(self, event_ids=None):
+        if event_ids is None:
+            event_ids = [
+                int(key.decode().rsplit(':', 1)[1])
+                for key in self.client.scan_iter(match=f'{self.prefix}:*')
+            ]
+        updated = 0
+        for event_id in event_ids:
+            if not self.client.exists(self.key(event_id)):
+                continue
+            reserved, sold = self.totals(event_id)
+            total = Event.objects.filter(pk=event_id).values_list('total_tickets', flat=True).first()
+            if total is None:
+                self.client.delete(self.key(event_id))
+                continue
+            Event.objects.filter(pk=event_id).update(reserved_tickets=reserved, sold_tickets=sold)
+            # Cập nhật capacity khi organizer thay đổi total_tickets
+            self.client.hset(self.key(event_id), 'capacity', total)
+            updated += 1
+        return updated
+
+
+class LocalCounter(ExternalInventoryCounter):
+    """Bộ đếm trong bộ nhớ tiến trình, cùng ngữ nghĩa với RedisCounter; dùng cho test."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def _get(self, event_id):
+        if event_id not in self._state:
+            total, sold, reserved = Event.objects.values_list(
+                'total_tickets', 'sold_tickets', 'reserved_tickets'
+            ).get(pk=event_id)
+            self._state[event_id] = {'capacity': total, 'reserved': reserved, 'sold': sold}
+        return self._state[event_id]
+
+    def reserve(self, event_id, quantity=1):
+        with self._lock:
+            state = self._get(event_id)
+            if state['reserved'] + state['sold'] + quantity > state['capacity']:
+                return False
+            state['reserved'] += quantity
+            return True
+
+    def _move(self, event_id, quantity, source, target=None):
+        with self._lock:
+            state = self._get(event_id)
+            quantity = min(quantity, state[source])
+            state[source] -= quantity
+            if target:
+                state[target] += quantity
+
+    def totals(self, event_id):
+        with self._lock:
+            state = self._get(event_id)
+            return state['reserved'], state['sold']
+
+    def reconcile(self, event_ids=None):
+        with self._lock:
+            items = [
+                (event_id, dict(state)) for event_id, state in self._state.items()
+                if event_ids is None or event_id in event_ids
+            ]
+        for event_id, state in items:
+            Event.objects.filter(pk=event_id).update(
+                reserved_tickets=state['reserved'], sold_tickets=state['sold']
+            )
+        return len(items)
+
+
+@lru_cache(maxsize=None)
+def get_counter():
+    config = getattr(settings, 'INVENTORY_COUNTER', {})
+    backend = import_string(config.get('BACKEND', 'events.counters.EventRowCounter'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_counter(setting, **kwargs):
+    if setting == 'INVENTORY_COUNTER':
+        get_counter.cache_clear()
@@ -0,0 +1,79 @@
+# Gộp các lần sửa sự kiện thành một thông báo cập nhật.
+#
+# Mỗi lần lưu Event đổi trường quan trọng chỉ ghi vào PendingEventUpdate của sự kiện (giá trị cũ của
+# trường lần đầu thay đổi và thời điểm sửa gần nhất), không tạo Notification ngay. Lệnh
+# `python manage.py run_notification_fanouts` gọi flush_due(): sự kiện đã yên EVENT_UPDATE_QUIET_SECONDS
+# (hoặc chờ quá EVENT_UPDATE_MAX_DELAY_SECONDS khi bị sửa liên tục) nhận một Notification liệt kê các
+# trường đã đổi; trường bị sửa rồi đổi lại như cũ thì bỏ qua.
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Notification, PendingEventUpdate
+
+QUIET_PERIOD = timedelta(seconds=getattr(settings, 'EVENT_UPDATE_QUIET_SECONDS', 300))
+MAX_DELAY = timedelta(seconds=getattr(settings, 'EVENT_UPDATE_MAX_DELAY_SECONDS', 1800))
+
+# Các trường quan trọng của sự kiện, theo thứ tự hiển thị trong thông báo
+FIELD_LABELS = {
+    'title': 'tên sự kiện',
+    'start_time': 'thời gian bắt đầu',
+    'end_time': 'thời gian kết thúc',
+    'location': 'địa điểm',
+    'is_active': 'trạng thái',
+}
+
+
+def _serialize(value):
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def record_change(event, fields):
+    """Ghi nhận các trường vừa đổi của sự kiện vào bộ đệm chờ gửi thông báo."""
+    now = timezone.now()
+    previous = {field: _serialize(event.previous_value(field)) for field in fields}
+    with transaction.atomic():
+        pending, created = PendingEventUpdate.objects.select_for_update().get_or_create(
+            event=event, defaults={'original_values': previous, 'first_changed_at': now, 'last_changed_at': now}
+        )
+        if not created:
+            # Giữ giá trị cũ nhất của trường đã có trong bộ đệm
+            pending.original_values = {**previous, **pending.original_values}
+            pending.last_changed_at = now
+            pending.save(update_fields=['original_values', 'last_changed_at'])
+
+
+def flush_due(now=None):
+    """Tạo thông báo cho các sự kiện đã hết khoảng lặng, trả về số thông báo đã tạo."""
+    now = now or timezone.now()
+    created = 0
+    with transaction.atomic():
+        due = list(
+            PendingEventUpdate.objects.select_for_update(skip_locked=True)
+            .filter(Q(last_changed_at__lte=now - QUIET_PERIOD) | Q(first_changed_at__lte=now - MAX_DELAY))
+            .select_related('event')
+        )
+        for pending in due:
+            event = pending.event
+            changed = [
+                field for field in FIELD_LABELS
+                if field in pending.original_values
+                and pending.original_values[field] != _serialize(getattr(event, field))
+            ]
+            if not changed:
+                continue
+            # Việc gửi tới người có vé chạy nền (events.fanout)
+            Notification.objects.create(
+                event=event,
+                title=f"Cập nhật sự kiện: {event.title}",
+                message=f"Sự kiện '{event.title}' đã được cập nhật: {', '.join(FIELD_LABELS[f] for f in changed)}.",
+                notification_type='update'
+            )
+            created += 1
+        PendingEventUpdate.objects.filter(pk__in=[pending.pk for pending in due]).delete()
+    return created
@@ -0,0 +1,48 @@
+# Tắt hàng loạt sự kiện đã kết thúc và mã giảm giá hết hạn/hết lượt.
+#
+# Signal pre_save chỉ cập nhật is_active khi bản ghi được lưu, nên bộ lọc is_active=True (danh sách
+# sự kiện, hot_events, mã giảm giá) có thể trả về dữ liệu cũ. Lệnh `python manage.py
+# expire_stale_records` (chạy định kỳ bằng Cron Jobs) tắt các bản ghi này bằng UPDATE theo từng khối
+# EXPIRY_CHUNK_SIZE khóa chính, mỗi khối một transaction ngắn. UPDATE không qua signal nên không
+# tạo thông báo cập nhật sự kiện. Lệnh này cũng xóa TicketTombstone cũ hơn gate_bundle.DELTA_MAX_AGE.
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .gate_bundle import DELTA_MAX_AGE
+from .models import DiscountCode, Event, TicketTombstone
+
+EXPIRY_CHUNK_SIZE = 1000
+
+
+def _deactivate(queryset, chunk_size):
+    changed = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return changed
+        changed += queryset.model.objects.filter(pk__in=pks, is_active=True).update(is_active=False)
+
+
+def expire_events(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """Tắt các sự kiện đã kết thúc, trả về số sự kiện đã đổi."""
+    return _deactivate(Event.objects.filter(is_active=True, end_time__lt=now or timezone.now()), chunk_size)
+
+
+def expire_discount_codes(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """Tắt các mã giảm giá hết hạn hoặc hết lượt dùng, trả về số mã đã đổi."""
+    stale = Q(valid_to__lt=now or timezone.now()) | Q(max_uses__isnull=False, used_count__gte=F('max_uses'))
+    return _deactivate(DiscountCode.objects.filter(stale, is_active=True), chunk_size)
+
+
+def expire_tombstones(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """
+    Xóa TicketTombstone cũ hơn DELTA_MAX_AGE, trả về số bản ghi đã xóa. Máy soát vé đồng bộ với
+    `since` cũ hơn mốc đó nhận gói đầy đủ nên không cần các bản ghi này.
+    """
+    stale = TicketTombstone.objects.filter(deleted_at__lt=(now or timezone.now()) - DELTA_MAX_AGE)
+    deleted = 0
+    while True:
+        pks = list(stale.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted
+        deleted += TicketTombstone.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,96 @@
+# Gửi thông báo của sự kiện tới từng người có vé (UserNotification) bằng job chạy nền.
+#
+# Lưu Notification gắn sự kiện chỉ tạo một NotificationFanout (một INSERT) thay vì bulk_create cho
+# mọi người có vé ngay trong transaction của request. Lệnh `python manage.py run_notification_fanouts`
+# (chạy mỗi phút bằng Cron Jobs) nhận job, đọc id người có vé theo thứ tự tăng dần bằng
+# .iterator(chunk_size=...) và chèn từng lô FANOUT_BATCH_SIZE dòng; mỗi lô commit cùng con trỏ
+# last_user_id nên job bị gián đoạn sẽ chạy tiếp từ lô kế tiếp khi hết hạn giữ (FANOUT_LEASE).
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import NotificationFanout, Ticket, UserNotification
+
+FANOUT_BATCH_SIZE = getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 1000)
+FANOUT_LEASE = timedelta(seconds=getattr(settings, 'NOTIFICATION_FANOUT_LEASE_SECONDS', 300))
+
+
+def _batched(values, size):
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ticket_owners(event_id, after=0):
+    return (
+        Ticket.objects.filter(event_id=event_id, user_id__gt=after)
+        .order_by('user_id').values_list('user_id', flat=True).distinct()
+    )
+
+
+def claim_next(now=None):
+    """Nhận job đang chờ (hoặc job bị gián đoạn đã hết hạn giữ) cũ nhất, trả về None nếu không có."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        job = (
+            NotificationFanout.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending') | Q(status='running', locked_until__lt=now))
+            .select_related('notification').order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        if job.total is None:
+            job.total = _ticket_owners(job.notification.event_id).count()
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_until = now + FANOUT_LEASE
+        job.save(update_fields=['status', 'attempts', 'locked_until', 'total', 'updated_at'])
+    return job
+
+
+def run(job, batch_size=FANOUT_BATCH_SIZE, progress=None):
+    """Chèn UserNotification cho những người có vé còn lại của job; gọi `progress(job)` sau mỗi lô."""
+    owners = _ticket_owners(job.notification.event_id, after=job.last_user_id).iterator(chunk_size=batch_size)
+    for user_ids in _batched(owners, batch_size):
+        with transaction.atomic():
+            # bulk_create(ignore_conflicts=True) không cho biết số dòng đã chèn: bỏ trước những người
+            # đã có UserNotification để `delivered` chỉ đếm dòng chèn thật
+            existing = set(
+                UserNotification.objects.filter(notification_id=job.notification_id, user_id__in=user_ids)
+                .values_list('user_id', flat=True)
+            )
+            new_user_ids = [user_id for user_id in user_ids if user_id not in existing]
+            UserNotification.objects.bulk_create(
+                [UserNotification(user_id=user_id, notification_id=job.notification_id) for user_id in new_user_ids],
+                ignore_conflicts=True,
+            )
+            job.last_user_id = user_ids[-1]
+            job.delivered += len(new_user_ids)
+            job.locked_until = timezone.now() + FANOUT_LEASE
+            job.save(update_fields=['last_user_id', 'delivered', 'locked_until', 'updated_at'])
+        if progress:
+            progress(job)
+    job.status = 'done'
+    job.locked_until = None
+    job.save(update_fields=['status', 'locked_until', 'updated_at'])
+    return job
+
+
+def run_pending(batch_size=FANOUT_BATCH_SIZE, max_jobs=None, progress=None):
+    """Chạy lần lượt các job đang chờ, trả về số job đã hoàn tất."""
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = claim_next()
+        if job is None:
+            break
+        run(job, batch_size=batch_size, progress=progress)
+        done += 1
+    return done
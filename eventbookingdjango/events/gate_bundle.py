@@ -0,0 +1,97 @@
+# Gói dữ liệu soát vé offline cho máy tại cổng (GET /events/{id}/gate-bundle/?since=<version>).
+#
+# Định dạng nhị phân: header 21 byte (magic b'TKB1', loại gói, event_id, version) rồi các bản ghi
+# 17 byte: uuid (16 byte) + trạng thái (1 byte).
+#   - Gói đầy đủ (không có `since`): mọi vé đã thanh toán, sắp xếp theo uuid để tìm nhị phân.
+#   - Gói delta (`since` = version của lần đồng bộ trước): vé thay đổi sau thời điểm đó (check-in,
+#     hủy thanh toán...) và vé đã thanh toán bị xóa (TicketTombstone), trạng thái REVOKED. Chỉ gồm vé
+#     đang hoặc đã từng được thanh toán (purchase_date): vé giữ chỗ chưa từng có trên máy soát vé.
+#     `since` cũ hơn GATE_BUNDLE_DELTA_MAX_AGE_DAYS nhận gói đầy đủ; TicketTombstone cũ hơn mốc đó được
+#     xóa bởi lệnh `python manage.py expire_stale_records` (events.expiry).
+# Version là thời điểm (micro giây) lùi lại GATE_BUNDLE_SYNC_LAG_SECONDS để không bỏ sót transaction
+# commit trễ; bản ghi có thể lặp lại giữa hai lần đồng bộ nhưng áp dụng lại không sao.
+import struct
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Ticket, TicketTombstone
+
+MAGIC = b'TKB1'
+HEADER = struct.Struct('>4sBQQ')  # magic, loại gói, event_id, version
+RECORD_SIZE = 17
+KIND_FULL, KIND_DELTA = 0, 1
+STATUS_VALID, STATUS_CHECKED_IN, STATUS_REVOKED = 0, 1, 2
+
+CHUNK_SIZE = getattr(settings, 'GATE_BUNDLE_CHUNK_SIZE', 2000)
+SYNC_LAG = timedelta(seconds=getattr(settings, 'GATE_BUNDLE_SYNC_LAG_SECONDS', 5))
+DELTA_MAX_AGE = timedelta(days=getattr(settings, 'GATE_BUNDLE_DELTA_MAX_AGE_DAYS', 7))
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def to_version(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_version(version):
+    return EPOCH + timedelta(microseconds=int(version))
+
+
+def _ticket_status(is_paid, is_checked_in):
+    if not is_paid:
+        return STATUS_REVOKED
+    return STATUS_CHECKED_IN if is_checked_in else STATUS_VALID
+
+
+def _chunked(records):
+    """Gom bản ghi thành từng khối CHUNK_SIZE để StreamingHttpResponse không phải gửi từng 17 byte."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+
+
+def iter_bundle(event_id, since=None, now=None):
+    """Sinh gói dữ liệu theo từng khối bytes; đọc DB bằng .iterator() nên không nạp hết vé vào bộ nhớ."""
+    now = now or timezone.now()
+    version = to_version(now - SYNC_LAG)
+    if since is not None and from_version(since) < now - DELTA_MAX_AGE:
+        # Tombstone cũ hơn DELTA_MAX_AGE có thể đã bị xóa: gửi gói đầy đủ
+        since = None
+    yield HEADER.pack(MAGIC, KIND_FULL if since is None else KIND_DELTA, event_id, version)
+
+    tickets = Ticket.objects.filter(event_id=event_id)
+    if since is None:
+        tickets = tickets.filter(is_paid=True)
+    else:
+        tickets = tickets.filter(updated_at__gt=from_version(since)).filter(
+            Q(is_paid=True) | Q(purchase_date__isnull=False)
+        )
+    rows = tickets.order_by('uuid').values_list('uuid', 'is_paid', 'is_checked_in').iterator(chunk_size=CHUNK_SIZE)
+    yield from _chunked(uuid.bytes + bytes((_ticket_status(is_paid, is_checked_in),))
+                        for uuid, is_paid, is_checked_in in rows)
+
+    if since is not None:
+        deleted = (
+            TicketTombstone.objects.filter(event_id=event_id, deleted_at__gt=from_version(since))
+            .order_by('uuid').values_list('uuid', flat=True).iterator(chunk_size=CHUNK_SIZE)
+        )
+        yield from _chunked(uuid.bytes + bytes((STATUS_REVOKED,)) for uuid in deleted)
+
+
+def read_bundle(data):
+    """Đọc gói dữ liệu (phía máy soát vé), trả về (loại gói, event_id, version, {uuid bytes: trạng thái})."""
+    magic, kind, event_id, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Gói dữ liệu không hợp lệ.")
+    records = {
+        data[offset:offset + 16]: data[offset + 16]
+        for offset in range(HEADER.size, len(data), RECORD_SIZE)
+    }
+    return kind, event_id, version, records
@@ -0,0 +1,104 @@
+# Nhận check-in theo lô từ máy soát vé (POST /tickets/bulk-check-in/).
+#
+# Máy soát vé gom các lượt quét và gửi mỗi giây. Cả lô được ghi bằng một câu UPDATE có điều kiện
+# (is_checked_in=False), thời điểm quét và máy quét của từng vé lấy qua CASE, rồi một SELECT để biết
+# kết quả từng vé. Gửi lại một lô đã gửi cho kết quả y hệt: vé được ghi nhận bởi đúng lượt quét đó
+# vẫn là 'accepted', không bị tính là trùng.
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Case, CharField, DateTimeField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Ticket
+
+# Số lượt quét tối đa trong một lô
+MAX_SCANS_PER_BATCH = getattr(settings, 'MAX_SCANS_PER_BATCH', 500)
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+
+def parse_scans(data):
+    """
+    Chuẩn hóa {"scans": [{"uuid": ..., "scanned_at": ISO 8601, "device_id": ...}, ...]}
+    thành danh sách (uuid gốc, UUID hoặc None nếu sai định dạng, scanned_at, device_id).
+    scanned_at thiếu hoặc sai được để None (lượt quét đó là 'invalid'), không thay bằng giờ server:
+    gửi lại cùng một lô luôn cho cùng dữ liệu.
+    """
+    scans = data.get('scans')
+    if not isinstance(scans, list) or not scans:
+        raise ValidationError("Danh sách lượt quét không hợp lệ.")
+    if len(scans) > MAX_SCANS_PER_BATCH:
+        raise ValidationError(f"Chỉ được gửi tối đa {MAX_SCANS_PER_BATCH} lượt quét mỗi lần.")
+
+    parsed = []
+    for scan in scans:
+        if not isinstance(scan, dict):
+            raise ValidationError("Lượt quét phải là object.")
+        raw_uuid = scan.get('uuid')
+        try:
+            ticket_uuid = uuid.UUID(str(raw_uuid))
+        except ValueError:
+            ticket_uuid = None
+        try:
+            # ValueError: đúng định dạng nhưng không phải ngày giờ có thật (vd. 2025-02-30T10:00:00)
+            scanned_at = parse_datetime(str(scan.get('scanned_at') or ''))
+        except ValueError:
+            scanned_at = None
+        if scanned_at is not None and timezone.is_naive(scanned_at):
+            scanned_at = timezone.make_aware(scanned_at)
+        parsed.append((raw_uuid, ticket_uuid, scanned_at, str(scan.get('device_id') or '')[:64]))
+    return parsed
+
+
+def bulk_check_in(scans, event_id=None):
+    """
+    Ghi nhận các lượt quét từ parse_scans, trả về danh sách
+    {'uuid', 'result': accepted|duplicate|invalid, 'checked_in_at', 'device_id'} theo thứ tự gửi lên.
+    Mỗi vé lấy lượt quét sớm nhất trong lô. Luôn đúng hai truy vấn, bất kể số lượt quét.
+    """
+    first_scan = {}
+    for _, ticket_uuid, scanned_at, device_id in scans:
+        if ticket_uuid and scanned_at and (ticket_uuid not in first_scan or scanned_at < first_scan[ticket_uuid][0]):
+            first_scan[ticket_uuid] = (scanned_at, device_id)
+
+    tickets = Ticket.objects.filter(uuid__in=first_scan, is_paid=True)
+    if event_id is not None:
+        tickets = tickets.filter(event_id=event_id)
+
+    if first_scan:
+        tickets.filter(is_checked_in=False).update(
+            is_checked_in=True,
+            check_in_date=Case(
+                *[When(uuid=key, then=Value(at)) for key, (at, _) in first_scan.items()],
+                output_field=DateTimeField(),
+            ),
+            check_in_device=Case(
+                *[When(uuid=key, then=Value(device)) for key, (_, device) in first_scan.items()],
+                output_field=CharField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    current = {
+        ticket_uuid: (checked_in_at, device_id)
+        for ticket_uuid, checked_in_at, device_id in tickets.values_list('uuid', 'check_in_date', 'check_in_device')
+    }
+
+    results = []
+    for raw_uuid, ticket_uuid, scanned_at, device_id in scans:
+        if scanned_at is None or ticket_uuid not in current:
+            results.append({'uuid': raw_uuid, 'result': INVALID})
+            continue
+        checked_in_at, checked_in_device = current[ticket_uuid]
+        accepted = (scanned_at, device_id) == first_scan[ticket_uuid] == (checked_in_at, checked_in_device)
+        results.append({
+            'uuid': raw_uuid,
+            'result': ACCEPTED if accepted else DUPLICATE,
+            'checked_in_at': checked_in_at,
+            'device_id': checked_in_device,
+        })
+    return results
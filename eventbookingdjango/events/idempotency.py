@@ -0,0 +1,100 @@
+# Hỗ trợ header Idempotency-Key cho các action ghi dữ liệu (đặt vé, tạo/xác nhận thanh toán).
+#
+# Lần đầu: lưu key cùng dấu vân tay của request, chạy view rồi lưu lại response. Client gửi lại
+# cùng key (mạng chập chờn, tự retry) thì nhận lại đúng response đó sau một truy vấn theo unique
+# index, không giữ chỗ, tạo payment hay gửi mail thêm lần nào. Key hết hạn sau IDEMPOTENCY_KEY_TTL
+# và được dọn bằng lệnh `python manage.py purge_idempotency_keys`.
+# Record đang xử lý (status_code null) giữ khóa IDEMPOTENCY_LOCK_TIMEOUT tính từ created_at: worker chết
+# giữa chừng không kịp xóa record thì lần gửi lại sau thời hạn đó tiếp quản record thay vì nhận 409.
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 60))
+# Lỗi tạm thời: không lưu, client gửi lại sẽ được xử lý lại
+RETRYABLE_STATUS = {status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=JSONEncoder, default=str)
+    return hashlib.sha256(f'{request.method}:{request.path}:{body}'.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """Decorator cho action của ViewSet; request không có header Idempotency-Key chạy như bình thường."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return view(self, request, *args, **kwargs)
+            if len(key) > 255:
+                return Response({"error": f"{HEADER} quá dài."}, status=status.HTTP_400_BAD_REQUEST)
+
+            fingerprint = request_fingerprint(request)
+            now = timezone.now()
+            record = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).first()
+            if record is not None and record.expires_at <= now:
+                record.delete()
+                record = None
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    return Response({"error": f"{HEADER} đã được dùng cho một request khác."},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                if record.status_code is not None:
+                    return _replay(record)
+                # Tiếp quản record quá hạn khóa bằng UPDATE có điều kiện: chỉ một lần gửi lại thắng
+                if record.created_at > now - IDEMPOTENCY_LOCK_TIMEOUT or not IdempotencyKey.objects.filter(
+                    pk=record.pk, status_code__isnull=True, created_at=record.created_at
+                ).update(created_at=now):
+                    return Response({"error": "Request với key này đang được xử lý."}, status=status.HTTP_409_CONFLICT)
+            else:
+                try:
+                    with transaction.atomic():
+                        record = IdempotencyKey.objects.create(
+                            user=request.user, scope=scope, key=key, fingerprint=fingerprint,
+                            expires_at=now + IDEMPOTENCY_KEY_TTL,
+                        )
+                except IntegrityError:
+                    # Hai request cùng key đến cùng lúc: chỉ một request được xử lý
+                    return Response({"error": "Request với key này đang được xử lý."}, status=status.HTTP_409_CONFLICT)
+
+            try:
+                response = view(self, request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500 or response.status_code in RETRYABLE_STATUS:
+                record.delete()
+            else:
+                record.status_code = response.status_code
+                # Lưu đúng dạng JSON mà client đã nhận (datetime, Decimal, UUID... theo encoder của DRF)
+                record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                record.save(update_fields=['status_code', 'response'])
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_keys(now=None):
+    """Xóa các key đã hết hạn, trả về số key đã xóa."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
@@ -0,0 +1,85 @@
+# Hộp thông báo của người dùng: gộp thông báo riêng (UserNotification) và thông báo chung.
+#
+# Thông báo chung (Notification.is_broadcast) chỉ lưu một dòng, không tạo UserNotification cho từng
+# người dùng. Trạng thái đã đọc của người dùng với thông báo chung gồm:
+#   - mốc User.notifications_read_at: thông báo chung tạo trước mốc này coi như đã đọc;
+#   - UserNotification (is_read=True) cho từng thông báo chung được đánh dấu đọc riêng sau mốc.
+# Người dùng chỉ thấy thông báo chung tạo sau khi đăng ký, giống khi còn tạo một dòng cho mỗi người.
+#
+# Mọi danh sách thông báo (my-notifications, event-notifications, hồ sơ người dùng, chi tiết sự kiện)
+# đi qua with_read_state(): is_read, read_at và tên sự kiện được tính ngay trong truy vấn lấy trang
+# nên một trang thông báo chỉ tốn truy vấn COUNT và truy vấn lấy trang.
+from django.db import transaction
+from django.db.models import BooleanField, Case, DateTimeField, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from .models import Notification, UserNotification
+
+
+def _broadcast_filter(user):
+    return Q(is_broadcast=True, created_at__gte=user.created_at)
+
+
+def with_read_state(notifications, user):
+    """Thêm `is_read`, `read_at` của người dùng và `event_title` vào queryset thông báo."""
+    if user is None or not user.is_authenticated:
+        read, read_at = Value(False), Value(None, output_field=DateTimeField())
+    else:
+        read_rows = UserNotification.objects.filter(user=user, notification=OuterRef('pk'), is_read=True)
+        read, read_at = Exists(read_rows), Subquery(read_rows.values('read_at')[:1])
+        if user.notifications_read_at is not None:
+            # Thông báo chung dưới mốc đã đọc không cần tra UserNotification
+            below_mark = Q(is_broadcast=True, created_at__lte=user.notifications_read_at)
+            read = Case(When(below_mark, then=Value(True)), default=read, output_field=BooleanField())
+            read_at = Case(
+                When(below_mark, then=Value(user.notifications_read_at)), default=read_at, output_field=DateTimeField()
+            )
+    return notifications.annotate(is_read=read, read_at=read_at, event_title=F('event__title'))
+
+
+def user_notifications(user):
+    """Thông báo của người dùng (riêng và chung) kèm trạng thái đã đọc, mới nhất trước."""
+    targeted = UserNotification.objects.filter(user=user, notification__is_broadcast=False).values('notification')
+    return with_read_state(
+        Notification.objects.filter(Q(pk__in=targeted) | _broadcast_filter(user)), user
+    ).order_by('-created_at', '-pk')
+
+
+def event_notifications(event_id, user):
+    """Thông báo của một sự kiện kèm trạng thái đã đọc của người dùng (có thể chưa đăng nhập)."""
+    return with_read_state(Notification.objects.filter(event_id=event_id), user).order_by('id')
+
+
+def unread_count(user):
+    """Số thông báo chưa đọc: một COUNT cho thông báo riêng, một COUNT cho thông báo chung."""
+    targeted = UserNotification.objects.filter(user=user, is_read=False, notification__is_broadcast=False).count()
+    broadcasts = Notification.objects.filter(_broadcast_filter(user))
+    if user.notifications_read_at is not None:
+        broadcasts = broadcasts.filter(created_at__gt=user.notifications_read_at)
+    broadcasts = broadcasts.exclude(
+        Exists(UserNotification.objects.filter(user=user, notification=OuterRef('pk'), is_read=True))
+    ).count()
+    return targeted + broadcasts
+
+
+def mark_read(user, notification):
+    """Đánh dấu một thông báo đã đọc; thông báo chung đã nằm dưới mốc thì không cần ghi gì."""
+    if notification.is_broadcast and user.notifications_read_at and notification.created_at <= user.notifications_read_at:
+        return
+    UserNotification.objects.update_or_create(
+        user=user, notification=notification, defaults={'is_read': True, 'read_at': timezone.now()}
+    )
+
+
+def mark_all_read(user):
+    """Dời mốc đã đọc tới hiện tại, đánh dấu mọi thông báo riêng đã đọc và bỏ các dòng đọc riêng thừa."""
+    now = timezone.now()
+    with transaction.atomic():
+        user.notifications_read_at = now
+        user.save(update_fields=['notifications_read_at'])
+        UserNotification.objects.filter(user=user, is_read=False, notification__is_broadcast=False).update(
+            is_read=True, read_at=now
+        )
+        UserNotification.objects.filter(
+            user=user, notification__is_broadcast=True, notification__created_at__lte=now
+        ).delete()
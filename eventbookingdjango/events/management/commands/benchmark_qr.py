@@ -0,0 +1,29 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from events.qr import QR_DEFAULT_SIZE, render_qr
+
+
+# Đo tốc độ vẽ mã QR: python manage.py benchmark_qr --count 500 --format svg
+class Command(BaseCommand):
+    help = 'Đo số ảnh QR vẽ được mỗi giây (không cache và có cache).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='Số vé (uuid) khác nhau cần vẽ.')
+        parser.add_argument('--format', choices=['png', 'svg'], default='png')
+        parser.add_argument('--size', type=int, default=QR_DEFAULT_SIZE)
+
+    def handle(self, *args, **options):
+        codes = [str(uuid.uuid4()) for _ in range(options['count'])]
+        render_qr.cache_clear()
+        for label in ('Không cache', 'Có cache'):
+            started = time.perf_counter()
+            total_bytes = sum(len(render_qr(code, options['format'], options['size'])) for code in codes)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{label}: {len(codes) / elapsed:,.0f} ảnh/giây "
+                f"({elapsed * 1000 / len(codes):.3f} ms/ảnh, trung bình {total_bytes // len(codes)} bytes)"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Cache: {render_qr.cache_info()}"))
@@ -0,0 +1,44 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from events.models import EventTrendingLog
+from events.trending import compute_scores
+
+
+# So sánh tính điểm từng dòng (EventTrendingLog.compute_scores) và bằng NumPy:
+# python manage.py benchmark_trending --events 100000
+class Command(BaseCommand):
+    help = 'Đo tốc độ tính điểm trending cho nhiều sự kiện (không truy vấn DB).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=100000, help='Số sự kiện giả lập.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        n = options['events']
+        rng = np.random.default_rng(options['seed'])
+        total = rng.integers(0, 5000, n)
+        sold = (total * rng.random(n)).astype(np.int64)
+        reviews = rng.integers(0, 200, n)
+        recent_sales = rng.random(n) * 500
+        recent_views = rng.random(n) * 100000
+        recent_reviews = rng.random(n) * 50
+
+        started = time.perf_counter()
+        expected = [
+            EventTrendingLog.compute_scores(*row)
+            for row in zip(sold.tolist(), total.tolist(), reviews.tolist(),
+                           recent_sales.tolist(), recent_views.tolist(), recent_reviews.tolist())
+        ]
+        python_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        trending, interest = compute_scores(sold, total, reviews, recent_sales, recent_views, recent_reviews)
+        numpy_elapsed = time.perf_counter() - started
+
+        mismatches = int(np.sum(~np.isclose(trending, [e[0] for e in expected], atol=1e-4)))
+        self.stdout.write(f"Từng dòng (Python): {python_elapsed * 1000:.1f} ms")
+        self.stdout.write(f"NumPy:              {numpy_elapsed * 1000:.1f} ms ({python_elapsed / numpy_elapsed:.0f}x)")
+        self.stdout.write(self.style.SUCCESS(f"{n} sự kiện, {mismatches} kết quả lệch."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from events.activity import close_buckets, roll_up_buckets
+from events.trending import rescore_all
+
+
+# Chạy mỗi giờ bằng Cron Jobs (ngay sau khi sang giờ mới): python manage.py close_activity_buckets
+class Command(BaseCommand):
+    help = 'Đóng các bucket hoạt động đã qua giờ, tính lại điểm trending và gộp bucket cũ.'
+
+    def handle(self, *args, **options):
+        event_ids = close_buckets()
+        rescored = rescore_all(event_ids) if event_ids else 0
+        rolled_up, expired = roll_up_buckets()
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã đóng bucket của {len(event_ids)} sự kiện, tính lại điểm {rescored} sự kiện, "
+            f"gộp {rolled_up} bucket giờ, xóa {expired} bucket ngày."
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from events.expiry import EXPIRY_CHUNK_SIZE, expire_discount_codes, expire_events, expire_tombstones
+
+
+# Chạy định kỳ bằng Cron Jobs, ví dụ mỗi 5 phút: python manage.py expire_stale_records
+class Command(BaseCommand):
+    help = 'Tắt các sự kiện đã kết thúc và mã giảm giá hết hạn hoặc hết lượt dùng, xóa tombstone vé quá cũ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=EXPIRY_CHUNK_SIZE, help='Số dòng mỗi câu UPDATE.')
+
+    def handle(self, *args, **options):
+        events = expire_events(chunk_size=options['chunk_size'])
+        codes = expire_discount_codes(chunk_size=options['chunk_size'])
+        tombstones = expire_tombstones(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã tắt {events} sự kiện và {codes} mã giảm giá, xóa {tombstones} tombstone vé."
+        ))
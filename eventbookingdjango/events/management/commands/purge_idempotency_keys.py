@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from events.idempotency import purge_expired_keys
+
+
+# Chạy định kỳ bằng Cron Jobs, ví dụ mỗi giờ: python manage.py purge_idempotency_keys
+class Command(BaseCommand):
+    help = 'Xóa các Idempotency-Key đã hết hạn.'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Đã xóa {deleted} Idempotency-Key hết hạn."))
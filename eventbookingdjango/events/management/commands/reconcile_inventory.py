@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from events.counters import get_counter
+
+
+# Chạy định kỳ bằng Cron Jobs khi dùng ShardedCounter hoặc RedisCounter
+class Command(BaseCommand):
+    help = 'Gộp bộ đếm tồn kho (shard/Redis) về Event.sold_tickets và Event.reserved_tickets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='event_ids',
+                            help='Chỉ xử lý sự kiện này (có thể lặp lại).')
+
+    def handle(self, *args, **options):
+        updated = get_counter().reconcile(options['event_ids'])
+        self.stdout.write(self.style.SUCCESS(f"Đã đồng bộ bộ đếm cho {updated} sự kiện."))
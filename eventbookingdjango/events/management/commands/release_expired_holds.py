@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from events.booking import release_expired_holds
+
+
+# Chạy định kỳ bằng Cron Jobs, ví dụ mỗi phút: python manage.py release_expired_holds
+class Command(BaseCommand):
+    help = 'Hủy các vé giữ chỗ đã hết hạn thanh toán và trả lại chỗ cho sự kiện.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Số vé xử lý trong mỗi lô.')
+
+    def handle(self, *args, **options):
+        released = release_expired_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Đã hủy {released} vé giữ chỗ hết hạn."))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from events.trending import RESCORE_CHUNK_SIZE, rescore_all
+
+
+# Chạy định kỳ bằng Cron Jobs, ví dụ mỗi giờ: python manage.py rescore_trending
+class Command(BaseCommand):
+    help = 'Tính lại điểm trending/interest cho mọi sự kiện đang hoạt động.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events', help='Chỉ tính cho sự kiện này (lặp lại được).')
+        parser.add_argument('--chunk-size', type=int, default=RESCORE_CHUNK_SIZE, help='Số dòng mỗi câu bulk_update.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rescore_all(options['events'], chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Đã tính lại điểm cho {count} sự kiện trong {elapsed:.2f} giây."))
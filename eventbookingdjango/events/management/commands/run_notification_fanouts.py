@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from events.event_updates import flush_due
+from events.fanout import FANOUT_BATCH_SIZE, run_pending
+
+
+# Chạy định kỳ bằng Cron Jobs, ví dụ mỗi phút: python manage.py run_notification_fanouts
+class Command(BaseCommand):
+    help = 'Tạo thông báo cập nhật sự kiện đã hết khoảng lặng và gửi các thông báo đang chờ theo từng lô.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=FANOUT_BATCH_SIZE, help='Số UserNotification mỗi lô.')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Số thông báo tối đa xử lý trong lần chạy.')
+
+    def handle(self, *args, **options):
+        flushed = flush_due()
+        if flushed:
+            self.stdout.write(f"Đã tạo {flushed} thông báo cập nhật sự kiện.")
+
+        def progress(job):
+            self.stdout.write(f"Thông báo {job.notification_id}: {job.delivered}/{job.total}")
+
+        done = run_pending(batch_size=options['batch_size'], max_jobs=options['max_jobs'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Đã gửi xong {done} thông báo."))
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:01
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notification',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.AlterModelOptions(
+            name='ticket',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.RemoveField(
+            model_name='eventtrendinglog',
+            name='id',
+        ),
+        migrations.RemoveField(
+            model_name='payment',
+            name='tickets',
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='is_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='parent_review',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='events.review'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tickets', to='events.payment'),
+        ),
+        migrations.AlterField(
+            model_name='eventtrendinglog',
+            name='event',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_log', serialize=False, to='events.event'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['parent_review'], name='events_revi_parent__43c311_idx'),
+        ),
+    ]
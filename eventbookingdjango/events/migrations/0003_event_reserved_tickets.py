@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:01
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_ticket_counters(apps, schema_editor):
+    # Đồng bộ lại bộ đếm từ bảng vé: vé đã thanh toán -> sold, chưa thanh toán -> reserved
+    Event = apps.get_model('events', 'Event')
+    counts = Event.objects.annotate(
+        paid=Count('tickets', filter=Q(tickets__is_paid=True)),
+        unpaid=Count('tickets', filter=Q(tickets__is_paid=False)),
+    ).values_list('pk', 'paid', 'unpaid')
+    for pk, paid, unpaid in counts.iterator():
+        Event.objects.filter(pk=pk).update(sold_tickets=paid, reserved_tickets=unpaid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0002_sync_model_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='reserved_tickets',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(backfill_ticket_counters, migrations.RunPython.noop),
+    ]
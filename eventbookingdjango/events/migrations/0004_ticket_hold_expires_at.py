@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:04
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_legacy_holds(apps, schema_editor):
+    # Vé chưa thanh toán có từ trước (chưa gắn payment) được giữ thêm một TTL rồi mới bị dọn
+    Ticket = apps.get_model('events', 'Ticket')
+    Ticket.objects.filter(is_paid=False, payment__isnull=True).update(
+        hold_expires_at=timezone.now() + timedelta(minutes=getattr(settings, 'TICKET_HOLD_TTL_MINUTES', 15))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_reserved_tickets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['is_paid', 'hold_expires_at'], name='events_tick_is_paid_1a14f8_idx'),
+        ),
+        migrations.RunPython(set_legacy_holds, migrations.RunPython.noop),
+    ]
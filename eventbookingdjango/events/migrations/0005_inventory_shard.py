@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_ticket_hold_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('capacity', models.IntegerField(default=0)),
+                ('reserved', models.IntegerField(default=0)),
+                ('sold', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_shards', to='events.event')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('event', 'shard'), name='unique_inventory_shard')],
+            },
+        ),
+    ]
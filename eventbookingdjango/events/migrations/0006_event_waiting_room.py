@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_inventory_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='admit_rate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='waiting_room_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
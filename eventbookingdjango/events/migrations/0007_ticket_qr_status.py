@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    # Vé cũ đã có ảnh QR upload sẵn trong lúc đặt vé
+    Ticket = apps.get_model('events', 'Ticket')
+    Ticket.objects.exclude(qr_code__isnull=True).exclude(qr_code='').update(qr_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_event_waiting_room'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='qr_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='qr_next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='qr_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['qr_status', 'qr_next_attempt_at'], name='events_tick_qr_stat_28afb7_idx'),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0007_ticket_qr_status'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='events_tick_qr_code_18e351_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='events_tick_qr_stat_28afb7_idx',
+        ),
+        migrations.RemoveField(
+            model_name='ticket',
+            name='qr_attempts',
+        ),
+        migrations.RemoveField(
+            model_name='ticket',
+            name='qr_code',
+        ),
+        migrations.RemoveField(
+            model_name='ticket',
+            name='qr_next_attempt_at',
+        ),
+        migrations.RemoveField(
+            model_name='ticket',
+            name='qr_status',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0009_ticket_gate_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='check_in_device',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0011_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventtrendinglog',
+            name='decayed_through',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eventtrendinglog',
+            name='recent_reviews',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='eventtrendinglog',
+            name='recent_sales',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='eventtrendinglog',
+            name='recent_views',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EventActivityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('span', models.PositiveSmallIntegerField(choices=[(1, 'Giờ'), (24, 'Ngày')], default=1)),
+                ('start', models.DateTimeField()),
+                ('sales', models.PositiveIntegerField(default=0)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('reviews', models.PositiveIntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_buckets', to='events.event')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['span', 'start'], name='events_even_span_59b388_idx')],
+                'constraints': [models.UniqueConstraint(fields=('event', 'span', 'start'), name='unique_activity_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:44
+
+from django.db import migrations, models
+
+
+def convert_broadcasts(apps, schema_editor):
+    # Thông báo không gắn sự kiện trở thành thông báo chung; dòng UserNotification chưa đọc của chúng
+    # không còn cần, dòng đã đọc được giữ làm trạng thái đọc riêng
+    Notification = apps.get_model('events', 'Notification')
+    UserNotification = apps.get_model('events', 'UserNotification')
+    Notification.objects.filter(event__isnull=True).update(is_broadcast=True)
+    UserNotification.objects.filter(notification__is_broadcast=True, is_read=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0012_event_activity_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='is_broadcast',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='notifications_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['is_broadcast', 'created_at'], name='events_noti_is_broa_bd948b_idx'),
+        ),
+        migrations.RunPython(convert_broadcasts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:48
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_notification_fanout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingEventUpdate',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pending_update', serialize=False, to='events.event')),
+                ('original_values', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('first_changed_at', models.DateTimeField()),
+                ('last_changed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
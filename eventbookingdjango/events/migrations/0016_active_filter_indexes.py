@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0015_pending_event_update'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discountcode',
+            index=models.Index(fields=['is_active', 'valid_to'], name='events_disc_is_acti_134e4a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['is_active', 'start_time'], name='events_even_is_acti_e01993_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['is_active', 'end_time'], name='events_even_is_acti_29a81a_idx'),
+        ),
+    ]
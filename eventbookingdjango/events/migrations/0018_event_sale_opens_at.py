@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0017_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='sale_opens_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
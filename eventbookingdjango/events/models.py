@@ -1,17 +1,53 @@
+from collections import Counter
 from datetime import timedelta
 from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.conf import settings
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from cloudinary.models import CloudinaryField
 import uuid
 from decimal import Decimal
 
-# pip install qrcode[pil]
-import qrcode
-from io import BytesIO
-from django.core.files.base import ContentFile
+
+# Ghi nhớ giá trị các trường lúc nạp từ DB (hoặc lúc lưu gần nhất) để biết trường nào đã thay đổi
+# mà không phải truy vấn lại bản ghi cũ. Signal post_save vẫn thấy giá trị trước khi lưu.
+class TrackChangesMixin:
+    _loaded_values = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _snapshot(self, fields=None):
+        # Trường bị defer (chưa nạp) không được ghi nhớ, coi như không thay đổi
+        values = {
+            f.name: self.__dict__[f.attname] for f in self._meta.concrete_fields
+            if f.attname in self.__dict__ and (fields is None or f.name in fields or f.attname in fields)
+        }
+        self._loaded_values = {**self._loaded_values, **values} if fields is not None else values
+
+    @property
+    def changed_fields(self):
+        """Tên các trường đã đổi so với giá trị đã nạp; instance chưa lưu thì trả về tập rỗng."""
+        return {
+            f.name for f in self._meta.concrete_fields
+            if f.name in self._loaded_values and self._loaded_values[f.name] != self.__dict__.get(f.attname)
+        }
+
+    def previous_value(self, field):
+        """Giá trị của trường lúc nạp từ DB (hoặc lúc lưu gần nhất), None nếu chưa có."""
+        return self._loaded_values.get(field)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
 
 
 # Quản lý người dùng tùy chỉnh
@@ -64,6 +100,8 @@ class User(AbstractBaseUser):
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Mốc đã đọc của thông báo chung: thông báo chung tạo trước mốc này coi như đã đọc (events.inbox)
+    notifications_read_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     objects = UserManager()
@@ -104,9 +142,51 @@ class EventQuerySet(models.QuerySet):
     def active(self):
         return self.filter(is_active=True, end_time__gte=timezone.now())
 
+    def on_sale(self):
+        """Sự kiện đang mở bán: còn hoạt động, chưa bắt đầu và đã qua giờ mở bán (nếu có)."""
+        now = timezone.now()
+        return self.filter(is_active=True, start_time__gte=now).filter(
+            models.Q(sale_opens_at__isnull=True) | models.Q(sale_opens_at__lte=now)
+        )
+
+    # Các thao tác tồn kho vé: mỗi thao tác là MỘT câu UPDATE có điều kiện trên dòng Event,
+    # database tự khóa dòng nên nhiều worker chạy song song cũng không thể bán vượt số vé.
+    def reserve_tickets(self, event_id, quantity=1):
+        """Giữ chỗ `quantity` vé, trả về True nếu còn đủ vé (sold + reserved + quantity <= total)."""
+        return self.filter(
+            pk=event_id,
+            total_tickets__gte=F('sold_tickets') + F('reserved_tickets') + quantity,
+        ).update(reserved_tickets=F('reserved_tickets') + quantity) == 1
+
+    def release_tickets(self, event_id, quantity=1):
+        """Trả lại chỗ đã giữ (vé chưa thanh toán bị hủy/xóa)."""
+        return self.filter(pk=event_id).update(
+            reserved_tickets=Greatest(F('reserved_tickets') - quantity, 0),
+        )
+
+    def commit_tickets(self, event_id, quantity=1):
+        """Chuyển chỗ đã giữ thành vé đã bán (vé được thanh toán)."""
+        return self.filter(pk=event_id).update(
+            reserved_tickets=Greatest(F('reserved_tickets') - quantity, 0),
+            sold_tickets=F('sold_tickets') + quantity,
+        )
+
+    def uncommit_tickets(self, event_id, quantity=1):
+        """Chuyển vé đã bán về trạng thái giữ chỗ (vé bị hủy thanh toán nhưng vẫn còn)."""
+        return self.filter(pk=event_id).update(
+            sold_tickets=Greatest(F('sold_tickets') - quantity, 0),
+            reserved_tickets=F('reserved_tickets') + quantity,
+        )
+
+    def remove_sold_tickets(self, event_id, quantity=1):
+        """Giảm số vé đã bán khi vé đã thanh toán bị xóa."""
+        return self.filter(pk=event_id).update(
+            sold_tickets=Greatest(F('sold_tickets') - quantity, 0),
+        )
+
 
 # Sự kiện
-class Event(models.Model):
+class Event(TrackChangesMixin, models.Model):
     CATEGORY_CHOICES = (
         ('music', 'Music'),
         ('sports', 'Sports'),
@@ -134,6 +214,14 @@ class Event(models.Model):
     total_tickets = models.IntegerField(validators=[MinValueValidator(0)])
     ticket_price = models.DecimalField(max_digits=9, decimal_places=2, validators=[MinValueValidator(Decimal('0.00'))])
     sold_tickets = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Số vé đang được giữ chỗ (đã đặt nhưng chưa thanh toán)
+    reserved_tickets = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+
+    # Phòng chờ cho sự kiện mở bán lớn: chỉ người đã đến lượt trong hàng đợi mới được đặt vé
+    waiting_room_enabled = models.BooleanField(default=False)
+    admit_rate = models.PositiveIntegerField(null=True, blank=True)  # người/giây, mặc định theo settings
+    # Giờ mở bán: trước mốc này không đặt được vé, phòng chờ cho vào cửa tính từ mốc này
+    sale_opens_at = models.DateTimeField(null=True, blank=True)
 
     tags = models.ManyToManyField('Tag', blank=True, related_name='events')
 
@@ -144,6 +232,10 @@ class Event(models.Model):
 
     objects = EventQuerySet.as_manager()
 
+    # Các bộ đếm chỉ được cập nhật bằng UPDATE nguyên tử (xem EventQuerySet),
+    # không ghi đè từ instance trong bộ nhớ vì giá trị đó có thể đã cũ.
+    COUNTER_FIELDS = ('sold_tickets', 'reserved_tickets')
+
     class Meta:
         constraints = [
             models.CheckConstraint(
@@ -154,6 +246,9 @@ class Event(models.Model):
         indexes = [
             models.Index(fields=['start_time', 'end_time']),
             models.Index(fields=['organizer']),
+            # Lọc is_active cho danh sách sự kiện và quét sự kiện hết hạn (events.expiry)
+            models.Index(fields=['is_active', 'start_time']),
+            models.Index(fields=['is_active', 'end_time']),
         ]
 
     def __str__(self):
@@ -167,6 +262,11 @@ class Event(models.Model):
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     #chuyển sang signals.py update_event_status
@@ -183,26 +283,70 @@ class Tag(models.Model):
         return self.name
 
 
+# Một phần tồn kho vé của sự kiện (dùng bởi events.counters.ShardedCounter).
+# Mỗi shard tự giữ capacity riêng để lượt đặt vé chỉ khóa một dòng thay vì dòng Event.
+class InventoryShard(models.Model):
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField()
+    capacity = models.IntegerField(default=0)
+    reserved = models.IntegerField(default=0)
+    sold = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'shard'], name='unique_inventory_shard'),
+        ]
+
+    def __str__(self):
+        return f"Shard {self.shard} - Sự kiện {self.event_id}"
+
+
+# Thời gian giữ chỗ cho vé chưa thanh toán
+TICKET_HOLD_TTL = timedelta(minutes=getattr(settings, 'TICKET_HOLD_TTL_MINUTES', 15))
+
+
+class TicketQuerySet(models.QuerySet):
+    def held(self):
+        """Vé chưa thanh toán mà chỗ giữ vẫn còn hiệu lực."""
+        return self.filter(is_paid=False).filter(
+            models.Q(hold_expires_at__isnull=True) | models.Q(hold_expires_at__gt=timezone.now())
+        )
+
+    def expired_holds(self, now=None):
+        """
+        Vé chưa thanh toán đã hết hạn giữ chỗ (dùng index is_paid, hold_expires_at).
+        Bỏ qua vé đã gắn với Payment đang chờ xác nhận để confirm_payment không ra thanh toán rỗng.
+        """
+        return self.filter(is_paid=False, hold_expires_at__lte=now or timezone.now(), payment__isnull=True)
+
+
 # Vé
-class Ticket(models.Model):
+class Ticket(TrackChangesMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tickets')
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='tickets')
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    qr_code = CloudinaryField('qr_code', null=True, blank=True)  # Lưu QR code
-
     created_at = models.DateTimeField(auto_now_add=True)
     is_paid = models.BooleanField(default=False)
     purchase_date = models.DateTimeField(null=True, blank=True)
+    # Hết thời hạn này mà chưa thanh toán thì vé bị hủy và trả lại chỗ (release_expired_holds)
+    hold_expires_at = models.DateTimeField(null=True, blank=True)
 
     is_checked_in = models.BooleanField(default=False)
     check_in_date = models.DateTimeField(null=True, blank=True)
+    check_in_device = models.CharField(max_length=64, blank=True)  # Máy soát vé đã check-in
     payment=models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True, blank=True,
                              related_name='tickets')
+    # Phiên bản cho đồng bộ máy soát vé (events.gate_bundle); các lệnh .update() phải tự gán
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TicketQuerySet.as_manager()
 
     class Meta:
         indexes = [
             models.Index(fields=['user', 'event']),
-            models.Index(fields=['qr_code']),
+            models.Index(fields=['is_paid', 'hold_expires_at']),
+            models.Index(fields=['event', 'updated_at']),
+            models.Index(fields=['user', 'created_at']),
         ]
         ordering = ['-created_at']
 
@@ -210,27 +354,59 @@ class Ticket(models.Model):
         return f"Vé của {self.user} - Sự kiện {self.event.title}"
 
     def save(self, *args, **kwargs):
+        from .counters import get_counter
+        counter = get_counter()
         with transaction.atomic():
             if not self.pk:  # Chỉ kiểm tra khi tạo mới
-                # Giả sử event có thuộc tính sold_tickets (tự tính hoặc trường riêng cập nhật)
-                if self.event.sold_tickets >= self.event.total_tickets:
+                # Giữ chỗ nguyên tử qua bộ đếm tồn kho, rollback cùng transaction nếu lưu vé lỗi
+                if not counter.reserve(self.event_id):
                     raise ValidationError("Hết vé cho sự kiện này.")
-            super().save(*args, **kwargs)
+                if not self.is_paid and self.hold_expires_at is None:
+                    self.hold_expires_at = timezone.now() + TICKET_HOLD_TTL
+                try:
+                    super().save(*args, **kwargs)
+                except Exception:
+                    # Bộ đếm nằm ngoài DB (Redis) không rollback cùng transaction
+                    counter.cancel_reservation(self.event_id)
+                    raise
+            else:
+                super().save(*args, **kwargs)
 
     def mark_as_paid(self, paid_at):
         self.is_paid = True
         self.purchase_date = paid_at
+        self.hold_expires_at = None
         self.save()
 
-    def check_in(self):
-        if not self.is_checked_in:
+    def check_in(self, device_id=''):
+        """Check-in bằng một câu UPDATE có điều kiện; trả về False nếu vé đã được check-in trước đó."""
+        now = timezone.now()
+        updated = Ticket.objects.filter(pk=self.pk, is_checked_in=False).update(
+            is_checked_in=True, check_in_date=now, check_in_device=device_id, updated_at=now
+        )
+        if updated:
             self.is_checked_in = True
-            self.check_in_date = timezone.now()
-            self.save()
+            self.check_in_date = now
+            self.check_in_device = device_id
+            self.updated_at = now
+        return bool(updated)
+
+
+# Vé đã thanh toán bị xóa: giữ lại uuid để máy soát vé biết vé không còn hiệu lực khi đồng bộ
+class TicketTombstone(models.Model):
+    # Không ràng buộc khóa ngoại: vé bị xóa theo sự kiện vẫn tạo bản ghi trước khi sự kiện bị xóa
+    event = models.ForeignKey(Event, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    uuid = models.UUIDField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['event', 'deleted_at']),
+        ]
 
 
 # Thanh toán
-class Payment(models.Model):
+class Payment(TrackChangesMixin, models.Model):
     PAYMENT_METHOD_CHOICES = (
         ('momo', 'MoMo'),
         ('vnpay', 'VNPay'),
@@ -253,31 +429,57 @@ class Payment(models.Model):
 
     def save(self, *args, **kwargs):
         with transaction.atomic():
-            if not self.pk:
-                # Respect the status set externally, default to False if not set
-                if self.status is None:
-                    self.status = False
-
-                if self.status and not self.paid_at:
-                    self.paid_at = timezone.now()
-
-                super().save(*args, **kwargs)  # Save before assigning tickets
-
-            else:
-                # Update payment if modified
-                if self.status and not self.paid_at:
-                    self.paid_at = timezone.now()
-                super().save(*args, **kwargs)
-
-            # Mark tickets as paid
-            for ticket in Ticket.objects.filter(payment=self):
-                if not ticket.is_paid:
-                    ticket.mark_as_paid(self.paid_at)
+            adding = self._state.adding
+            # Respect the status set externally, default to False if not set
+            if self.status is None:
+                self.status = False
+            if self.status and not self.paid_at:
+                self.paid_at = timezone.now()
+            super().save(*args, **kwargs)
 
-            # Update discount code usage count
-            if self.discount_code and self.discount_code.is_valid():
-                self.discount_code.used_count += 1
-                self.discount_code.save()
+            # Lượt dùng mã giảm giá được ghi nhận đúng một lần, khi tạo payment; mã vừa hết lượt/hết
+            # hạn (request khác dùng trước) thì rollback payment
+            if adding and self.discount_code_id and not self.use_discount_code():
+                raise ValidationError("Mã giảm giá đã hết lượt sử dụng hoặc hết hạn.")
+            if self.status:
+                self.settle()
+
+    def use_discount_code(self):
+        """
+        Tăng used_count của mã giảm giá bằng một UPDATE có điều kiện (chỉ khi mã còn hạn và còn lượt),
+        trả về True nếu đã ghi nhận.
+        """
+        now = timezone.now()
+        return bool(DiscountCode.objects.filter(
+            models.Q(max_uses__isnull=True) | models.Q(used_count__lt=F('max_uses')),
+            pk=self.discount_code_id, valid_from__lte=now, valid_to__gte=now,
+        ).update(
+            used_count=F('used_count') + 1,
+            is_active=models.Case(
+                models.When(max_uses__lte=F('used_count') + 1, then=models.Value(False)),
+                default=F('is_active'),
+            ),
+        ))
+
+    def settle(self):
+        """
+        Chốt thanh toán: đánh dấu mọi vé chưa thanh toán của payment là đã thanh toán bằng một câu
+        UPDATE, số vé đã bán và doanh thu được cập nhật theo từng sự kiện khi transaction commit
+        (events.aggregation). Số truy vấn không phụ thuộc số vé.
+        """
+        from . import aggregation
+        with transaction.atomic():
+            tickets = list(
+                Ticket.objects.select_for_update().filter(payment=self, is_paid=False).values_list('pk', 'event_id')
+            )
+            if not tickets:
+                return
+            Ticket.objects.filter(pk__in=[pk for pk, _ in tickets]).update(
+                is_paid=True, purchase_date=self.paid_at, hold_expires_at=None, updated_at=timezone.now()
+            )
+            # Cập nhật hàng loạt không qua signal của Ticket nên ghi nhận trực tiếp theo sự kiện
+            for event_id, quantity in Counter(event_id for _, event_id in tickets).items():
+                aggregation.record(event_id, 'commit', quantity)
 
     def get_display_transaction_id(self):
         return f"****{self.transaction_id[-4:]}"  # Hiển thị 4 ký tự cuối để bảo mật
@@ -302,6 +504,7 @@ class Review(models.Model):
         indexes = [
             models.Index(fields=['event', 'user']),
             models.Index(fields=['parent_review']),
+            models.Index(fields=['event', 'created_at']),
         ]
 
     def __str__(self):
@@ -310,7 +513,7 @@ class Review(models.Model):
 
 
 # Mã giảm giá
-class DiscountCode(models.Model):
+class DiscountCode(TrackChangesMixin, models.Model):
     code = models.CharField(max_length=50, unique=True, db_index=True)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2,
                                               validators=[MinValueValidator(0), MaxValueValidator(100)])
@@ -334,6 +537,7 @@ class DiscountCode(models.Model):
         ]
         indexes = [
             models.Index(fields=['code', 'is_active']),
+            models.Index(fields=['is_active', 'valid_to']),
         ]
 
     def __str__(self):
@@ -357,13 +561,26 @@ class Notification(models.Model):
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES, default='reminder')
     title = models.CharField(max_length=255)
     message = models.TextField()
+    # Thông báo chung (không gắn sự kiện) gửi mọi người dùng: lưu một lần, không tạo UserNotification
+    # cho từng người; UserNotification chỉ có khi người dùng đánh dấu đã đọc riêng thông báo này
+    is_broadcast = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.title
-    
+
+    def save(self, *args, **kwargs):
+        if self.event_id is None:
+            self.is_broadcast = True
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_broadcast', 'created_at']),
+            models.Index(fields=['event', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
 
 # Chưa có cơ chế gửi thông báo real-time (cần tích hợp WebSocket hoặc Django Channels).
 # Để đánh dấu thông báo  đã được người dùng đọc hay chưa
@@ -379,6 +596,47 @@ class UserNotification(models.Model):
 
 
 
+# Gửi thông báo của sự kiện tới từng người có vé: chạy nền theo lô, lưu tiến độ để chạy tiếp sau
+# khi bị gián đoạn (events.fanout)
+class NotificationFanout(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    )
+
+    notification = models.OneToOneField(Notification, on_delete=models.CASCADE, related_name='fanout', primary_key=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    last_user_id = models.BigIntegerField(default=0)  # Đã tạo UserNotification cho mọi user_id <= giá trị này
+    delivered = models.PositiveIntegerField(default=0)  # Số UserNotification job đã chèn (không tính dòng có sẵn)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_id}: {self.delivered}/{self.total if self.total is not None else '?'} ({self.status})"
+
+
+# Thay đổi của sự kiện chờ gửi thông báo: các lần sửa liên tiếp được gộp thành một thông báo
+# sau khoảng lặng EVENT_UPDATE_QUIET_SECONDS (events.event_updates)
+class PendingEventUpdate(models.Model):
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, related_name='pending_update', primary_key=True)
+    # Giá trị trước lần sửa đầu tiên của từng trường đã đổi
+    original_values = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    first_changed_at = models.DateTimeField()
+    last_changed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.event_id}: {', '.join(self.original_values)}"
+
+
 # Tin nhắn trò chuyện
 class ChatMessage(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='chat_messages')
@@ -392,6 +650,9 @@ class ChatMessage(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['event', 'sender', 'receiver']),
+            models.Index(fields=['event', 'created_at']),
+            models.Index(fields=['sender', 'created_at']),
+            models.Index(fields=['receiver', 'created_at']),
         ]
 
     def save(self, *args, **kwargs):
@@ -403,7 +664,16 @@ class ChatMessage(models.Model):
 
 
 import math
-from datetime import date
+
+# Chu kỳ bán rã của hoạt động gần đây trong điểm trending: hoạt động cách đây TRENDING_HALF_LIFE chỉ
+# còn một nửa trọng số (events.activity)
+TRENDING_HALF_LIFE = timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24))
+
+
+def decay_factor(elapsed):
+    """Hệ số suy giảm theo hàm mũ sau khoảng thời gian `elapsed` (timedelta)."""
+    return 0.5 ** max(elapsed / TRENDING_HALF_LIFE, 0)
+
 
 class EventTrendingLog(models.Model):
     # EventTrendingLog dùng chung khóa chính với Event (tức là cùng một ID, kiểu như extension của bảng Event)
@@ -412,38 +682,47 @@ class EventTrendingLog(models.Model):
     total_revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     trending_score = models.DecimalField(max_digits=10, decimal_places=4, default=0)
     interest_score = models.DecimalField(max_digits=10, decimal_places=4, default=0)
+    # Tổng suy giảm theo thời gian của các bucket hoạt động đã đóng, tính tại thời điểm decayed_through
+    recent_sales = models.FloatField(default=0)
+    recent_views = models.FloatField(default=0)
+    recent_reviews = models.FloatField(default=0)
+    decayed_through = models.DateTimeField(null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
 
-    def calculate_score(self):
-        today = date.today()
-        sold_tickets = self.event.sold_tickets
-        total_tickets = self.event.total_tickets
-        review_count = self.event.reviews.count()
-        sales_start_date = self.event.created_at.date() if self.event.created_at else today
-
+    @staticmethod
+    def compute_scores(sold_tickets, total_tickets, review_count, recent_sales, recent_views, recent_reviews):
+        """Trả về (trending_score, interest_score) từ các chỉ số của sự kiện."""
         # Tỷ lệ vé đã bán
         sold_ratio = sold_tickets / total_tickets if total_tickets else 0
-        # Tốc độ bán
-        days_since_sales_start = (today - sales_start_date).days or 1
-        velocity = sold_tickets / days_since_sales_start
-        views = self.view_count
 
-        # Trending score
-        trending_score = (
+        # Trending score: hoạt động gần đây (vé bán, lượt xem, review) đã suy giảm theo thời gian
+        trending_score = round(
             (sold_ratio * 0.5) +
-            (velocity * 0.3) +
-            (math.log(views + 1) * 0.2)
+            (recent_sales * 0.3) +
+            (math.log(recent_views + 1) * 0.2) +
+            (recent_reviews * 0.1),
+            4
         )
-        self.trending_score = round(trending_score, 4)
 
         # Interest score – có thể điều chỉnh trọng số tùy mục tiêu
-        interest_score = (
-            (self.trending_score * 0.5) +
+        interest_score = round(
+            (trending_score * 0.5) +
             (sold_tickets * 0.3) +
-            (review_count * 0.2)
+            (review_count * 0.2),
+            4
         )
-        self.interest_score = round(interest_score, 4)
+        return trending_score, interest_score
+
+    def recent_activity(self, now=None):
+        """(recent_sales, recent_views, recent_reviews) suy giảm tiếp tới thời điểm `now`."""
+        factor = decay_factor((now or timezone.now()) - self.decayed_through) if self.decayed_through else 1
+        return self.recent_sales * factor, self.recent_views * factor, self.recent_reviews * factor
 
+    def calculate_score(self, now=None):
+        self.trending_score, self.interest_score = self.compute_scores(
+            self.event.sold_tickets, self.event.total_tickets, self.event.reviews.count(),
+            *self.recent_activity(now),
+        )
         self.save(update_fields=['trending_score', 'interest_score'])
 
 
@@ -452,3 +731,47 @@ class EventTrendingLog(models.Model):
             models.Index(fields=['event', 'last_updated']),
         ]
         ordering = ['-trending_score']
+
+
+# Hoạt động của sự kiện theo từng giờ (bucket giờ cũ được gộp thành bucket ngày, xem events.activity)
+class EventActivityBucket(models.Model):
+    HOURLY, DAILY = 1, 24
+    SPAN_CHOICES = (
+        (HOURLY, 'Giờ'),
+        (DAILY, 'Ngày'),
+    )
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='activity_buckets')
+    span = models.PositiveSmallIntegerField(choices=SPAN_CHOICES, default=HOURLY)  # độ dài bucket (giờ)
+    start = models.DateTimeField()
+    sales = models.PositiveIntegerField(default=0)
+    views = models.PositiveIntegerField(default=0)
+    reviews = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'span', 'start'], name='unique_activity_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['span', 'start']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} @ {self.start:%Y-%m-%d %H:00} ({self.get_span_display()})"
+
+
+# Idempotency-Key: lưu kết quả của request ghi dữ liệu để client gửi lại thì trả lại đúng kết quả cũ
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    scope = models.CharField(max_length=50)  # tên action, cùng một key dùng được cho các action khác nhau
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 của method, path và body
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null: request đang xử lý
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)  # request đang xử lý: mốc tính hạn khóa
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
@@ -1,8 +1,161 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_CACHE_TTL = getattr(settings, 'PAGINATION_COUNT_CACHE_TTL', 60)
+
+
+def estimated_count(queryset):
+    """
+    Số dòng ước lượng từ thống kê bảng của DB (MySQL information_schema.TABLES, PostgreSQL pg_class).
+    Chỉ dùng được cho queryset không lọc (cả bảng); trả về None nếu không ước lượng được.
+    """
+    if queryset.query.where:
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+def cached_count(queryset, ttl=COUNT_CACHE_TTL):
+    """COUNT(*) của queryset, lưu cache `ttl` giây theo câu SQL (mỗi bộ lọc một khóa)."""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    key = 'pagination-count:' + hashlib.md5(f'{queryset.db}:{sql}:{params}'.encode()).hexdigest()
+    return cache.get_or_set(key, queryset.count, ttl)
+
 
 class ItemPaginator(PageNumberPagination):
+    """
+    Phân trang theo ?page=. ViewSet chọn cách tính `count` bằng thuộc tính count_mode:
+      - 'exact' (mặc định): COUNT(*) mỗi trang như PageNumberPagination;
+      - 'none': không COUNT, lấy page_size + 1 dòng để biết còn trang sau (`has_next`), count = null;
+      - 'estimate': như 'none', count lấy từ thống kê bảng (estimated_count), không có thì như 'cached';
+      - 'cached': như 'none', count là COUNT(*) lưu cache PAGINATION_COUNT_CACHE_TTL giây (cached_count).
+    ?page=last tính trang cuối từ count nên chỉ dùng được khi có count; ở chế độ 'none' trả về 400.
+    """
     page_size = 8  # Mặc định 10 mục mỗi trang
     page_size_query_param = 'page_size'
     max_page_size = 100  # Kích thước trang tối đa có thể yêu cầu từ client
     page_query_param = 'page'  # Tên tham số truy vấn cho trang
-    last_page_strings = ['last']  # Tên chuỗi cho trang cuối cùng
\ No newline at end of file
+    last_page_strings = ['last']  # Tên chuỗi cho trang cuối cùng
+    count_mode = 'exact'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = getattr(view, 'count_mode', self.count_mode)
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.count = None
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            if self.count_mode == 'none':
+                raise ValidationError({self.page_query_param: "Không hỗ trợ trang cuối khi không đếm tổng số mục."})
+            self.count = self.get_count(queryset)
+            page_number = max(1, -(-self.count // page_size))
+        try:
+            self.page_number = int(page_number)
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound("Trang không hợp lệ.")
+        offset = (self.page_number - 1) * page_size
+        # Lấy dư một dòng để biết còn trang sau mà không cần COUNT(*)
+        rows = list(queryset[offset:offset + page_size + 1])
+        if self.page_number > 1 and not rows:
+            raise NotFound("Trang không hợp lệ.")
+        self.has_next = len(rows) > page_size
+        if self.count is None and self.count_mode != 'none':
+            self.count = self.get_count(queryset)
+        return rows[:page_size]
+
+    def get_count(self, queryset):
+        """count của chế độ 'estimate' / 'cached'."""
+        count = estimated_count(queryset) if self.count_mode == 'estimate' else None
+        return cached_count(queryset) if count is None else count
+
+    def get_next_link(self):
+        if self.count_mode == 'exact':
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.count_mode == 'exact':
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if self.count_mode == 'exact':
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'has_next': self.has_next,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+# Phân trang theo con trỏ (keyset): trang sau lọc `created_at < mốc của trang trước` trên index
+# (..., created_at) thay vì COUNT(*) + OFFSET, nên trang sâu cũng nhanh như trang đầu.
+class KeysetPaginator(CursorPagination):
+    page_size = ItemPaginator.page_size
+    page_size_query_param = 'page_size'
+    max_page_size = ItemPaginator.max_page_size
+    ordering = ('-created_at', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        # ViewSet có thể đổi thứ tự bằng thuộc tính cursor_ordering (cột đầu phải có index)
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+
+class ItemKeysetPaginator(ItemPaginator):
+    """
+    ItemPaginator cho các danh sách lớn, thêm dần (vé, tin nhắn, thông báo, review): mặc định vẫn
+    phân trang theo ?page=, gửi ?cursor= (để trống cho trang đầu) thì chuyển sang KeysetPaginator và
+    dùng link next/previous trong kết quả để đi tiếp.
+    """
+    cursor_query_param = KeysetPaginator.cursor_query_param
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPaginator()
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,50 @@
+# Vẽ mã QR của vé theo yêu cầu (GET /tickets/{id}/qr.png | qr.svg).
+#
+# Nội dung QR (uuid hoặc token đã ký, xem events.ticket_tokens) cùng định dạng và kích thước xác
+# định hoàn toàn ảnh: không cần lưu ảnh hay upload lên Cloudinary. Ảnh đã vẽ được giữ trong LRU
+# cache giới hạn QR_CACHE_SIZE phần tử, ETag (strong) tính từ chính các tham số đó nên trả 304 không
+# cần vẽ lại.
+import hashlib
+import io
+from functools import lru_cache
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+
+QR_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+QR_DEFAULT_SIZE = 300
+QR_MIN_SIZE = 64
+QR_MAX_SIZE = 1024
+QR_BORDER = 4
+# Tăng khi đổi cách vẽ để ETag cũ không còn khớp
+QR_RENDER_VERSION = 1
+
+
+def clamp_size(size):
+    """Chuẩn hóa kích thước (pixel) từ query string, giá trị sai thì dùng mặc định."""
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return QR_DEFAULT_SIZE
+    return min(max(size, QR_MIN_SIZE), QR_MAX_SIZE)
+
+
+def qr_etag(data, fmt='png', size=QR_DEFAULT_SIZE):
+    digest = hashlib.sha1(f'{QR_RENDER_VERSION}:{fmt}:{size}:{data}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+@lru_cache(maxsize=getattr(settings, 'QR_CACHE_SIZE', 1024))
+def render_qr(data, fmt='png', size=QR_DEFAULT_SIZE):
+    """Vẽ mã QR cho chuỗi `data`, rộng tối đa `size` pixel, trả về bytes PNG hoặc SVG."""
+    qr = qrcode.QRCode(border=QR_BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    qr.box_size = max(size // (qr.modules_count + 2 * QR_BORDER), 1)
+    buffer = io.BytesIO()
+    if fmt == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color='black', back_color='white').save(buffer, format='PNG')
+    return buffer.getvalue()
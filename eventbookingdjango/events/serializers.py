@@ -6,27 +6,134 @@ from .models import (
 )
 from django.db import transaction
 from django.utils import timezone
-from django.db.models import F
+from django.db.models import F, Prefetch
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.models.functions import Coalesce
 from decimal import Decimal
-from cloudinary.utils import cloudinary_url
+from django.urls import reverse
+from .ticket_tokens import issue_token
+from . import inbox
+
+
+def sparse_fields(request):
+    """Đọc ?fields=a,b (chỉ lấy các trường này) và ?omit=c,d (bỏ các trường này) từ request."""
+    params = {}
+    if request is None:
+        return params
+    for name in ('fields', 'omit'):
+        value = request.query_params.get(name)
+        if value:
+            params[name] = [field.strip() for field in value.split(',') if field.strip()]
+    return params
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer nhận `fields=[...]` / `omit=[...]` (xem sparse_fields) để trả về một phần các trường.
+    optimize_queryset() thu queryset về đúng các cột và quan hệ mà các trường còn lại đọc tới
+    (.only(), select_related, prefetch_related). SerializerMethodField khai báo dữ liệu cần dùng trong
+    Meta.field_sources; trường không khai báo thì queryset được giữ nguyên.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested_fields = set(fields) if fields is not None else None
+        self.omitted_fields = set(omit or ())
+        for name in list(self.fields):
+            if not self.wants(name):
+                self.fields.pop(name)
+
+    def wants(self, name):
+        """Trường (kể cả trường thêm trong to_representation) có nằm trong kết quả hay không."""
+        if self.requested_fields is not None and name not in self.requested_fields:
+            return False
+        return name not in self.omitted_fields
+
+    def _sources(self, name, field):
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            return getattr(self.Meta, 'field_sources', {}).get(name)
+        return [field.source]
+
+    def _resolve(self, queryset, source, field, only, select, prefetch):
+        """Ghi nhận cột/quan hệ cần cho một source dạng 'a.b.c'; trả về False nếu không xác định được."""
+        model, prefix = queryset.model, ''
+        parts = source.split('.')
+        for index, part in enumerate(parts):
+            try:
+                model_field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                # Giá trị đã annotate sẵn trên queryset
+                return not prefix and part in queryset.query.annotations
+            path = prefix + part
+            last = index == len(parts) - 1
+            if not model_field.is_relation:
+                # Phần còn lại là thuộc tính của giá trị (vd. poster.url)
+                only.add(path)
+                return True
+            if model_field.many_to_many or model_field.one_to_many:
+                if prefix or not last:
+                    return False
+                prefetch[part] = (model_field, getattr(field, 'child', None))
+                return True
+            if model_field.concrete:
+                only.add(path)
+            if last:
+                if isinstance(field, serializers.BaseSerializer) or not model_field.concrete:
+                    # Serializer lồng nhau đọc toàn bộ bản ghi liên quan
+                    select.add(path)
+                return True
+            select.add(path)
+            model, prefix = model_field.related_model, path + '__'
+        return True
+
+    def optimize_queryset(self, queryset, keep=()):
+        only, select, prefetch = {queryset.model._meta.pk.name, *keep}, set(), {}
+        # Queryset lấy từ related manager (user.tickets.all()) gán sẵn đối tượng cha qua khóa ngoại:
+        # khóa ngoại bị hoãn thì Django phải refresh_from_db từng dòng
+        only.update(field.name for field in queryset._known_related_objects)
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            sources = self._sources(name, field)
+            if sources is None:
+                return queryset
+            for source in sources:
+                if not self._resolve(queryset, source, field, only, select, prefetch):
+                    return queryset
+
+        lookups = []
+        for name, (model_field, child) in prefetch.items():
+            related = model_field.related_model._default_manager.all()
+            if isinstance(child, DynamicFieldsMixin):
+                # Khóa ngoại trỏ về bảng cha phải được nạp để Django ghép kết quả prefetch
+                related = child.optimize_queryset(
+                    related, keep=(model_field.field.name,) if model_field.one_to_many else ()
+                )
+            lookups.append(Prefetch(name, queryset=related))
+        # Bỏ select_related/prefetch_related của các trường không còn được trả về
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select:
+            queryset = queryset.select_related(*select)
+        return queryset.only(*only).prefetch_related(*lookups)
 
 
 # Serializer cho Tag
-class TagSerializer(ModelSerializer):
+class TagSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
 
 # Serializer cho Review
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_infor = serializers.SerializerMethodField()
 
     class Meta:
         model = Review
         fields = ['id', 'user', 'user_infor', 'event', 'rating', 'comment', 'parent_review', 'created_at']
         read_only_fields = ['id', 'created_at', 'user']
+        field_sources = {'user_infor': ['user.username', 'user.avatar']}
 
     def validate_rating(self, value):
         # Chỉ kiểm tra nếu rating được cung cấp và không phải là phản hồi
@@ -59,35 +166,60 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 
 # Serializer cho Notification
-class NotificationSerializer(serializers.ModelSerializer):
-    event_title = serializers.ReadOnlyField(source='event.title', allow_null=True)
+class NotificationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    event_title = serializers.SerializerMethodField()
     is_read = serializers.SerializerMethodField()
+    read_at = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
-        fields = ['id', 'event', 'event_title', 'title', 'message', 'notification_type', 'is_read', 'created_at']
+        fields = ['id', 'event', 'event_title', 'title', 'message', 'notification_type', 'is_read', 'read_at', 'created_at']
         read_only_fields = ['id', 'event_title', 'created_at']
+        field_sources = {
+            'event_title': ['event.title'],
+            'is_read': ['is_broadcast', 'created_at'],
+            'read_at': ['is_broadcast', 'created_at'],
+        }
+
+    def _read_state(self, obj):
+        # Danh sách lấy qua events.inbox.with_read_state() đã tính sẵn is_read, read_at
+        if not hasattr(obj, 'is_read'):
+            obj.is_read, obj.read_at = False, None
+            request = self.context.get('request')
+            if request and request.user.is_authenticated:
+                mark = request.user.notifications_read_at
+                if obj.is_broadcast and mark and obj.created_at <= mark:
+                    obj.is_read, obj.read_at = True, mark
+                else:
+                    user_notification = UserNotification.objects.filter(
+                        user=request.user, notification=obj, is_read=True
+                    ).first()
+                    if user_notification:
+                        obj.is_read, obj.read_at = True, user_notification.read_at
+        return obj.is_read, obj.read_at
+
+    def get_event_title(self, obj):
+        if hasattr(obj, 'event_title'):
+            return obj.event_title
+        return obj.event.title if obj.event_id else None
 
     def get_is_read(self, obj):
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
-            return False
-        # Sử dụng filter().first() để tránh truy vấn không cần thiết
-        user_notification = UserNotification.objects.filter(
-            user=request.user,
-            notification=obj
-        ).first()
-        return user_notification.is_read if user_notification else False
+        return self._read_state(obj)[0]
+
+    def get_read_at(self, obj):
+        read_at = self._read_state(obj)[1]
+        return serializers.DateTimeField().to_representation(read_at) if read_at else None
 
 
 # Serializer cho ChatMessage
-class ChatMessageSerializer(ModelSerializer):
+class ChatMessageSerializer(DynamicFieldsMixin, ModelSerializer):
     user_info = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatMessage
         fields = ['id', 'event', 'sender', 'receiver', 'message', 'is_from_organizer', 'created_at', 'user_info']
         read_only_fields = ['id', 'event', 'created_at', 'user_info', 'is_from_organizer']
+        field_sources = {'user_info': ['sender.username', 'sender.avatar']}
 
     def get_user_info(self, obj):
         return {
@@ -97,7 +229,7 @@ class ChatMessageSerializer(ModelSerializer):
 
 
 # Serializer cho DiscountCode
-class DiscountCodeSerializer(ModelSerializer):
+class DiscountCodeSerializer(DynamicFieldsMixin, ModelSerializer):
     class Meta:
         model = DiscountCode
         fields = [
@@ -108,10 +240,11 @@ class DiscountCodeSerializer(ModelSerializer):
 
 
 # Serializer cho Event
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['poster'] = instance.poster.url if instance.poster else ''
+        if 'poster' in self.fields:
+            data['poster'] = instance.poster.url if instance.poster else ''
         return data
 
     class Meta:
@@ -119,7 +252,8 @@ class EventSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'organizer', 'title', 'description', 'category', 'start_time', 'end_time',
             'is_active', 'location', 'latitude', 'longitude', 'total_tickets', 'ticket_price',
-            'sold_tickets', 'tags', 'poster', 'created_at', 'updated_at'
+            'sold_tickets', 'tags', 'poster', 'created_at', 'updated_at',
+            'waiting_room_enabled', 'admit_rate', 'sale_opens_at'
         ]
         read_only_fields = ['id', 'organizer', 'sold_tickets', 'created_at', 'updated_at']
 
@@ -154,35 +288,38 @@ class EventSerializer(serializers.ModelSerializer):
 
 
 # Serializer cho Ticket
-class TicketSerializer(ModelSerializer):
+class TicketSerializer(DynamicFieldsMixin, ModelSerializer):
     username = serializers.ReadOnlyField(source='user.username')  # Lấy tên người dùng
     email = serializers.ReadOnlyField(source='user.email')  # Lấy email người dùng
     event_title = serializers.ReadOnlyField(source='event.title')  # Lấy tiêu đề sự kiện
     event_start_time = serializers.ReadOnlyField(source='event.start_time')  # Lấy thời gian bắt đầu sự kiện
     event_location = serializers.ReadOnlyField(source='event.location')  # Lấy địa điểm sự kiện
     event_id = serializers.ReadOnlyField(source='event.id')  # Lấy event id
-    qr_code = serializers.ReadOnlyField()  # Thêm trường qr_code để hiển thị mã QR
+    qr_code = serializers.SerializerMethodField()  # Link ảnh QR, vẽ theo yêu cầu
+    token = serializers.SerializerMethodField()
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        if instance.qr_code:
-            public_id = str(instance.qr_code)  # hoặc instance.qr_code.public_id nếu cần chính xác hơn
-            url, options = cloudinary_url(public_id)
-            data['qr_code'] = url
-        else:
-            data['qr_code'] = ''
-        return data
+    def get_qr_code(self, instance):
+        url = reverse('ticket-qr', kwargs={'pk': instance.pk, 'fmt': 'png'})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_token(self, instance):
+        # Token đã ký để soát vé tại cổng, chỉ có khi vé đã thanh toán
+        return issue_token(instance) if instance.is_paid else None
 
     class Meta:
         model = Ticket
         fields = [
             'id', 'username', 'email', 'purchase_date', 'qr_code',
-            'event_title', 'event_start_time', 'event_location', 'event_id','is_paid','uuid'
+            'event_title', 'event_start_time', 'event_location', 'event_id','is_paid','uuid',
+            'hold_expires_at', 'token'
         ]
         read_only_fields = [
             'id', 'username', 'email', 'purchase_date', 'qr_code',
-            'event_title', 'event_start_time', 'event_location', 'event_id','is_paid','uuid'
+            'event_title', 'event_start_time', 'event_location', 'event_id','is_paid','uuid',
+            'hold_expires_at', 'token'
         ]
+        field_sources = {'qr_code': [], 'token': ['is_paid', 'event.start_time', 'event.end_time']}
 
     def create(self, validated_data):
         # Tự động gán user và event từ context
@@ -192,7 +329,7 @@ class TicketSerializer(ModelSerializer):
 
 
 # Serializer cho Payment
-class PaymentSerializer(ModelSerializer):
+class PaymentSerializer(DynamicFieldsMixin, ModelSerializer):
     user_detail = serializers.SerializerMethodField()
     tickets = TicketSerializer(many=True, read_only=True)  # Lấy danh sách vé đã mua
 
@@ -202,6 +339,7 @@ class PaymentSerializer(ModelSerializer):
         model = Payment
         fields = ['id', 'user', 'user_detail', 'amount', 'payment_method', 'paid_at', 'transaction_id', 'tickets']
         read_only_fields = ['id', 'paid_at', 'transaction_id']
+        field_sources = {'user_detail': ['user.username', 'user.email', 'user.phone'], 'amount': ['amount']}
 
     def get_user_detail(self, obj):
         return {
@@ -216,7 +354,7 @@ class PaymentSerializer(ModelSerializer):
 
 
 # Serializer cho User
-class UserSerializer(ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, ModelSerializer):
     password = serializers.CharField(write_only=True, required=True)
     tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True, required=False)
     avatar = serializers.ImageField(required=False, allow_null=True)
@@ -266,23 +404,22 @@ class UserSerializer(ModelSerializer):
 
 
 # Serializer chi tiết cho User: Profile
-class UserDetailSerializer(ModelSerializer):
+class UserDetailSerializer(DynamicFieldsMixin, ModelSerializer):
     organized_events = EventSerializer(many=True, read_only=True)
     tickets = TicketSerializer(many=True, read_only=True)
     payments = PaymentSerializer(many=True, read_only=True)
     user_notifications = serializers.SerializerMethodField()
 
     def get_user_notifications(self, obj):
-        # Lấy danh sách UserNotification của user
-        user_notifications = obj.user_notifications.all()
-        # Trả về danh sách Notification tương ứng
-        notifications = [user_notification.notification for user_notification in user_notifications]
-        return NotificationSerializer(notifications, many=True, context=self.context).data
+        # Thông báo riêng và thông báo chung của user, kèm is_read
+        return NotificationSerializer(inbox.user_notifications(obj), many=True, context=self.context).data
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['avatar'] = instance.avatar.url if instance.avatar else ''
-        data['customer_group'] = instance.get_customer_group().value
+        if 'avatar' in self.fields:
+            data['avatar'] = instance.avatar.url if instance.avatar else ''
+        if self.wants('customer_group'):
+            data['customer_group'] = instance.get_customer_group().value
         return data
 
     class Meta:
@@ -295,15 +432,112 @@ class UserDetailSerializer(ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'is_staff', 'is_superuser', 'total_spent']
 
 
+# Chi tiết sự kiện: kích thước trang đầu của danh sách con và giới hạn khi expand
+DETAIL_PAGE_SIZE = 5
+DETAIL_EXPAND_LIMIT = 100
+DETAIL_EXPANDABLE = ('reviews', 'event_notifications', 'chat_messages', 'discount_codes')
+
+
+def parse_expand(request):
+    """Đọc `?expand=a,b` thành tập tên hợp lệ trong DETAIL_EXPANDABLE."""
+    if request is None:
+        return set()
+    return set(request.query_params.get('expand', '').split(',')).intersection(DETAIL_EXPANDABLE)
+
+
+def detail_collections(request=None):
+    """{tên danh sách con: (serializer, queryset đã select_related)} của chi tiết sự kiện."""
+    # is_read, read_at tính sẵn trong truy vấn thay vì mỗi thông báo một truy vấn
+    notifications = inbox.with_read_state(
+        Notification.objects.order_by('-created_at', '-pk'), getattr(request, 'user', None)
+    )
+    return {
+        'reviews': (ReviewSerializer, Review.objects.select_related('user').order_by('-created_at', '-pk')),
+        'event_notifications': (NotificationSerializer, notifications),
+        'chat_messages': (ChatMessageSerializer, ChatMessage.objects.select_related('sender').order_by('-created_at', '-pk')),
+    }
+
+
+def with_event_detail(queryset, request=None):
+    """
+    Nạp sẵn dữ liệu cho EventDetailSerializer: organizer và tag, tổng số và trang đầu (hoặc phần
+    expand) của từng danh sách con. Số truy vấn cố định: sự kiện, tag của organizer, tag, và một
+    truy vấn cho mỗi danh sách con.
+    """
+    expand = parse_expand(request)
+    prefetches = []
+    counts = {}
+    for name, (_, items) in detail_collections(request).items():
+        limit = DETAIL_EXPAND_LIMIT if name in expand else DETAIL_PAGE_SIZE
+        prefetches.append(models.Prefetch(name, queryset=items[:limit], to_attr=f'{name}_page'))
+        related = items.model
+        counts[f'{name}_total'] = Coalesce(models.Subquery(
+            related.objects.filter(event=models.OuterRef('pk')).order_by()
+            .values('event').annotate(n=models.Count('pk')).values('n'),
+            output_field=models.IntegerField(),
+        ), 0)
+    return (
+        queryset.select_related('organizer')
+        .prefetch_related('organizer__tags', 'tags', *prefetches)
+        .annotate(**counts)
+    )
+
+
 # Serializer cho EventDetail
-class EventDetailSerializer(serializers.ModelSerializer):
+class EventDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    Chi tiết sự kiện gọn nhẹ: mỗi danh sách con (reviews, event_notifications, chat_messages) chỉ có
+    trang đầu DETAIL_PAGE_SIZE phần tử kèm tổng số; `?expand=reviews,chat_messages,...` trả tối đa
+    DETAIL_EXPAND_LIMIT phần tử, `discount_codes` chỉ có khi được expand. Dùng cùng with_event_detail()
+    để số truy vấn không phụ thuộc số review/tin nhắn.
+    """
     organizer = UserSerializer(read_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
-    event_notifications = NotificationSerializer(many=True, read_only=True)
-    chat_messages = ChatMessageSerializer(many=True, read_only=True)
+    reviews = serializers.SerializerMethodField()
+    event_notifications = serializers.SerializerMethodField()
+    chat_messages = serializers.SerializerMethodField()
+    review_count = serializers.SerializerMethodField()
+    event_notification_count = serializers.SerializerMethodField()
+    chat_message_count = serializers.SerializerMethodField()
     tags = TagSerializer(many=True, read_only=True)
     discount_codes = serializers.SerializerMethodField()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expand = parse_expand(self.context.get('request'))
+        if 'discount_codes' not in self.expand:
+            self.fields.pop('discount_codes', None)
+
+    def _collection(self, obj, name):
+        serializer_class, queryset = detail_collections(self.context.get('request'))[name]
+        # Trang đầu đã được prefetch (with_event_detail), nếu không thì truy vấn trực tiếp
+        items = getattr(obj, f'{name}_page', None)
+        if items is None:
+            limit = DETAIL_EXPAND_LIMIT if name in self.expand else DETAIL_PAGE_SIZE
+            items = queryset.filter(event=obj)[:limit]
+        return serializer_class(items, many=True, context=self.context).data
+
+    def _count(self, obj, name):
+        count = getattr(obj, f'{name}_total', None)
+        return count if count is not None else getattr(obj, name).count()
+
+    def get_reviews(self, obj):
+        return self._collection(obj, 'reviews')
+
+    def get_event_notifications(self, obj):
+        return self._collection(obj, 'event_notifications')
+
+    def get_chat_messages(self, obj):
+        return self._collection(obj, 'chat_messages')
+
+    def get_review_count(self, obj):
+        return self._count(obj, 'reviews')
+
+    def get_event_notification_count(self, obj):
+        return self._count(obj, 'event_notifications')
+
+    def get_chat_message_count(self, obj):
+        return self._count(obj, 'chat_messages')
+
     def get_discount_codes(self, obj):
         now = timezone.now()
         discount_codes = DiscountCode.objects.filter(
@@ -318,9 +552,12 @@ class EventDetailSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['poster'] = instance.poster.url if instance.poster else ''
-        data['sold_tickets'] = instance.sold_tickets
-        data['ticket_price'] = str(instance.ticket_price) if instance.ticket_price is not None else None
+        if 'poster' in self.fields:
+            data['poster'] = instance.poster.url if instance.poster else ''
+        if 'sold_tickets' in self.fields:
+            data['sold_tickets'] = instance.sold_tickets
+        if 'ticket_price' in self.fields:
+            data['ticket_price'] = str(instance.ticket_price) if instance.ticket_price is not None else None
         return data
 
     def create(self, validated_data):
@@ -351,15 +588,15 @@ class EventDetailSerializer(serializers.ModelSerializer):
             'id', 'organizer', 'title', 'description', 'category', 'start_time',
             'end_time', 'is_active', 'location', 'latitude', 'longitude',
             'total_tickets', 'ticket_price', 'sold_tickets', 'tags', 'poster',
-            'created_at', 'updated_at', 'reviews', 'event_notifications',
-            'chat_messages', 'discount_codes'
+            'created_at', 'updated_at', 'reviews', 'review_count', 'event_notifications',
+            'event_notification_count', 'chat_messages', 'chat_message_count', 'discount_codes',
+            'waiting_room_enabled', 'admit_rate', 'sale_opens_at'
         ]
-        read_only_fields = ['created_at', 'updated_at', 'sold_tickets', 'reviews',
-                            'event_notifications', 'chat_messages', 'organizer']
+        read_only_fields = ['created_at', 'updated_at', 'sold_tickets', 'organizer']
 
 
 # Serializer cho EventTrendingLog
-class EventTrendingLogSerializer(serializers.ModelSerializer):
+class EventTrendingLogSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     event_title = serializers.ReadOnlyField(source='event.title')  # Lấy tiêu đề sự kiện
     event_poster = serializers.ReadOnlyField(source='event.poster.url')  # Lấy poster sự kiện
 
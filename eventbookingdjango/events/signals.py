@@ -3,62 +3,35 @@
 from django.db.models.signals import post_migrate, pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Tag, Event, Notification, Ticket, Review, ChatMessage, EventTrendingLog, Payment, DiscountCode, UserNotification
+from .models import Tag, Event, Notification, Ticket, Review, EventTrendingLog, Payment, DiscountCode, TicketTombstone, NotificationFanout
 from django.db import transaction
 from django.db.models import F
 from django.utils import timezone
+from . import activity, aggregation, event_updates
 
 
-# Tự động tạo thông báo khi sự kiện được cập nhật
+# Ghi nhận thay đổi quan trọng của sự kiện; các lần sửa liên tiếp được gộp thành một thông báo
+# sau khoảng lặng (events.event_updates)
 @receiver(post_save, sender=Event)
 def create_notification_for_event_update(sender, instance, created, update_fields=None, **kwargs):
-    """Tạo thông báo khi sự kiện được cập nhật."""
-    # Bỏ qua nếu là sự kiện mới hoặc chỉ cập nhật trường sold_tickets
-    if created or update_fields == {'sold_tickets'}:
+    """Đưa thay đổi của sự kiện vào bộ đệm chờ gửi thông báo."""
+    # Bỏ qua nếu là sự kiện mới
+    if created:
         return
 
-    # Chỉ tạo thông báo nếu các trường quan trọng được cập nhật
-    important_fields = {'title', 'start_time', 'end_time', 'location', 'is_active'}
-    if update_fields and not important_fields.intersection(update_fields):
-        return
+    # Chỉ ghi nhận nếu các trường quan trọng thực sự thay đổi (Event.save luôn truyền update_fields
+    # gồm mọi trường trừ bộ đếm nên phải so với giá trị đã nạp)
+    changed = set(event_updates.FIELD_LABELS).intersection(instance.changed_fields)
+    if changed:
+        event_updates.record_change(instance, changed)
 
-    with transaction.atomic():
-        # Tạo một thông báo duy nhất cho sự kiện
-        notification = Notification.objects.create(
-            event=instance,
-            title=f"Cập nhật sự kiện: {instance.title}",
-            message=f"Sự kiện '{instance.title}' đã được cập nhật.",
-            notification_type='update'
-        )
-        # Lấy danh sách user có vé cho sự kiện
-        ticket_owners = Ticket.objects.filter(event=instance).select_related('user').values_list('user', flat=True).distinct()
-        # Tạo UserNotification cho từng user
-        user_notifications = [
-            UserNotification(user_id=user_id, notification=notification)
-            for user_id in ticket_owners
-        ]
-        # Sử dụng ignore_conflicts để bỏ qua các bản ghi trùng lặp
-        UserNotification.objects.bulk_create(user_notifications, ignore_conflicts=True)
-
-
-# Tự động tạo UserNotification khi Notification được tạo thủ công
+
+# Thông báo gắn sự kiện: tạo job gửi tới người có vé, chạy nền theo lô (events.fanout).
+# Thông báo chung không tạo dòng cho từng user, xem events.inbox.
 @receiver(post_save, sender=Notification)
 def create_usernotification_for_manual_notification(sender, instance, created, **kwargs):
-    if created:
-        with transaction.atomic():
-            User = get_user_model()
-            if instance.event:
-                # Lấy user có vé sự kiện
-                ticket_owners = Ticket.objects.filter(event=instance.event).select_related('user').values_list('user', flat=True).distinct()
-            else:
-                # Nếu không có event, lấy tất cả user
-                ticket_owners = User.objects.all().values_list('id', flat=True)
-
-            user_notifications = [
-                UserNotification(user_id=user_id, notification=instance)
-                for user_id in ticket_owners
-            ]
-            UserNotification.objects.bulk_create(user_notifications, ignore_conflicts=True)
+    if created and not instance.is_broadcast:
+        NotificationFanout.objects.create(notification=instance)
 
 
 # Tạo tag và superuser mặc định sau khi migrate
@@ -85,31 +58,26 @@ def create_default_tags(sender, **kwargs):
         )
 
 
-# Signal để cập nhật total_spent của User khi Payment được lưu
+# Signal để cập nhật total_spent của User khi Payment được lưu.
+# Trạng thái cũ lấy từ giá trị đã nạp (TrackChangesMixin), total_spent cập nhật bằng F-expression.
 @receiver(post_save, sender=Payment)
 def update_user_total_spent(sender, instance, created, **kwargs):
-    with transaction.atomic():
-        user = instance.user
-        if created:
-            # Nếu là tạo mới và thanh toán thành công
-            if instance.status:
-                user.total_spent += instance.amount
-                user.save(update_fields=['total_spent'])
+    if created:
+        # Nếu là tạo mới và thanh toán thành công
+        delta = instance.amount if instance.status else 0
+    else:
+        old_status = instance.previous_value('status')
+        old_amount = instance.previous_value('amount')
+        if old_status != instance.status:
+            # Từ chưa thanh toán sang thanh toán thành công hoặc ngược lại
+            delta = instance.amount if instance.status else -old_amount
+        elif instance.status and old_amount != instance.amount:
+            # Nếu đã thanh toán và amount thay đổi
+            delta = instance.amount - old_amount
         else:
-            # Nếu là cập nhật
-            old_payment = Payment.objects.get(pk=instance.pk)
-            if old_payment.status != instance.status:
-                if instance.status:
-                    # Từ chưa thanh toán sang thanh toán thành công
-                    user.total_spent += instance.amount
-                else:
-                    # Từ thanh toán thành công sang chưa thanh toán
-                    user.total_spent -= old_payment.amount
-                user.save(update_fields=['total_spent'])
-            elif instance.status and old_payment.amount != instance.amount:
-                # Nếu đã thanh toán và amount thay đổi
-                user.total_spent = user.total_spent - old_payment.amount + instance.amount
-                user.save(update_fields=['total_spent'])
+            delta = 0
+    if delta:
+        get_user_model().objects.filter(pk=instance.user_id).update(total_spent=F('total_spent') + delta)
 
 
 # Signal để cập nhật is_active của Event trước khi lưu
@@ -122,60 +90,44 @@ def update_event_status(sender, instance, **kwargs):
 # Signal để cập nhật is_active của DiscountCode trước khi lưu
 @receiver(pre_save, sender=DiscountCode)
 def update_discount_code_status(sender, instance, **kwargs):
+    # Quản trị viên vừa tắt mã thủ công thì giữ nguyên
+    if 'is_active' in instance.changed_fields and not instance.is_active:
+        return
     # Cập nhật trạng thái is_active dựa trên is_valid
     instance.is_active = instance.is_valid()
 
 
-# Signal để cập nhật sold_tickets và EventTrendingLog khi Ticket được lưu
+# Signal để cập nhật sold_tickets và EventTrendingLog khi Ticket được lưu.
+# Chỉ ghi nhận thay đổi, bộ đếm và điểm trending được cập nhật một lần khi transaction commit
+# (events.aggregation).
 @receiver(post_save, sender=Ticket)
 def update_sold_tickets_on_save(sender, instance, created, **kwargs):
-    with transaction.atomic():
-        event = instance.event
-        trending_log, _ = EventTrendingLog.objects.get_or_create(event=event)
-
-        if created and instance.is_paid:
-            # Nếu tạo mới và đã thanh toán
-            Event.objects.filter(pk=event.pk).update(
-                sold_tickets=F('sold_tickets') + 1
-            )
-            trending_log.total_revenue += event.ticket_price
-        elif not created:
-            # Nếu là cập nhật
-            old = Ticket.objects.get(pk=instance.pk)
-            if not old.is_paid and instance.is_paid:
-                # Từ chưa thanh toán sang thanh toán thành công
-                Event.objects.filter(pk=event.pk).update(
-                    sold_tickets=F('sold_tickets') + 1
-                )
-                trending_log.total_revenue += event.ticket_price
-            elif old.is_paid and not instance.is_paid:
-                # Từ thanh toán thành công sang chưa thanh toán
-                Event.objects.filter(pk=event.pk).update(
-                    sold_tickets=F('sold_tickets') - 1
-                )
-                trending_log.total_revenue -= event.ticket_price
-
-        # Lưu thay đổi cho trending_log và tính toán score
-        trending_log.save()
-        trending_log.calculate_score()
+    # Vé mới luôn đã được giữ chỗ trong Ticket.save, nên trạng thái trước đó là "chưa thanh toán"
+    was_paid = False if created else instance.previous_value('is_paid')
+    if not was_paid and instance.is_paid:
+        # Từ chưa thanh toán sang thanh toán thành công: chuyển chỗ giữ thành vé đã bán
+        aggregation.record(instance.event_id, 'commit')
+    elif was_paid and not instance.is_paid:
+        # Từ thanh toán thành công sang chưa thanh toán: vé quay lại trạng thái giữ chỗ
+        aggregation.record(instance.event_id, 'uncommit')
 
 
 # Signal để cập nhật sold_tickets và EventTrendingLog khi Ticket bị xóa
 @receiver(post_delete, sender=Ticket)
 def update_sold_tickets_on_delete(sender, instance, **kwargs):
-    with transaction.atomic():
-        event = instance.event
-        # Đếm số vé đã thanh toán
-        sold_tickets = event.tickets.filter(is_paid=True).count()
-        event.sold_tickets = sold_tickets
-        event.save(update_fields=['sold_tickets'])
-
-        # Cập nhật EventTrendingLog
-        trending_log, _ = EventTrendingLog.objects.get_or_create(event=event)
-        if instance.is_paid:
-            trending_log.total_revenue -= event.ticket_price
-            trending_log.save()
-            trending_log.calculate_score()
+    if instance.is_paid:
+        aggregation.record(instance.event_id, 'remove_sold')
+        TicketTombstone.objects.create(event_id=instance.event_id, uuid=instance.uuid)
+    else:
+        # Vé chưa thanh toán: trả lại chỗ đã giữ
+        aggregation.record(instance.event_id, 'release')
+
+
+# Review mới được tính vào bucket hoạt động của sự kiện (events.activity)
+@receiver(post_save, sender=Review)
+def record_review_activity(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: activity.record(instance.event_id, reviews=1))
 
 
 # Signal để tự động tạo EventTrendingLog khi tạo Event mới
@@ -1,3 +1,1133 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core import signing
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .models import (
+    User, Event, Ticket, Payment, DiscountCode, Review, Notification, NotificationFanout, PendingEventUpdate, UserNotification, ChatMessage, EventTrendingLog, EventActivityBucket, InventoryShard, IdempotencyKey,
+    TICKET_HOLD_TTL, TRENDING_HALF_LIFE
+)
+from .booking import book_tickets, parse_booking_items, release_expired_holds
+from .counters import get_counter
+from .idempotency import IDEMPOTENCY_LOCK_TIMEOUT, purge_expired_keys
+from .paginators import ItemPaginator
+from .qr import render_qr
+from .trending import rescore_all
+from .views import TicketViewSet
+from . import activity, aggregation, event_updates, expiry, fanout, gate_bundle, ticket_tokens, waiting_room
+
+
+def create_event(organizer=None, **kwargs):
+    if organizer is None:
+        organizer = User.objects.create_user(
+            username='organizer', email='organizer@example.com', password='123', role='organizer'
+        )
+    now = timezone.now()
+    defaults = {
+        'title': 'Flash sale', 'description': 'Test', 'category': 'music',
+        'start_time': now + timedelta(days=7), 'end_time': now + timedelta(days=8),
+        'location': 'HCM', 'latitude': 10.8, 'longitude': 106.7,
+        'total_tickets': 10, 'ticket_price': Decimal('100000'),
+    }
+    defaults.update(kwargs)
+    return Event.objects.create(organizer=organizer, **defaults)
+
+
+# Giữ chỗ nguyên tử: không bán vượt số vé khi nhiều người đặt cùng lúc
+class TicketReservationTest(TestCase):
+    def setUp(self):
+        self.event = create_event(total_tickets=2)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+
+    def test_booking_reserves_and_payment_commits(self):
+        ticket = Ticket.objects.create(user=self.user, event=self.event)
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.reserved_tickets, self.event.sold_tickets), (1, 0))
+
+        # Bộ đếm được cập nhật khi transaction commit (events.aggregation)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.mark_as_paid(timezone.now())
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.reserved_tickets, self.event.sold_tickets), (0, 1))
+
+    def test_sold_out_raises(self):
+        Ticket.objects.create(user=self.user, event=self.event)
+        Ticket.objects.create(user=self.user, event=self.event)
+        with self.assertRaises(ValidationError):
+            Ticket.objects.create(user=self.user, event=self.event)
+
+    def test_deleting_unpaid_ticket_releases_seat(self):
+        ticket = Ticket.objects.create(user=self.user, event=self.event)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket.delete()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.reserved_tickets, 0)
+
+    def test_event_save_does_not_overwrite_counters(self):
+        stale = Event.objects.get(pk=self.event.pk)
+        Ticket.objects.create(user=self.user, event=self.event)
+        stale.title = 'Đổi tên'
+        stale.save()
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.reserved_tickets, 1)
+
+    @override_settings(INVENTORY_COUNTER={'BACKEND': 'events.counters.ShardedCounter', 'OPTIONS': {'shards': 8}})
+    def test_sharded_booking_spans_shards(self):
+        event = create_event(organizer=self.event.organizer, total_tickets=50)
+        counter = get_counter()
+        # 50 chỗ chia cho 8 shard (6-7 chỗ mỗi shard)
+        self.assertTrue(counter.reserve(event.pk, 10))
+        self.assertTrue(counter.reserve(event.pk, 38))
+        self.assertFalse(counter.reserve(event.pk, 3))
+        self.assertEqual(counter.totals(event.pk), (48, 0))
+        self.assertTrue(counter.reserve(event.pk, 2))
+        self.assertEqual(counter.totals(event.pk), (50, 0))
+
+
+# Đặt vé theo lô: số truy vấn không phụ thuộc số vé
+class BatchBookingTest(TestCase):
+    def setUp(self):
+        self.event = create_event(total_tickets=10)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+
+    def test_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as single:
+            book_tickets(self.user, {self.event.pk: 1})
+        with CaptureQueriesContext(connection) as batch:
+            tickets = book_tickets(self.user, {self.event.pk: 6})
+        self.assertEqual(len(batch), len(single))
+        self.assertEqual(len(tickets), 6)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.reserved_tickets, 7)
+
+    def test_all_or_nothing(self):
+        other = create_event(organizer=self.event.organizer, total_tickets=1)
+        with self.assertRaises(ValidationError):
+            book_tickets(self.user, {self.event.pk: 2, other.pk: 2})
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.reserved_tickets, 0)
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_parse_items(self):
+        quantities = parse_booking_items({'items': [
+            {'event_id': 1, 'quantity': 2}, {'event_id': '1', 'quantity': 1}, {'event_id': 2},
+        ]})
+        self.assertEqual(quantities, {1: 3, 2: 1})
+        with self.assertRaises(ValidationError):
+            parse_booking_items({'event_id': 1, 'quantity': 0})
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    capacity = 25
+    attempts = 300
+
+    def book_in_parallel(self):
+        event = create_event(total_tickets=self.capacity)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+
+        def book(_):
+            try:
+                Ticket.objects.create(user=user, event=event)
+                return True
+            except ValidationError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(book, range(self.attempts)))
+
+        self.assertEqual(sum(results), self.capacity)
+        self.assertEqual(Ticket.objects.filter(event=event).count(), self.capacity)
+        return event
+
+    def test_parallel_bookings_never_oversell(self):
+        event = self.book_in_parallel()
+        event.refresh_from_db()
+        self.assertEqual(event.reserved_tickets + event.sold_tickets, self.capacity)
+
+    @override_settings(INVENTORY_COUNTER={'BACKEND': 'events.counters.ShardedCounter', 'OPTIONS': {'shards': 4}})
+    def test_sharded_counter_never_oversells(self):
+        event = self.book_in_parallel()
+        self.assertEqual(get_counter().totals(event.pk), (self.capacity, 0))
+        self.assertEqual(InventoryShard.objects.filter(event=event).count(), 4)
+
+        get_counter().reconcile()
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (self.capacity, 0))
+
+    @override_settings(INVENTORY_COUNTER={'BACKEND': 'events.counters.LocalCounter'})
+    def test_local_counter_never_oversells(self):
+        event = self.book_in_parallel()
+        Ticket.objects.filter(event=event).first().mark_as_paid(timezone.now())
+        self.assertEqual(get_counter().totals(event.pk), (self.capacity - 1, 1))
+
+        get_counter().reconcile()
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (self.capacity - 1, 1))
+
+
+# Vé giữ chỗ hết hạn được dọn theo lô và trả lại chỗ
+class ExpiredHoldSweepTest(TestCase):
+    def test_release_expired_holds(self):
+        event = create_event(total_tickets=5)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        book_tickets(user, {event.pk: 3})
+        paid = Ticket.objects.create(user=user, event=event)
+        with self.captureOnCommitCallbacks(execute=True):
+            paid.mark_as_paid(timezone.now())
+
+        later = timezone.now() + TICKET_HOLD_TTL + timedelta(seconds=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(release_expired_holds(batch_size=2, now=later), 3)
+
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (0, 1))
+        self.assertEqual(list(Ticket.objects.values_list('pk', flat=True)), [paid.pk])
+
+    def test_tickets_of_pending_payment_are_kept(self):
+        event = create_event(total_tickets=5)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        tickets = book_tickets(user, {event.pk: 2})
+        payment = Payment.objects.create(user=user, amount=event.ticket_price * 2, payment_method='momo', transaction_id='tx')
+        Ticket.objects.filter(pk=tickets[0].pk).update(payment=payment)
+
+        later = timezone.now() + TICKET_HOLD_TTL + timedelta(seconds=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(release_expired_holds(now=later), 1)
+        self.assertEqual(list(payment.tickets.values_list('pk', flat=True)), [tickets[0].pk])
+
+        # Thanh toán không còn vé thì không được xác nhận
+        client = APIClient()
+        client.force_authenticate(user)
+        payment.tickets.all().delete()
+        response = client.post(f'/payments/{payment.pk}/confirm/')
+        self.assertEqual(response.status_code, 400)
+        payment.refresh_from_db()
+        self.assertFalse(payment.status)
+
+
+# Phòng chờ: người vào hàng sau chỉ được đặt vé khi đến lượt
+@override_settings(WAITING_ROOM={'BACKEND': 'events.waiting_room.LocalQueueStore', 'ADMIT_RATE': 1, 'ADMIT_BURST': 2})
+class WaitingRoomTest(TestCase):
+    def setUp(self):
+        # Hàng đợi trong bộ nhớ tiến trình, id sự kiện được dùng lại giữa các test
+        waiting_room.get_store.cache_clear()
+
+    def test_admission_order(self):
+        event = create_event(waiting_room_enabled=True)
+        users = [
+            User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', password='123')
+            for i in range(4)
+        ]
+        tokens = [waiting_room.join(event, user) for user in users]
+
+        self.assertTrue(waiting_room.is_admitted(event.pk, users[1], tokens[1]))
+        status = waiting_room.get_status(event.pk, users[3], tokens[3])
+        self.assertFalse(status['admitted'])
+        self.assertEqual(status['position'], 2)
+        # Token không dùng được cho người khác
+        self.assertFalse(waiting_room.is_admitted(event.pk, users[0], tokens[1]))
+
+    def test_admission_starts_at_sale_open(self):
+        opens_at = timezone.now() + timedelta(minutes=10)
+        event = create_event(waiting_room_enabled=True, sale_opens_at=opens_at)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        # Vào hàng sớm chỉ giữ số thứ tự, chưa ai được vào trước giờ mở bán
+        token = waiting_room.join(event, user)
+        status = waiting_room.get_status(event.pk, user, token)
+        self.assertEqual((status['admitted'], status['position']), (False, 1))
+        self.assertGreaterEqual(status['retry_after'], 599)
+        with mock.patch('events.waiting_room.time.time', return_value=opens_at.timestamp() + 1):
+            self.assertTrue(waiting_room.is_admitted(event.pk, user, token))
+
+    def test_token_is_single_use(self):
+        event = create_event(waiting_room_enabled=True, total_tickets=5)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        client = APIClient()
+        client.force_authenticate(user)
+        token = client.post(f'/events/{event.pk}/queue/').data['token']
+
+        response = client.post('/tickets/book-tickets/', {'event_id': event.pk, 'quantity': 9, 'queue_token': token}, format='json')
+        self.assertEqual(response.status_code, 400)
+        # Đặt vé thất bại không làm mất lượt; đặt thành công thì token hết hiệu lực
+        response = client.post('/tickets/book-tickets/', {'event_id': event.pk, 'quantity': 2, 'queue_token': token}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = client.post('/tickets/book-ticket/', {'event_id': event.pk, 'queue_token': token}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Ticket.objects.filter(event=event).count(), 2)
+
+
+
+# Ảnh QR vẽ theo yêu cầu từ uuid, client dùng lại bản đã có qua ETag
+class TicketQRCodeTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.ticket = book_tickets(self.user, {create_event().pk: 1})[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_render_png_and_svg(self):
+        url = reverse('ticket-qr', kwargs={'pk': self.ticket.pk, 'fmt': 'png'})
+        response = self.client.get(url, {'size': 128})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertEqual(response.content, render_qr(str(self.ticket.uuid), 'png', 128))
+
+        response = self.client.get(reverse('ticket-qr', kwargs={'pk': self.ticket.pk, 'fmt': 'svg'}))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+    def test_etag_and_owner_only(self):
+        url = reverse('ticket-qr', kwargs={'pk': self.ticket.pk, 'fmt': 'png'})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(url, {'size': 500})['ETag'], etag)
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+# Token vé ký HMAC: kiểm tra không cần DB, hỗ trợ đổi khóa
+@override_settings(TICKET_SIGNING_KEYS={1: 'old-key'})
+class TicketTokenTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        now = timezone.now()
+        self.event = create_event(start_time=now + timedelta(hours=1), end_time=now + timedelta(hours=4))
+        self.ticket = Ticket.objects.create(user=self.user, event=self.event)
+        self.ticket.mark_as_paid(timezone.now())
+
+    def test_verify_and_key_rotation(self):
+        token = ticket_tokens.issue_token(self.ticket)
+        with self.assertNumQueries(0):
+            data = ticket_tokens.verify_token(token, event_id=self.event.pk, now=self.event.start_time.timestamp())
+        self.assertEqual((data.ticket_id, data.event_id, data.kid), (self.ticket.pk, self.event.pk, 1))
+
+        with self.assertRaises(signing.BadSignature):
+            ticket_tokens.verify_token(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB'))
+        with self.assertRaises(signing.BadSignature):
+            ticket_tokens.verify_token(token, event_id=self.event.pk + 1, now=self.event.start_time.timestamp())
+        with self.assertRaises(signing.SignatureExpired):
+            ticket_tokens.verify_token(token, now=(self.event.end_time + timedelta(days=1)).timestamp())
+
+        with self.settings(TICKET_SIGNING_KEYS={1: 'old-key', 2: 'new-key'}, TICKET_SIGNING_KEY_ID=2):
+            new_token = ticket_tokens.issue_token(self.ticket)
+            self.assertEqual(ticket_tokens.verify_token(new_token, now=self.event.start_time.timestamp()).kid, 2)
+            self.assertEqual(ticket_tokens.verify_token(token, now=self.event.start_time.timestamp()).kid, 1)
+        with self.settings(TICKET_SIGNING_KEYS={2: 'new-key'}):
+            with self.assertRaises(signing.BadSignature):
+                ticket_tokens.verify_token(token, now=self.event.start_time.timestamp())
+
+    def test_misconfigured_keys(self):
+        with self.settings(TICKET_SIGNING_KEYS={256: 'key'}):
+            with self.assertRaises(ImproperlyConfigured):
+                ticket_tokens.issue_token(self.ticket)
+        with self.settings(TICKET_SIGNING_KEYS={1: 'key'}, TICKET_SIGNING_KEY_ID=2):
+            with self.assertRaises(ImproperlyConfigured):
+                ticket_tokens.issue_token(self.ticket)
+
+    def test_check_in_and_bulk_verify(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        token = ticket_tokens.issue_token(self.ticket)
+        response = client.post('/tickets/verify-tokens/', {'tokens': [token, 'garbage']}, format='json')
+        self.assertEqual([r['valid'] for r in response.data['results']], [True, False])
+        self.assertEqual(response.data['results'][1]['error'], "Token vé không hợp lệ.")
+
+        url = '/tickets/check-in/'
+        self.assertEqual(client.post(url, {'token': token, 'event_id': self.event.pk}).status_code, 200)
+        self.assertEqual(client.post(url, {'token': token, 'event_id': self.event.pk}).status_code, 400)
+        self.ticket.refresh_from_db()
+        self.assertTrue(self.ticket.is_checked_in)
+
+
+# Gói dữ liệu soát vé offline: gói đầy đủ sắp xếp theo uuid, gói delta có check-in và vé bị xóa
+class GateBundleTest(TestCase):
+    def setUp(self):
+        self.event = create_event()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.tickets = [Ticket.objects.create(user=self.user, event=self.event) for _ in range(4)]
+        for ticket in self.tickets[:3]:
+            ticket.mark_as_paid(timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.event.organizer)
+
+    def fetch(self, **params):
+        response = self.client.get(f'/events/{self.event.pk}/gate-bundle/', params)
+        self.assertEqual(response.status_code, 200)
+        return gate_bundle.read_bundle(b''.join(response.streaming_content))
+
+    def test_full_and_delta_bundle(self):
+        kind, event_id, version, records = self.fetch()
+        self.assertEqual((kind, event_id), (gate_bundle.KIND_FULL, self.event.pk))
+        paid = sorted(ticket.uuid.bytes for ticket in self.tickets[:3])
+        self.assertEqual(list(records), paid)
+        self.assertEqual(set(records.values()), {gate_bundle.STATUS_VALID})
+
+        self.tickets[0].check_in()
+        self.tickets[1].delete()
+        kind, _, new_version, records = self.fetch(since=version)
+        self.assertEqual(kind, gate_bundle.KIND_DELTA)
+        self.assertGreaterEqual(new_version, version)
+        self.assertEqual(records[self.tickets[0].uuid.bytes], gate_bundle.STATUS_CHECKED_IN)
+        self.assertEqual(records[self.tickets[1].uuid.bytes], gate_bundle.STATUS_REVOKED)
+        # Vé giữ chỗ chưa từng thanh toán không có trên máy soát vé
+        self.assertNotIn(self.tickets[3].uuid.bytes, records)
+
+    def test_old_since_gets_full_bundle_and_tombstones_expire(self):
+        self.tickets[1].delete()
+        now = timezone.now() + gate_bundle.DELTA_MAX_AGE + timedelta(days=1)
+        since = gate_bundle.to_version(timezone.now() - timedelta(days=1))
+        kind, _, _, records = gate_bundle.read_bundle(b''.join(gate_bundle.iter_bundle(self.event.pk, since, now=now)))
+        self.assertEqual(kind, gate_bundle.KIND_FULL)
+        self.assertEqual(set(records), {self.tickets[0].uuid.bytes, self.tickets[2].uuid.bytes})
+
+        self.assertEqual(expiry.expire_tombstones(now=timezone.now()), 0)
+        self.assertEqual(expiry.expire_tombstones(now=now, chunk_size=1), 1)
+
+
+# Check-in theo lô: một UPDATE có điều kiện, gửi lại lô không đổi kết quả
+class BulkCheckInTest(TestCase):
+    def test_bulk_check_in_is_idempotent(self):
+        event = create_event()
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        paid = [Ticket.objects.create(user=user, event=event) for _ in range(2)]
+        for ticket in paid:
+            ticket.mark_as_paid(timezone.now())
+        unpaid = Ticket.objects.create(user=user, event=event)
+        paid[1].check_in('gate-0')
+
+        scanned_at = (timezone.now() - timedelta(minutes=1)).isoformat()
+        later = timezone.now().isoformat()
+        scans = [
+            {'uuid': str(paid[0].uuid), 'scanned_at': scanned_at, 'device_id': 'gate-1'},
+            {'uuid': str(paid[0].uuid), 'scanned_at': later, 'device_id': 'gate-2'},
+            {'uuid': str(paid[1].uuid), 'scanned_at': later, 'device_id': 'gate-1'},
+            {'uuid': str(unpaid.uuid), 'scanned_at': later, 'device_id': 'gate-1'},
+            {'uuid': 'not-a-uuid', 'scanned_at': later, 'device_id': 'gate-1'},
+        ]
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.assertNumQueries(2):
+            response = client.post('/tickets/bulk-check-in/', {'event_id': event.pk, 'scans': scans}, format='json')
+        expected = ['accepted', 'duplicate', 'duplicate', 'invalid', 'invalid']
+        self.assertEqual([r['result'] for r in response.data['results']], expected)
+        self.assertEqual(response.data['results'][2]['device_id'], 'gate-0')
+
+        response = client.post('/tickets/bulk-check-in/', {'event_id': event.pk, 'scans': scans}, format='json')
+        self.assertEqual([r['result'] for r in response.data['results']], expected)
+        paid[0].refresh_from_db()
+        self.assertEqual((paid[0].is_checked_in, paid[0].check_in_device), (True, 'gate-1'))
+
+    def test_scanned_at_is_taken_as_sent(self):
+        event = create_event()
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        tickets = [Ticket.objects.create(user=user, event=event) for _ in range(2)]
+        for ticket in tickets:
+            ticket.mark_as_paid(timezone.now())
+        client = APIClient()
+        client.force_authenticate(user)
+        # Thiếu, sai hoặc không có thật (30/2) thì lượt quét là 'invalid'; giờ trong tương lai được giữ nguyên
+        future = timezone.now() + timedelta(minutes=5)
+        scans = [
+            {'uuid': str(tickets[0].uuid), 'device_id': 'gate-1'},
+            {'uuid': str(tickets[0].uuid), 'scanned_at': 'garbage', 'device_id': 'gate-1'},
+            {'uuid': str(tickets[0].uuid), 'scanned_at': '2025-02-30T10:00:00', 'device_id': 'gate-1'},
+            {'uuid': str(tickets[1].uuid), 'scanned_at': future.isoformat(), 'device_id': 'gate-1'},
+        ]
+        response = client.post('/tickets/bulk-check-in/', {'scans': scans}, format='json')
+        self.assertEqual([r['result'] for r in response.data['results']], ['invalid', 'invalid', 'invalid', 'accepted'])
+        tickets[0].refresh_from_db()
+        tickets[1].refresh_from_db()
+        self.assertFalse(tickets[0].is_checked_in)
+        self.assertEqual(tickets[1].check_in_date, future)
+
+
+# Idempotency-Key: client gửi lại request thì nhận lại response cũ, không đặt thêm vé
+class IdempotencyKeyTest(TestCase):
+    def test_retry_replays_original_response(self):
+        event = create_event(total_tickets=5)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        first = client.post('/tickets/book-ticket/', {'event_id': event.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):
+            retry = client.post('/tickets/book-ticket/', {'event_id': event.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Ticket.objects.filter(event=event).count(), 1)
+
+        other = create_event(organizer=event.organizer, total_tickets=5)
+        response = client.post('/tickets/book-ticket/', {'event_id': other.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 422)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(purge_expired_keys(), 1)
+
+    def test_stale_in_flight_key_is_taken_over(self):
+        event = create_event(total_tickets=5)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        client = APIClient()
+        client.force_authenticate(user)
+        # Worker chết giữa chừng: record còn ở trạng thái đang xử lý
+        with mock.patch.object(Ticket, 'save', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                client.post('/tickets/book-ticket/', {'event_id': event.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertIsNone(IdempotencyKey.objects.get().status_code)
+
+        response = client.post('/tickets/book-ticket/', {'event_id': event.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 409)
+        IdempotencyKey.objects.update(created_at=timezone.now() - IDEMPOTENCY_LOCK_TIMEOUT)
+        response = client.post('/tickets/book-ticket/', {'event_id': event.pk}, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+
+# Thay đổi trạng thái vé được gom lại và áp dụng một lần khi commit
+class CommitTimeAggregationTest(TestCase):
+    def pay(self, count):
+        event = create_event(organizer=User.objects.create_user(
+            username=f'organizer{count}', email=f'organizer{count}@example.com', password='123', role='organizer'
+        ), total_tickets=count)
+        user = User.objects.create_user(username=f'buyer{count}', email=f'buyer{count}@example.com', password='123')
+        tickets = book_tickets(user, {event.pk: count})
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for ticket in tickets:
+                        ticket.mark_as_paid(timezone.now())
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (0, count))
+        self.assertEqual(event.trending_log.total_revenue, event.ticket_price * count)
+        return len(queries)
+
+    def test_signal_work_does_not_grow_with_ticket_count(self):
+        # Mỗi vé chỉ còn câu UPDATE của chính nó (kèm savepoint), phần bộ đếm/điểm trending là hằng số
+        one, two, ten = self.pay(1), self.pay(2), self.pay(10)
+        per_ticket = two - one
+        self.assertLessEqual(per_ticket, 3)
+        self.assertEqual(ten - one, 9 * per_ticket)
+
+    def test_rolled_back_savepoint_is_not_applied(self):
+        event = create_event(total_tickets=3)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        book_tickets(user, {event.pk: 3})
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                aggregation.record(event.pk, 'commit', 1)
+                try:
+                    with transaction.atomic():
+                        aggregation.record(event.pk, 'commit', 2)
+                        raise ValueError
+                except ValueError:
+                    pass
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (2, 1))
+
+
+# Chốt thanh toán: một UPDATE cho mọi vé, lượt dùng mã giảm giá chỉ được ghi nhận một lần
+class PaymentSettlementTest(TestCase):
+    def settle(self, count, discount_code=None):
+        event = create_event(organizer=User.objects.create_user(
+            username=f'organizer{count}', email=f'organizer{count}@example.com', password='123', role='organizer'
+        ), total_tickets=count)
+        user = User.objects.create_user(username=f'buyer{count}', email=f'buyer{count}@example.com', password='123')
+        tickets = book_tickets(user, {event.pk: count})
+        payment = Payment.objects.create(
+            user=user, amount=event.ticket_price * count, payment_method='momo',
+            transaction_id=f'tx-{count}', discount_code=discount_code,
+        )
+        Ticket.objects.filter(pk__in=[ticket.pk for ticket in tickets]).update(payment=payment)
+
+        payment.status = True
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                payment.save()
+        event.refresh_from_db()
+        self.assertEqual((event.reserved_tickets, event.sold_tickets), (0, count))
+        self.assertEqual(event.trending_log.total_revenue, event.ticket_price * count)
+        self.assertFalse(Ticket.objects.filter(payment=payment, is_paid=False).exists())
+        return payment, len(queries)
+
+    def test_query_count_does_not_depend_on_ticket_count(self):
+        _, one = self.settle(1)
+        _, ten = self.settle(10)
+        self.assertEqual(one, ten)
+
+    def test_discount_usage_recorded_once(self):
+        now = timezone.now()
+        code = DiscountCode.objects.create(
+            code='SALE', discount_percentage=10, valid_from=now - timedelta(days=1),
+            valid_to=now + timedelta(days=1), max_uses=1,
+        )
+        payment, _ = self.settle(2, discount_code=code)
+        payment.save()
+        code.refresh_from_db()
+        self.assertEqual((code.used_count, code.is_active), (1, False))
+
+    def test_discount_used_up_after_validation_rolls_back_payment(self):
+        now = timezone.now()
+        code = DiscountCode.objects.create(
+            code='SALE', discount_percentage=10, valid_from=now - timedelta(days=1),
+            valid_to=now + timedelta(days=1), max_uses=1, user_group='new',
+        )
+        event = create_event()
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        book_tickets(user, {event.pk: 1})
+        client = APIClient()
+        client.force_authenticate(user)
+
+        use_discount_code = Payment.use_discount_code
+
+        def used_up_meanwhile(payment):
+            # Request khác dùng hết lượt sau khi view đã kiểm tra mã
+            DiscountCode.objects.filter(pk=code.pk).update(used_count=1)
+            return use_discount_code(payment)
+
+        with mock.patch.object(Payment, 'use_discount_code', used_up_meanwhile):
+            response = client.post('/payments/pay-unpaid-tickets/', {'event_id': event.pk, 'discount_code_id': code.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(Ticket.objects.filter(payment__isnull=False).exists())
+
+    def test_tickets_taken_meanwhile_roll_back_payment(self):
+        event = create_event()
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        tickets = book_tickets(user, {event.pk: 2})
+        client = APIClient()
+        client.force_authenticate(user)
+
+        save = Payment.save
+
+        def swept_meanwhile(payment, *args, **kwargs):
+            # Một vé hết hạn và bị dọn trước khi view gắn vé vào payment
+            Ticket.objects.filter(pk=tickets[0].pk).update(hold_expires_at=timezone.now())
+            return save(payment, *args, **kwargs)
+
+        with mock.patch.object(Payment, 'save', swept_meanwhile):
+            response = client.post('/payments/pay-unpaid-tickets/', {'event_id': event.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+        # Vé đã gắn với một payment thì không tạo thêm payment thứ hai
+        Ticket.objects.filter(pk=tickets[0].pk).delete()
+        self.assertEqual(client.post('/payments/pay-unpaid-tickets/', {'event_id': event.pk}).status_code, 200)
+        self.assertEqual(client.post('/payments/pay-unpaid-tickets/', {'event_id': event.pk}).status_code, 400)
+        self.assertEqual(Payment.objects.count(), 1)
+
+
+# Theo dõi trường thay đổi (TrackChangesMixin): signal không phải truy vấn lại bản ghi cũ
+class TrackChangesTest(TestCase):
+    def setUp(self):
+        self.event = create_event()
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+
+    def test_changed_fields_and_previous_value(self):
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual(event.changed_fields, set())
+        event.title = 'Đổi tên'
+        self.assertEqual((event.changed_fields, event.previous_value('title')), ({'title'}, 'Flash sale'))
+        event.save()
+        self.assertEqual(event.changed_fields, set())
+
+    def test_payment_status_transitions_update_total_spent(self):
+        payment = Payment.objects.create(user=self.user, amount=Decimal('100'), payment_method='momo', transaction_id='tx')
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.status = True
+        with CaptureQueriesContext(connection) as ctx:
+            payment.save()
+        self.assertFalse([q for q in ctx.captured_queries if 'events_payment' in q['sql'] and q['sql'].startswith('SELECT')])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_spent, Decimal('100'))
+
+        payment.amount = Decimal('80')
+        payment.save()
+        payment.status = False
+        payment.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_spent, Decimal('0'))
+
+    def test_event_update_notice_only_for_important_changes(self):
+        event = Event.objects.get(pk=self.event.pk)
+        event.description = 'Mô tả mới'
+        event.save()
+        self.assertFalse(PendingEventUpdate.objects.exists())
+        event.location = 'Hà Nội'
+        event.save()
+        self.assertEqual(PendingEventUpdate.objects.get().original_values, {'location': 'HCM'})
+
+
+# Tính lại điểm trending theo lô bằng NumPy cho kết quả giống calculate_score từng dòng
+class TrendingRescoreTest(TestCase):
+    def test_rescore_matches_calculate_score(self):
+        organizer = User.objects.create_user(
+            username='organizer', email='organizer@example.com', password='123', role='organizer'
+        )
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        events = [create_event(organizer=organizer, total_tickets=total) for total in (10, 20, 0)]
+        Event.objects.filter(pk=events[0].pk).update(sold_tickets=4)
+        Review.objects.create(event=events[1], user=user, rating=5)
+        now = timezone.now()
+        EventTrendingLog.objects.filter(event=events[1]).update(
+            recent_sales=3.5, recent_views=42, recent_reviews=1, decayed_through=now - timedelta(hours=5)
+        )
+        EventTrendingLog.objects.filter(event=events[2]).delete()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(rescore_all(now=now), 3)
+        # Ba truy vấn lấy số liệu, một INSERT trending log còn thiếu, một UPDATE cho cả lô
+        self.assertEqual(len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]), 5)
+
+        for event in events:
+            log = EventTrendingLog.objects.select_related('event').get(event=event)
+            scores = (log.trending_score, log.interest_score)
+            log.calculate_score(now)
+            self.assertEqual(scores, (Decimal(str(log.trending_score)), Decimal(str(log.interest_score))))
+
+
+# Bucket hoạt động theo giờ: đóng bucket cộng vào tổng suy giảm, bucket cũ được gộp theo ngày
+class ActivityBucketTest(TestCase):
+    def setUp(self):
+        self.event = create_event()
+        self.hour = activity.bucket_start()
+
+    def add_bucket(self, hours_ago, **values):
+        EventActivityBucket.objects.create(event=self.event, start=self.hour - timedelta(hours=hours_ago), **values)
+
+    def test_record_accumulates_in_current_hour(self):
+        activity.record(self.event.pk, sales=2)
+        activity.record(self.event.pk, views=1)
+        bucket = EventActivityBucket.objects.get(event=self.event)
+        self.assertEqual((bucket.start, bucket.sales, bucket.views, bucket.reviews), (self.hour, 2, 1, 0))
+
+    def test_close_buckets_decays_old_sales(self):
+        self.add_bucket(1, sales=10, views=4)
+        self.add_bucket(int(TRENDING_HALF_LIFE / timedelta(hours=1)) + 1, sales=10)
+        self.add_bucket(0, sales=99)  # giờ hiện tại chưa đóng
+
+        self.assertEqual(activity.close_buckets(self.hour), [self.event.pk])
+        log = EventTrendingLog.objects.get(event=self.event)
+        self.assertAlmostEqual(log.recent_sales, 15)
+        self.assertEqual((log.recent_views, log.view_count, log.decayed_through), (4, 4, self.hour))
+        # Đóng lại lần nữa không cộng trùng; sau một chu kỳ bán rã tổng còn một nửa
+        self.assertEqual(activity.close_buckets(self.hour), [])
+        log.refresh_from_db()
+        self.assertAlmostEqual(log.recent_activity(self.hour + TRENDING_HALF_LIFE)[0], 7.5)
+
+        # Sự kiện bán hết từ lâu không còn được tính là trending
+        Event.objects.filter(pk=self.event.pk).update(sold_tickets=10)
+        rescore_all(now=self.hour)
+        recent = EventTrendingLog.objects.get(event=self.event).trending_score
+        rescore_all(now=self.hour + 10 * TRENDING_HALF_LIFE)
+        self.assertLess(EventTrendingLog.objects.get(event=self.event).trending_score, recent)
+
+    def test_overlapping_runs_count_buckets_once(self):
+        self.add_bucket(1, sales=10, views=4)
+        bulk_create = EventTrendingLog.objects.bulk_create
+        runs = []
+
+        def other_run_commits_first(*args, **kwargs):
+            # Lần chạy khác đã đọc cùng bucket và commit trước khi lần này lấy được khóa
+            if not runs:
+                runs.append(None)
+                runs.append(activity.close_buckets(self.hour))
+            return bulk_create(*args, **kwargs)
+
+        with mock.patch.object(EventTrendingLog.objects, 'bulk_create', other_run_commits_first):
+            self.assertEqual(activity.close_buckets(self.hour), [])
+        self.assertEqual(runs, [None, [self.event.pk]])
+        log = EventTrendingLog.objects.get(event=self.event)
+        self.assertEqual((log.recent_sales, log.view_count), (10, 4))
+
+    def test_roll_up_old_buckets(self):
+        now = self.hour.replace(hour=12)
+        day = now.replace(hour=0) - activity.HOURLY_RETENTION - timedelta(days=1)
+        for hour in (1, 5):
+            EventActivityBucket.objects.create(event=self.event, start=day + timedelta(hours=hour), sales=hour, views=1)
+        self.add_bucket(1, sales=1)
+        EventActivityBucket.objects.create(
+            event=self.event, span=EventActivityBucket.DAILY, start=now - activity.DAILY_RETENTION - timedelta(days=1)
+        )
+        activity.close_buckets(now)
+
+        self.assertEqual(activity.roll_up_buckets(now), (2, 1))
+        daily = EventActivityBucket.objects.get(event=self.event, span=EventActivityBucket.DAILY)
+        self.assertEqual((daily.start, daily.sales, daily.views), (day, 6, 2))
+        self.assertEqual(EventActivityBucket.objects.filter(span=EventActivityBucket.HOURLY).count(), 1)
+
+
+# Thông báo chung lưu một lần, trạng thái đọc theo mốc của user và dòng đọc riêng
+class BroadcastNotificationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def unread(self):
+        return self.client.get('/notifications/unread-count/').data['unread_count']
+
+    def test_broadcast_is_not_fanned_out(self):
+        User.objects.create_user(username='other', email='other@example.com', password='123')
+        first = Notification.objects.create(title='Bảo trì', message='...')
+        second = Notification.objects.create(title='Khuyến mãi', message='...')
+        self.assertTrue(first.is_broadcast)
+        self.assertFalse(UserNotification.objects.exists())
+        self.assertEqual(self.unread(), 2)
+
+        self.client.post(f'/notifications/{first.pk}/mark-as-read/')
+        data = self.client.get('/notifications/my-notifications/').data['results']
+        self.assertEqual([(n['id'], n['is_read']) for n in data], [(second.pk, False), (first.pk, True)])
+        self.assertEqual(self.unread(), 1)
+
+    def test_mark_all_read_merges_targeted_and_broadcast(self):
+        event = create_event()
+        book_tickets(self.user, {event.pk: 1})
+        Notification.objects.create(event=event, title='Đổi giờ', message='...')
+        Notification.objects.create(title='Bảo trì', message='...')
+        fanout.run_pending()
+        self.assertEqual(self.unread(), 2)
+
+        self.client.post('/notifications/mark-all-as-read/')
+        self.assertEqual(self.unread(), 0)
+        later = Notification.objects.create(title='Mới', message='...')
+        data = self.client.get('/notifications/my-notifications/').data['results']
+        self.assertEqual([n['is_read'] for n in data], [False, True, True])
+        self.assertEqual(data[0]['id'], later.pk)
+
+
+# Gửi thông báo sự kiện chạy nền theo lô, chạy tiếp được sau khi bị gián đoạn
+class NotificationFanoutTest(TestCase):
+    def setUp(self):
+        self.event = create_event()
+        for i in range(5):
+            user = User.objects.create_user(username=f'buyer{i}', email=f'buyer{i}@example.com', password='123')
+            book_tickets(user, {self.event.pk: 1})
+
+    def test_event_update_is_delivered_in_background(self):
+        self.event.title = 'Đổi tên'
+        self.event.save()
+        event_updates.flush_due(now=timezone.now() + event_updates.QUIET_PERIOD)
+        notification = self.event.event_notifications.get()
+        self.assertFalse(UserNotification.objects.exists())
+        self.assertEqual(notification.fanout.status, 'pending')
+
+        self.assertEqual(fanout.run_pending(batch_size=2), 1)
+        job = NotificationFanout.objects.get(pk=notification.pk)
+        self.assertEqual((job.status, job.delivered, job.total), ('done', 5, 5))
+        self.assertEqual(UserNotification.objects.filter(notification=notification).count(), 5)
+
+    def test_resume_after_crash(self):
+        notification = Notification.objects.create(event=self.event, title='Nhắc lịch', message='...')
+
+        def crash(job):
+            raise RuntimeError('worker chết giữa chừng')
+
+        job = fanout.claim_next()
+        with self.assertRaises(RuntimeError):
+            fanout.run(job, batch_size=2, progress=crash)
+        # Job còn trong thời gian giữ thì worker khác không nhận
+        self.assertIsNone(fanout.claim_next())
+        self.assertEqual(UserNotification.objects.filter(notification=notification).count(), 2)
+
+        job = fanout.claim_next(now=timezone.now() + fanout.FANOUT_LEASE * 2)
+        self.assertEqual((job.attempts, job.delivered), (2, 2))
+        fanout.run(job, batch_size=2)
+        self.assertEqual(UserNotification.objects.filter(notification=notification).count(), 5)
+        self.assertEqual(NotificationFanout.objects.get(pk=notification.pk).delivered, 5)
+
+    def test_delivered_counts_inserted_rows_only(self):
+        notification = Notification.objects.create(event=self.event, title='Nhắc lịch', message='...')
+        owner = self.event.tickets.order_by('user_id').first().user_id
+        UserNotification.objects.create(user_id=owner, notification=notification)
+
+        fanout.run(fanout.claim_next(), batch_size=2)
+        job = NotificationFanout.objects.get(pk=notification.pk)
+        self.assertEqual((job.delivered, job.total), (4, 5))
+        self.assertEqual(UserNotification.objects.filter(notification=notification).count(), 5)
+
+
+# Các lần sửa sự kiện liên tiếp được gộp thành một thông báo sau khoảng lặng
+class EventUpdateCoalescingTest(TestCase):
+    def setUp(self):
+        self.event = Event.objects.get(pk=create_event().pk)
+
+    def test_edits_within_quiet_period_merge_into_one_notice(self):
+        for title in ('Flash sael', 'Flash sale!', 'Flash Sale 2025'):
+            self.event.title = title
+            self.event.save()
+        self.event.location = 'Hà Nội'
+        self.event.save()
+        self.assertFalse(Notification.objects.exists())
+
+        self.assertEqual(event_updates.flush_due(), 0)
+        self.assertEqual(event_updates.flush_due(now=timezone.now() + event_updates.QUIET_PERIOD), 1)
+        notification = Notification.objects.get()
+        self.assertIn('tên sự kiện, địa điểm', notification.message)
+        self.assertFalse(PendingEventUpdate.objects.exists())
+
+    def test_reverted_edit_sends_nothing(self):
+        self.event.location = 'Hà Nội'
+        self.event.save()
+        self.event.location = 'HCM'
+        self.event.save()
+        self.assertEqual(event_updates.flush_due(now=timezone.now() + event_updates.MAX_DELAY), 0)
+        self.assertFalse(PendingEventUpdate.objects.exists())
+
+
+# Tắt hàng loạt sự kiện đã kết thúc và mã giảm giá hết hạn/hết lượt
+class ExpireStaleRecordsTest(TestCase):
+    def test_expire_in_chunks(self):
+        now = timezone.now()
+        organizer = User.objects.create_user(
+            username='organizer', email='organizer@example.com', password='123', role='organizer'
+        )
+        events = [create_event(organizer=organizer) for _ in range(3)]
+        Event.objects.filter(pk__in=[e.pk for e in events[:2]]).update(
+            start_time=now - timedelta(days=2), end_time=now - timedelta(days=1)
+        )
+        codes = [
+            DiscountCode.objects.create(
+                code=f'CODE{i}', discount_percentage=10, valid_from=now - timedelta(days=1),
+                valid_to=now + timedelta(days=1), max_uses=5,
+            )
+            for i in range(3)
+        ]
+        DiscountCode.objects.filter(pk=codes[0].pk).update(valid_to=now - timedelta(hours=1))
+        DiscountCode.objects.filter(pk=codes[1].pk).update(used_count=5)
+
+        self.assertEqual(expiry.expire_events(chunk_size=1), 2)
+        self.assertEqual(expiry.expire_discount_codes(chunk_size=1), 2)
+        self.assertEqual(list(Event.objects.filter(is_active=True)), [events[2]])
+        self.assertEqual(list(DiscountCode.objects.filter(is_active=True)), [codes[2]])
+        self.assertEqual((expiry.expire_events(), expiry.expire_discount_codes()), (0, 0))
+
+
+# Chi tiết sự kiện: trang đầu của danh sách con, số truy vấn không phụ thuộc số review/tin nhắn
+class EventDetailTest(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def event_with_activity(self, count):
+        event = create_event(organizer=User.objects.create_user(
+            username=f'organizer{count}', email=f'organizer{count}@example.com', password='123', role='organizer'
+        ))
+        for i in range(count):
+            user = User.objects.create_user(username=f'u{count}-{i}', email=f'u{count}-{i}@example.com', password='123')
+            Review.objects.create(event=event, user=user, rating=5, comment='Hay')
+            ChatMessage.objects.create(event=event, sender=user, receiver=event.organizer, message='Xin chào')
+        return event
+
+    def get(self, event, query=''):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/events/{event.pk}/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(ctx.captured_queries)
+
+    def test_first_page_and_fixed_query_budget(self):
+        _, few = self.get(self.event_with_activity(1))
+        data, many = self.get(self.event_with_activity(12))
+        self.assertEqual(few, many)
+        self.assertEqual((len(data['reviews']), data['review_count']), (5, 12))
+        self.assertEqual((len(data['chat_messages']), data['chat_message_count']), (5, 12))
+        self.assertNotIn('discount_codes', data)
+
+    def test_expand(self):
+        data, _ = self.get(self.event_with_activity(12), '?expand=reviews,discount_codes')
+        self.assertEqual((len(data['reviews']), len(data['chat_messages'])), (12, 5))
+        self.assertEqual(data['discount_codes'], [])
+
+
+# ?fields= / ?omit=: chỉ trả và chỉ nạp các trường được chọn
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], [query['sql'] for query in ctx.captured_queries]
+
+    def buy(self, count):
+        event = create_event(organizer=User.objects.create_user(
+            username=f'organizer{count}', email=f'organizer{count}@example.com', password='123', role='organizer'
+        ))
+        payment = Payment.objects.create(
+            user=self.user, amount=event.ticket_price * count, payment_method='momo', transaction_id=f'tx-{count}'
+        )
+        Ticket.objects.filter(pk__in=[t.pk for t in book_tickets(self.user, {event.pk: count})]).update(payment=payment)
+
+    def test_event_list_selects_requested_columns(self):
+        create_event()
+        results, queries = self.get('/events/?fields=id,title')
+        self.assertEqual(set(results[0]), {'id', 'title'})
+        self.assertNotIn('"description"', queries[-1])
+
+    def test_related_manager_pages_keep_query_count(self):
+        self.buy(3)
+        self.buy(6)
+        for url in ('/users/tickets/?fields=id,event_title', '/users/payments/?fields=id,amount'):
+            _, plain = self.get(url.split('?')[0])
+            results, sparse = self.get(url)
+            self.assertEqual(set(results[0]), set(url.split('=')[1].split(',')))
+            self.assertLessEqual(len(sparse), len(plain))
+
+    def test_omit_nested_tickets(self):
+        self.buy(1)
+        self.buy(3)
+        results, queries = self.get('/payments/?fields=id,amount,tickets&omit=tickets')
+        self.assertEqual(set(results[0]), {'id', 'amount'})
+        self.assertFalse(any('events_ticket' in sql for sql in queries))
+
+        results, queries = self.get('/payments/?fields=id,tickets')
+        self.assertEqual(sorted(len(payment['tickets']) for payment in results), [1, 3])
+        self.assertLessEqual({'event_title', 'token'}, set(results[0]['tickets'][0]))
+        # Trang payment + prefetch vé (kèm sự kiện), không truy vấn theo từng vé
+        self.assertEqual(len([sql for sql in queries if 'SAVEPOINT' not in sql]), 3)
+
+
+# is_read, read_at, event_title tính trong truy vấn lấy trang thông báo
+class NotificationReadStateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.event = create_event()
+        notifications = [
+            Notification.objects.create(event=self.event, title=f'Cập nhật {i}', message='...') for i in range(30)
+        ]
+        UserNotification.objects.bulk_create([
+            UserNotification(user=self.user, notification=n, is_read=i % 2 == 0,
+                             read_at=timezone.now() if i % 2 == 0 else None)
+            for i, n in enumerate(notifications)
+        ])
+        cache.clear()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']])
+
+    def test_page_costs_two_queries(self):
+        for url in ('/notifications/my-notifications/?page_size=30',
+                    f'/notifications/event-notifications/?event_id={self.event.pk}&page_size=30'):
+            results, queries = self.get(url)
+            self.assertEqual(len(results), 30)
+            self.assertEqual(queries, 2)
+            self.assertEqual({n['event_title'] for n in results}, {'Flash sale'})
+            self.assertEqual(sum(n['is_read'] for n in results), 15)
+            self.assertTrue(all(bool(n['read_at']) == n['is_read'] for n in results))
+
+    def test_broadcast_below_mark_uses_mark_as_read_at(self):
+        Notification.objects.create(title='Bảo trì', message='...')
+        self.client.post('/notifications/mark-all-as-read/')
+        results, _ = self.get('/notifications/my-notifications/?page_size=1')
+        self.assertIsNone(results[0]['event_title'])
+        self.assertTrue(results[0]['is_read'])
+        self.assertIsNotNone(results[0]['read_at'])
+
+
+# ?cursor=: phân trang keyset, không COUNT(*)/OFFSET
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(20):
+            Notification.objects.create(title=f'Thông báo {i}', message='...')
+        cache.clear()
+
+    def test_walks_all_pages_without_count(self):
+        url, seen = '/notifications/my-notifications/?cursor=&page_size=8', []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).data
+            self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+            seen += [n['id'] for n in data['results']]
+            url = data['next']
+        expected = list(Notification.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_numbers_still_work(self):
+        data = self.client.get('/notifications/my-notifications/?page=3&page_size=8').data
+        self.assertEqual((data['count'], len(data['results'])), (20, 4))
+
+    def test_own_review_returned_separately(self):
+        event = create_event()
+        own = Review.objects.create(event=event, user=self.user, rating=4)
+        for i in range(3):
+            other = User.objects.create_user(username=f'reviewer{i}', email=f'reviewer{i}@example.com', password='123')
+            Review.objects.create(event=event, user=other, rating=5)
+
+        data = self.client.get(f'/reviews/?event_id={event.pk}&cursor=&page_size=2').data
+        self.assertEqual([r['id'] for r in data['own_reviews']], [own.pk])
+        seen = [r['id'] for r in data['results']]
+        data = self.client.get(data['next']).data
+        self.assertNotIn('own_reviews', data)
+        seen += [r['id'] for r in data['results']]
+        expected = Review.objects.exclude(pk=own.pk).order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+        # ?page= giữ thứ tự cũ: review của user hiện tại đứng đầu
+        self.assertEqual(self.client.get(f'/reviews/?event_id={event.pk}').data['results'][0]['id'], own.pk)
+
+
+# Phân trang không COUNT(*): has_next từ page_size + 1 dòng, count ước lượng hoặc lưu cache
+class CountFreePaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        book_tickets(self.user, {create_event().pk: 5})
+        cache.clear()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, sum('COUNT(' in q['sql'] for q in ctx.captured_queries)
+
+    def test_cached_count(self):
+        response, counts = self.get('/tickets/?page_size=2')
+        self.assertEqual((response.data['count'], response.data['has_next'], counts), (5, True, 1))
+        response, counts = self.get('/tickets/?page_size=2&page=3')
+        self.assertEqual((len(response.data['results']), response.data['has_next'], counts), (1, False, 0))
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.get('/tickets/?page_size=2&page=4')[0].status_code, 404)
+
+    def test_last_page(self):
+        response, counts = self.get('/tickets/?page_size=2&page=last')
+        self.assertEqual((len(response.data['results']), response.data['count'], counts), (1, 5, 1))
+        self.assertIsNone(response.data['next'])
+        self.assertIn('page=2', response.data['previous'])
+        # Không đếm thì không biết trang cuối
+        with mock.patch.object(TicketViewSet, 'count_mode', 'none'):
+            self.assertEqual(self.get('/tickets/?page=last')[0].status_code, 400)
+
+    def test_count_free_and_estimate_modes(self):
+        request = Request(APIRequestFactory().get('/tickets/', {'page_size': 2, 'page': 2}))
+        for mode, count in (('none', None), ('estimate', 5)):
+            paginator = ItemPaginator()
+            view = type('View', (), {'count_mode': mode})
+            page = paginator.paginate_queryset(Ticket.objects.filter(user=self.user), request, view=view)
+            data = paginator.get_paginated_response([t.pk for t in page]).data
+            self.assertEqual((data['count'], data['has_next'], len(data['results'])), (count, True, 2))
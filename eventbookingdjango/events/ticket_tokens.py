@@ -0,0 +1,117 @@
+# Token vé ký HMAC để máy soát vé kiểm tra tại cổng mà không cần gọi API/DB.
+#
+# Token (base64url, 56 ký tự) gồm: phiên bản, mã khóa (kid), ticket_id, event_id, khoảng thời gian
+# hiệu lực và 16 byte đầu của HMAC-SHA256. Khóa ký là khóa riêng của từng sự kiện, suy ra từ khóa
+# gốc: máy soát vé chỉ nhận khóa của sự kiện mình phụ trách (GET /events/{id}/gate-keys/), không
+# bao giờ biết khóa gốc.
+#
+# Đổi khóa: thêm khóa mới vào TICKET_SIGNING_KEYS và trỏ TICKET_SIGNING_KEY_ID sang nó. Token mới
+# ký bằng khóa mới, token cũ vẫn hợp lệ cho tới khi khóa cũ bị xóa khỏi danh sách.
+#
+#   TICKET_SIGNING_KEYS = {1: 'khóa-cũ', 2: 'khóa-mới'}  # kid từ 0 đến 255 (một byte trong token)
+#   TICKET_SIGNING_KEY_ID = 2
+#   TICKET_TOKEN_LEEWAY_SECONDS = 6 * 3600  # cho vào trước giờ bắt đầu / sau giờ kết thúc
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+
+TOKEN_VERSION = 1
+# version, kid, ticket_id, event_id, not_before, not_after
+PAYLOAD = struct.Struct('>BBQQII')
+MAC_SIZE = 16
+# Số token tối đa trong một lần gọi /tickets/verify-tokens/
+MAX_VERIFY_BATCH = getattr(settings, 'TICKET_TOKEN_VERIFY_BATCH', 1000)
+
+TicketToken = namedtuple('TicketToken', ['ticket_id', 'event_id', 'not_before', 'not_after', 'kid'])
+
+
+def get_signing_keys():
+    """
+    Trả về (kid hiện tại, {kid: khóa gốc dạng bytes}).
+    Raise ImproperlyConfigured nếu kid nằm ngoài 0..255 hoặc TICKET_SIGNING_KEY_ID không có trong danh sách.
+    """
+    keys = getattr(settings, 'TICKET_SIGNING_KEYS', None) or {1: settings.SECRET_KEY}
+    keys = {int(kid): key.encode() if isinstance(key, str) else key for kid, key in keys.items()}
+    invalid = [kid for kid in keys if not 0 <= kid <= 255]
+    if invalid:
+        raise ImproperlyConfigured(f"TICKET_SIGNING_KEYS: kid phải từ 0 đến 255, nhận được {invalid}.")
+    kid = getattr(settings, 'TICKET_SIGNING_KEY_ID', max(keys))
+    if kid not in keys:
+        raise ImproperlyConfigured(f"TICKET_SIGNING_KEY_ID = {kid} không có trong TICKET_SIGNING_KEYS.")
+    return kid, keys
+
+
+def derive_event_key(master_key, event_id):
+    return hmac.new(master_key, b'events.ticket_tokens:event:%d' % event_id, hashlib.sha256).digest()
+
+
+def get_event_keys(event_id):
+    """Khóa riêng của sự kiện theo từng kid, dùng để cấp cho máy soát vé."""
+    _, keys = get_signing_keys()
+    return {kid: derive_event_key(key, event_id) for kid, key in keys.items()}
+
+
+def _mac(key, payload):
+    return hmac.new(key, payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _decode(token):
+    return base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+
+
+def issue_token(ticket):
+    """Tạo token cho vé; không đổi nếu thông tin sự kiện và khóa không đổi (ảnh QR cache được)."""
+    kid, keys = get_signing_keys()
+    leeway = getattr(settings, 'TICKET_TOKEN_LEEWAY_SECONDS', 6 * 3600)
+    event = ticket.event
+    payload = PAYLOAD.pack(
+        TOKEN_VERSION, kid, ticket.pk, event.pk,
+        int(event.start_time.timestamp()) - leeway, int(event.end_time.timestamp()) + leeway,
+    )
+    return _encode(payload + _mac(derive_event_key(keys[kid], event.pk), payload))
+
+
+def verify_token(token, event_id=None, now=None):
+    """
+    Kiểm tra chữ ký và thời hạn của token, trả về TicketToken.
+    Raise signing.BadSignature nếu token sai, khóa không còn hiệu lực hoặc không thuộc sự kiện
+    `event_id`; signing.SignatureExpired nếu ngoài khoảng thời gian hiệu lực.
+    """
+    try:
+        raw = _decode(token)
+    except (binascii.Error, TypeError, ValueError):
+        raise signing.BadSignature("Token không hợp lệ.")
+    if len(raw) != PAYLOAD.size + MAC_SIZE:
+        raise signing.BadSignature("Token không hợp lệ.")
+
+    payload, mac = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+    version, kid, ticket_id, token_event_id, not_before, not_after = PAYLOAD.unpack(payload)
+    _, keys = get_signing_keys()
+    if version != TOKEN_VERSION or kid not in keys:
+        raise signing.BadSignature("Token dùng khóa không còn hiệu lực.")
+    if not hmac.compare_digest(mac, _mac(derive_event_key(keys[kid], token_event_id), payload)):
+        raise signing.BadSignature("Chữ ký token không hợp lệ.")
+    if event_id is not None and token_event_id != int(event_id):
+        raise signing.BadSignature("Vé không thuộc sự kiện này.")
+
+    now = time.time() if now is None else now
+    if not not_before <= now <= not_after:
+        raise signing.SignatureExpired("Vé chưa đến hoặc đã quá thời gian sử dụng.")
+    return TicketToken(ticket_id, token_event_id, not_before, not_after, kid)
+
+
+def ticket_qr_data(ticket):
+    """Nội dung mã QR: token đã ký cho vé đã thanh toán, uuid cho vé còn đang giữ chỗ."""
+    return issue_token(ticket) if ticket.is_paid else str(ticket.uuid)
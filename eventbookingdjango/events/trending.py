@@ -0,0 +1,93 @@
+# Tính lại điểm trending/interest cho mọi sự kiện đang hoạt động theo lô bằng NumPy.
+#
+# EventTrendingLog.calculate_score chỉ chạy khi có vé thay đổi nên điểm của sự kiện không bán được
+# vé không bao giờ giảm theo thời gian. Lệnh `python manage.py rescore_trending` (chạy định kỳ bằng
+# Cron Jobs) lấy số liệu của tất cả sự kiện bằng vài truy vấn tổng hợp, tính điểm trên mảng NumPy
+# rồi ghi lại bằng bulk_update theo từng khối. Công thức giống hệt EventTrendingLog.compute_scores,
+# hoạt động gần đây được suy giảm tới thời điểm chạy như EventTrendingLog.recent_activity.
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import TRENDING_HALF_LIFE, Event, EventTrendingLog, Review
+
+RESCORE_CHUNK_SIZE = 2000
+
+
+def compute_scores(sold, total, reviews, recent_sales, recent_views, recent_reviews):
+    """Phiên bản vector hóa của EventTrendingLog.compute_scores, trả về (trending, interest)."""
+    sold = np.asarray(sold, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+
+    sold_ratio = np.divide(sold, total, out=np.zeros_like(sold), where=total != 0)
+    trending = np.round(
+        sold_ratio * 0.5 + np.asarray(recent_sales) * 0.3 + np.log1p(recent_views) * 0.2 + np.asarray(recent_reviews) * 0.1,
+        4
+    )
+    interest = np.round(trending * 0.5 + sold * 0.3 + np.asarray(reviews, dtype=np.float64) * 0.2, 4)
+    return trending, interest
+
+
+def decay_to(metrics, now):
+    """Suy giảm recent_* từ decayed_through của từng sự kiện tới `now`, trả về (sales, views, reviews)."""
+    elapsed = np.maximum(now.timestamp() - metrics['through'], 0)
+    factor = np.where(np.isnan(elapsed), 1.0, 0.5 ** (np.nan_to_num(elapsed) / TRENDING_HALF_LIFE.total_seconds()))
+    return metrics['recent_sales'] * factor, metrics['recent_views'] * factor, metrics['recent_reviews'] * factor
+
+
+def load_metrics(event_ids=None):
+    """
+    Lấy số liệu cho các sự kiện đang hoạt động (hoặc `event_ids`) bằng ba truy vấn, trả về dict các
+    mảng NumPy: ids, sold, total, reviews, recent_sales, recent_views, recent_reviews, through
+    (timestamp của decayed_through, NaN nếu chưa có), has_log.
+    """
+    events = Event.objects.filter(is_active=True) if event_ids is None else Event.objects.filter(pk__in=event_ids)
+    rows = list(events.order_by().values_list('pk', 'sold_tickets', 'total_tickets'))
+    review_counts = dict(
+        Review.objects.filter(event__in=events).order_by()
+        .values('event').annotate(n=Count('pk')).values_list('event', 'n')
+    )
+    activity = {
+        row[0]: row[1:] for row in
+        EventTrendingLog.objects.filter(event__in=events).order_by()
+        .values_list('event_id', 'recent_sales', 'recent_views', 'recent_reviews', 'decayed_through')
+    }
+
+    ids = [row[0] for row in rows]
+    recent = [activity.get(pk, (0, 0, 0, None)) for pk in ids]
+    return {
+        'ids': np.array(ids, dtype=np.int64),
+        'sold': np.array([row[1] for row in rows], dtype=np.int64),
+        'total': np.array([row[2] for row in rows], dtype=np.int64),
+        'reviews': np.array([review_counts.get(pk, 0) for pk in ids], dtype=np.int64),
+        'recent_sales': np.array([r[0] for r in recent], dtype=np.float64),
+        'recent_views': np.array([r[1] for r in recent], dtype=np.float64),
+        'recent_reviews': np.array([r[2] for r in recent], dtype=np.float64),
+        'through': np.array([r[3].timestamp() if r[3] else np.nan for r in recent], dtype=np.float64),
+        'has_log': np.array([pk in activity for pk in ids], dtype=bool),
+    }
+
+
+def rescore_all(event_ids=None, chunk_size=RESCORE_CHUNK_SIZE, now=None):
+    """Tính lại và lưu điểm cho các sự kiện, trả về số sự kiện đã cập nhật."""
+    metrics = load_metrics(event_ids)
+    ids = metrics['ids']
+    if not len(ids):
+        return 0
+    trending, interest = compute_scores(
+        metrics['sold'], metrics['total'], metrics['reviews'], *decay_to(metrics, now or timezone.now())
+    )
+
+    logs = [
+        EventTrendingLog(event_id=pk, trending_score=t, interest_score=i)
+        for pk, t, i in zip(ids.tolist(), trending.tolist(), interest.tolist())
+    ]
+    with transaction.atomic():
+        # Sự kiện cũ chưa có trending log
+        EventTrendingLog.objects.bulk_create(
+            [EventTrendingLog(event_id=pk) for pk in ids[~metrics['has_log']].tolist()],
+            batch_size=chunk_size, ignore_conflicts=True
+        )
+        EventTrendingLog.objects.bulk_update(logs, ['trending_score', 'interest_score'], batch_size=chunk_size)
+    return len(logs)
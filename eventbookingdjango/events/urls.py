@@ -1,5 +1,5 @@
 from .views import PaymentViewSet
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from . import views
 
@@ -19,5 +19,6 @@ router.register('reviews', views.ReviewViewSet, basename='review')
 # Định nghĩa các URL patterns
 urlpatterns = [
     path('', include(router.urls)),
+    re_path(r'^tickets/(?P<pk>\d+)/qr\.(?P<fmt>png|svg)$', views.TicketViewSet.as_view({'get': 'qr_code'}), name='ticket-qr'),
     path('payments/webhook/', PaymentViewSet.as_view({'post': 'payment_webhook'}), name='payment-webhook'),
 ]
@@ -7,35 +7,63 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
 from django.db.models import Count, Avg, Q, F, Case, When, IntegerField
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core import signing
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 import uuid
-import qrcode
-import io
 import base64
 from .models import (
     User, Event, Tag, Ticket, Payment, Review, DiscountCode, Notification,
-    ChatMessage, EventTrendingLog, UserNotification
+    ChatMessage, EventTrendingLog, UserNotification, TICKET_HOLD_TTL
 )
 from .serializers import (
     UserSerializer, UserDetailSerializer, EventSerializer, EventDetailSerializer,
     TicketSerializer, ReviewSerializer, ChatMessageSerializer, TagSerializer,
     NotificationSerializer,
-    DiscountCodeSerializer, PaymentSerializer, EventTrendingLogSerializer
+    DiscountCodeSerializer, PaymentSerializer, EventTrendingLogSerializer, with_event_detail,
+    sparse_fields
 )
 from .perms import (
     IsAdminUser, IsAdminOrOrganizer, IsEventOrganizer, IsOrganizer, IsOrganizerOwner,
     IsTicketOwner, IsChatMessageSender, IsEventOwnerOrAdmin,ReviewOwner, IsOrganizerUser
 )
-from .paginators import ItemPaginator
+from .paginators import ItemPaginator, ItemKeysetPaginator
+from .idempotency import idempotent
+from . import activity, booking, gate_bundle, gate_scans, inbox, qr, ticket_tokens, waiting_room
 
 
+class SparseFieldsMixin:
+    """
+    ?fields=a,b / ?omit=c cho các API GET: serializer chỉ trả các trường được chọn và queryset chỉ nạp
+    các cột, quan hệ mà những trường đó dùng tới (DynamicFieldsMixin.optimize_queryset).
+    """
 
-class UserViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView):
+    def sparse_params(self):
+        return sparse_fields(self.request) if self.request.method == 'GET' else {}
+
+    def sparse_queryset(self, queryset, serializer_class=None):
+        params = self.sparse_params()
+        if not params:
+            return queryset
+        serializer_class = serializer_class or self.get_serializer_class()
+        return serializer_class(context=self.get_serializer_context(), **params).optimize_queryset(queryset)
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.sparse_params())
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        return self.sparse_queryset(super().filter_queryset(queryset))
+
+
+
+class UserViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = ItemPaginator
@@ -81,17 +109,17 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
     @action(methods=['get'], detail=False, url_path='tickets')
     def get_tickets(self, request):
         user = request.user
-        tickets = user.tickets.all().select_related('event')
+        tickets = self.sparse_queryset(user.tickets.all().select_related('event'), TicketSerializer)
         page = self.paginate_queryset(tickets)
-        serializer = TicketSerializer(page or tickets, many=True)
+        serializer = TicketSerializer(page or tickets, many=True, **self.sparse_params())
         return self.get_paginated_response(serializer.data) if page else Response(serializer.data)
 
     @action(methods=['get'], detail=False, url_path='payments')
     def get_payments(self, request):
         user = request.user
-        payments = user.payments.all().select_related('discount_code')
+        payments = self.sparse_queryset(user.payments.all().select_related('discount_code'), PaymentSerializer)
         page = self.paginate_queryset(payments)
-        serializer = PaymentSerializer(page or payments, many=True)
+        serializer = PaymentSerializer(page or payments, many=True, **self.sparse_params())
         return self.get_paginated_response(serializer.data) if page else Response(serializer.data)
 
     # lazy loading / infinite scroll
@@ -104,11 +132,9 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
 
     @action(detail=False, methods=['get'], url_path='my-notifications')
     def my_notifications(self, request):
-        user = request.user
-        user_notifications = UserNotification.objects.filter(user=user).select_related('notification__event')
-        notifications = [un.notification for un in user_notifications]
-        page = self.paginate_queryset(notifications)
-        serializer = NotificationSerializer(page or notifications, many=True)
+        user_notifications = inbox.user_notifications(request.user)
+        page = self.paginate_queryset(user_notifications)
+        serializer = NotificationSerializer(page or user_notifications, many=True, context={'request': request})
         return self.get_paginated_response(serializer.data) if page else Response(serializer.data)
 
     @action(methods=['get'], detail=False, url_path='sent-messages')
@@ -135,7 +161,7 @@ class UserViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView
 #Xem sự kiện
 # Cho phép người dùng xem danh sách sự kiện và chi tiết sự kiện
 # Chỉ admin và organizer mới có quyền tạo và chỉnh sửa sự kiện
-class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView, generics.CreateAPIView, generics.UpdateAPIView):
+class EventViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView, generics.CreateAPIView, generics.UpdateAPIView):
     queryset = Event.objects.all()
     pagination_class = ItemPaginator
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -153,7 +179,7 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         if self.action in ['list', 'hot_events', 'categories']:
             # Không yêu cầu xác thực cho list, hot_events
             return [permissions.AllowAny()]
-        elif self.action in ['retrieve', 'get_chat_messages','suggest_events', 'get_statistics']:
+        elif self.action in ['retrieve', 'get_chat_messages','suggest_events', 'get_statistics', 'queue']:
             # Yêu cầu đăng nhập để xem chi tiết sự kiện hoặc tin nhắn chat
             return [permissions.IsAuthenticated()]
         elif self.action in ['create']:
@@ -182,6 +208,12 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def retrieve(self, request, *args, **kwargs):
+        event = self.get_object()
+        # Lượt xem được cộng vào bucket hoạt động (events.activity) cho điểm trending
+        activity.record(event.pk, views=1)
+        return Response(self.get_serializer(event).data)
+
     def get_queryset(self):
         user = self.request.user
         # Nếu người dùng đã đăng nhập, áp dụng logic lọc theo vai trò
@@ -201,6 +233,9 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         q = self.request.query_params.get('q')
         if q:
             queryset = queryset.filter(Q(title__icontains=q) | Q(description__icontains=q) | Q(location__icontains=q) | Q(category__icontains=q))
+        if self.action == 'retrieve':
+            # Chi tiết sự kiện với số truy vấn cố định (xem EventDetailSerializer)
+            queryset = with_event_detail(queryset, self.request)
         return queryset
 
     @action(methods=['get'], detail=True, url_path='tickets')
@@ -224,7 +259,8 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         hot_events = Event.objects.filter(
             is_active=True,
             start_time__gte=timezone.now()
-        ).annotate(tickets_sold=Count('tickets', filter=Q(tickets__is_paid=True))).order_by('-tickets_sold')[:5]
+        ).annotate(tickets_sold=Count('tickets', filter=Q(tickets__is_paid=True))).order_by('-tickets_sold')
+        hot_events = self.sparse_queryset(hot_events)[:5]
         serializer = self.get_serializer(hot_events, many=True)
         return Response(serializer.data)
 
@@ -242,6 +278,52 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         }
         return Response(data)
 
+    # Phòng chờ: POST để vào hàng đợi và nhận token, GET ?token=... để xem vị trí hiện tại.
+    # GET không truy vấn bảng Event: mọi thông tin cần thiết nằm trong token đã ký.
+    @action(detail=True, methods=['get', 'post'], url_path='queue')
+    def queue(self, request, pk):
+        if request.method == 'POST':
+            event = get_object_or_404(Event, pk=pk, is_active=True)
+            token = waiting_room.join(event, request.user)
+            data = waiting_room.get_status(event.pk, request.user, token)
+            return Response({'token': token, **data}, status=status.HTTP_201_CREATED)
+
+        token = request.query_params.get('token')
+        if not token:
+            return Response({"error": "Thiếu tham số token."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(waiting_room.get_status(pk, request.user, token))
+        except (signing.BadSignature, ValueError):
+            return Response({"error": "Token hàng đợi không hợp lệ hoặc đã hết hạn."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Gói dữ liệu soát vé offline (xem events.gate_bundle); ?since=<version> để lấy phần thay đổi
+    @action(detail=True, methods=['get'], url_path='gate-bundle')
+    def export_gate_bundle(self, request, pk):
+        event = self.get_object()
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"error": "Tham số since không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            gate_bundle.iter_bundle(event.pk, since), content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = f'attachment; filename="event-{event.pk}.bundle"'
+        return response
+
+    # Khóa kiểm tra token vé của sự kiện cho máy soát vé (xem events.ticket_tokens)
+    @action(detail=True, methods=['get'], url_path='gate-keys')
+    def gate_keys(self, request, pk):
+        event = self.get_object()
+        current_kid, _ = ticket_tokens.get_signing_keys()
+        keys = ticket_tokens.get_event_keys(event.pk)
+        return Response({
+            'event_id': event.pk,
+            'current_kid': current_kid,
+            'keys': {kid: base64.b64encode(key).decode() for kid, key in keys.items()},
+        })
+
     @action(detail=False, methods=['get'], url_path='my-events')
     def my_events(self, request):
         user = request.user
@@ -289,7 +371,7 @@ class EventViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIV
         return Response(serializer.data)
 
 
-class TagViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
+class TagViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
     queryset = Tag.objects.all().order_by('id')
     serializer_class = TagSerializer
     pagination_class = ItemPaginator
@@ -304,14 +386,15 @@ class TagViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
         return [permissions.AllowAny()] 
 
 
-class TicketViewSet(viewsets.ViewSet, generics.ListAPIView,generics.UpdateAPIView):
+class TicketViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListAPIView,generics.UpdateAPIView):
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = ItemPaginator
+    pagination_class = ItemKeysetPaginator
+    count_mode = 'cached'  # Bảng vé lớn: COUNT(*) lưu cache, has_next lấy từ page_size + 1 dòng
 
     def get_permissions(self):
-        if self.action in ['book_ticket', 'check_in']:
+        if self.action in ['book_ticket', 'book_tickets', 'check_in', 'bulk_check_in', 'verify_tokens']:
             return [permissions.IsAuthenticated()]
         elif self.action in ['update', 'destroy', 'retrieve']:
             return [IsTicketOwner()]
@@ -333,59 +416,169 @@ class TicketViewSet(viewsets.ViewSet, generics.ListAPIView,generics.UpdateAPIVie
         return Response(serializer.data)
     #đặt 1 vé cho sự kiện
     @action(detail=False, methods=['post'], url_path='book-ticket')
+    @idempotent('book_ticket')
     def book_ticket(self, request):
         event_id = request.data.get('event_id')
         try:
-            event = Event.objects.get(id=event_id, is_active=True, start_time__gte=timezone.now())
+            event = Event.objects.on_sale().get(id=event_id)
         except Event.DoesNotExist:
             return Response({"error": "Sự kiện không tồn tại hoặc không khả dụng."}, status=status.HTTP_404_NOT_FOUND)
 
-        if event.tickets.filter(is_paid=True).count() >= event.total_tickets:
-            return Response({"error": "Hết vé."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # B1: Tạo vé nhưng chưa lưu ảnh QR
+        seq = None
+        if event.waiting_room_enabled:
+            try:
+                seq = waiting_room.consume(event.pk, request.user, request.data.get('queue_token'))
+            except (signing.BadSignature, ValueError):
+                return Response({"error": "Token hàng đợi không hợp lệ, đã hết hạn hoặc đã được sử dụng."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if seq is None:
+                return Response({"error": "Chưa đến lượt mua vé, vui lòng chờ trong hàng đợi."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # Tạo vé (Ticket.save giữ chỗ nguyên tử, báo lỗi nếu hết vé).
+        # Mã QR không cần tạo trước: GET /tickets/{id}/qr.png vẽ từ uuid khi cần.
         ticket = Ticket(event=event, user=request.user)
-        ticket.save()
-
-        # B2: Dùng ticket.uuid để tạo mã QR
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(str(ticket.uuid))
-        qr.make(fit=True)
-        img = qr.make_image(fill='black', back_color='white')
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        # B3: Lưu ảnh QR lên Cloudinary
-        from cloudinary.uploader import upload
-        upload_result = upload(buffer, folder="ticket_qr_codes")  # hoặc tuỳ theo folder bạn chọn
-        ticket.qr_code = upload_result['secure_url']
-        ticket.save()
+        try:
+            ticket.save()
+        except ValidationError:
+            if seq is not None:
+                waiting_room.restore(event.pk, seq)
+            return Response({"error": "Hết vé."}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             "message": "Vé đã được đặt thành công.",
-            "ticket": TicketSerializer(ticket).data,
-            "qr_code_url": ticket.qr_code
+            "ticket": TicketSerializer(ticket).data
+        }, status=status.HTTP_201_CREATED)
+
+    # Đặt nhiều vé một lần: {"event_id": 1, "quantity": 3} hoặc {"items": [{"event_id": 1, "quantity": 3}, ...]}
+    @action(detail=False, methods=['post'], url_path='book-tickets')
+    @idempotent('book_tickets')
+    def book_tickets(self, request):
+        # Lượt vào cửa đã dùng (event_id, số thứ tự), được trả lại nếu không đặt được vé
+        consumed = []
+        tickets = None
+        try:
+            quantities = booking.parse_booking_items(request.data)
+            # Sự kiện bật phòng chờ cần token: {"queue_tokens": {"<event_id>": "<token>"}} hoặc "queue_token"
+            queue_tokens = request.data.get('queue_tokens')
+            if not isinstance(queue_tokens, dict):
+                queue_tokens = {}
+            for event_id in Event.objects.filter(pk__in=quantities, waiting_room_enabled=True).values_list('pk', flat=True):
+                token = queue_tokens.get(str(event_id)) or request.data.get('queue_token')
+                try:
+                    seq = waiting_room.consume(event_id, request.user, token)
+                except (signing.BadSignature, ValueError):
+                    return Response({"error": "Token hàng đợi không hợp lệ, đã hết hạn hoặc đã được sử dụng."},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                if seq is None:
+                    return Response({"error": "Chưa đến lượt mua vé, vui lòng chờ trong hàng đợi."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+                consumed.append((event_id, seq))
+            tickets = booking.book_tickets(request.user, quantities)
+        except Event.DoesNotExist:
+            return Response({"error": "Sự kiện không tồn tại hoặc không khả dụng."}, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            if tickets is None:
+                for event_id, seq in consumed:
+                    waiting_room.restore(event_id, seq)
+
+        return Response({
+            "message": f"Đã đặt thành công {len(tickets)} vé.",
+            "tickets": TicketSerializer(tickets, many=True).data
         }, status=status.HTTP_201_CREATED)
 
 
+    # Check-in bằng token đã ký trong mã QR ({"token": ..., "event_id": ...}) hoặc uuid của vé.
+    # Với token: chữ ký được kiểm tra tại chỗ, chỉ cần một câu UPDATE có điều kiện.
     @action(detail=False, methods=['post'], url_path='check-in')
     def check_in(self, request):
+        token = request.data.get('token')
+        if token:
+            try:
+                data = ticket_tokens.verify_token(token, event_id=request.data.get('event_id'))
+            except signing.SignatureExpired:
+                return Response({"error": "Vé chưa đến hoặc đã quá thời gian sử dụng."}, status=status.HTTP_400_BAD_REQUEST)
+            except (signing.BadSignature, ValueError):
+                return Response({"error": "Token vé không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+            now = timezone.now()
+            updated = Ticket.objects.filter(pk=data.ticket_id, is_paid=True, is_checked_in=False).update(
+                is_checked_in=True, check_in_date=now, check_in_device=request.data.get('device_id', ''),
+                updated_at=now
+            )
+            if not updated:
+                if Ticket.objects.filter(pk=data.ticket_id, is_paid=True).exists():
+                    return Response({"error": "Vé đã được check-in."}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"error": "Vé không hợp lệ hoặc chưa thanh toán."}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"message": "Check-in thành công.", "ticket_id": data.ticket_id, "event_id": data.event_id})
+
         ticket_uuid = request.data.get('uuid')
         try:
             ticket = Ticket.objects.get(uuid=ticket_uuid, is_paid=True)
         except Ticket.DoesNotExist:
             return Response({"error": "Vé không hợp lệ hoặc chưa thanh toán."}, status=status.HTTP_404_NOT_FOUND)
 
-        if ticket.is_checked_in:
+        # check_in() chỉ cập nhật khi vé chưa check-in: hai cổng quét cùng lúc chỉ một cổng thành công
+        if not ticket.check_in(request.data.get('device_id', '')):
             return Response({"error": "Vé đã được check-in."}, status=status.HTTP_400_BAD_REQUEST)
-
-        ticket.check_in()
         return Response({"message": "Check-in thành công.", "ticket": TicketSerializer(ticket).data})
 
+    # Check-in theo lô từ máy soát vé, gửi lại cùng một lô không gây tác dụng phụ:
+    # {"event_id": 1, "scans": [{"uuid": "...", "scanned_at": "2025-05-01T18:00:00Z", "device_id": "gate-1"}, ...]}
+    @action(detail=False, methods=['post'], url_path='bulk-check-in')
+    def bulk_check_in(self, request):
+        try:
+            scans = gate_scans.parse_scans(request.data)
+            event_id = request.data.get('event_id')
+            event_id = int(event_id) if event_id is not None else None
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        except (TypeError, ValueError):
+            return Response({"error": "event_id không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": gate_scans.bulk_check_in(scans, event_id=event_id)})
+
+    # Kiểm tra nhiều token một lần, không truy vấn DB: {"tokens": [...], "event_id": 1}
+    @action(detail=False, methods=['post'], url_path='verify-tokens')
+    def verify_tokens(self, request):
+        tokens = request.data.get('tokens')
+        if not isinstance(tokens, list) or not tokens:
+            return Response({"error": "Danh sách token không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(tokens) > ticket_tokens.MAX_VERIFY_BATCH:
+            return Response({"error": f"Chỉ được kiểm tra tối đa {ticket_tokens.MAX_VERIFY_BATCH} token mỗi lần."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        event_id = request.data.get('event_id')
+        results = []
+        for token in tokens:
+            try:
+                data = ticket_tokens.verify_token(str(token), event_id=event_id)
+                results.append({'token': token, 'valid': True, 'ticket_id': data.ticket_id, 'event_id': data.event_id})
+            except signing.SignatureExpired:
+                results.append({'token': token, 'valid': False, 'error': "Vé chưa đến hoặc đã quá thời gian sử dụng."})
+            except (signing.BadSignature, ValueError):
+                results.append({'token': token, 'valid': False, 'error': "Token vé không hợp lệ."})
+        return Response({'results': results})
+
+    # Ảnh QR của vé: GET /tickets/{id}/qr.png hoặc qr.svg, ?size= chiều rộng (pixel)
+    def qr_code(self, request, pk=None, fmt='png'):
+        ticket = self.get_queryset().filter(pk=pk).first()
+        if ticket is None:
+            return Response({"error": "Không tìm thấy vé."}, status=status.HTTP_404_NOT_FOUND)
+
+        data = ticket_tokens.ticket_qr_data(ticket)
+        size = qr.clamp_size(request.query_params.get('size'))
+        etag = qr.qr_etag(data, fmt, size)
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(qr.render_qr(data, fmt, size), content_type=qr.QR_FORMATS[fmt])
+        response['ETag'] = etag
+        # Nội dung đổi khi vé được thanh toán hoặc đổi khóa ký: client luôn hỏi lại bằng ETag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 
 
-class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
+class PaymentViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -413,12 +606,16 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIV
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'], url_path='confirm')
+    @idempotent('confirm_payment')
     def confirm_payment(self, request, pk):
         payment = self.get_object()
         if payment.status:
             return Response({"error": "Thanh toán đã được xử lý."}, status=status.HTTP_400_BAD_REQUEST)
         if payment.user != request.user:
             return Response({"error": "Không có quyền xác nhận thanh toán này."}, status=status.HTTP_403_FORBIDDEN)
+        # Vé của thanh toán có thể đã bị hủy (ví dụ bị xóa thủ công) trước khi xác nhận
+        if not payment.tickets.exists():
+            return Response({"error": "Thanh toán không còn vé nào."}, status=status.HTTP_400_BAD_REQUEST)
 
         payment.status = True
         payment.paid_at = timezone.now()
@@ -443,28 +640,23 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIV
             "payment": PaymentSerializer(payment).data
         })
 
-    @action(detail=False, methods=['post'], url_path='pay-unpaid-tickets')
-    def pay_unpaid_tickets_for_event(self, request):
+    def _create_payment_for_held_tickets(self, request, event, discount_code_id):
+        """
+        Chọn vé đang giữ chỗ (khóa dòng), tạo Payment và gắn vé vào Payment; gọi trong transaction.atomic().
+        Vé đã gắn với Payment khác hoặc vừa hết hạn giữ chỗ làm cả thao tác bị hủy (ValidationError).
+        """
         user = request.user
-        event_id = request.data.get('event_id')
-        discount_code_id = request.data.get('discount_code_id')
-        if not event_id:
-            return Response({"error": "Thiếu event_id."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            event = Event.objects.get(id=event_id)
-        except Event.DoesNotExist:
-            return Response({"error": "Sự kiện không tồn tại."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Vé chưa thanh toán cho sự kiện này
-        unpaid_tickets = Ticket.objects.filter(user=user, is_paid=False, event=event)
-        if not unpaid_tickets.exists():
-            return Response({"error": "Không có vé chưa thanh toán cho sự kiện này."}, status=status.HTTP_400_BAD_REQUEST)
+        # select_for_update: hai request song song (hoặc release_expired_holds) không cùng xử lý một vé
+        ticket_ids = list(
+            Ticket.objects.filter(user=user, event=event, payment__isnull=True).held()
+            .select_for_update().values_list('pk', flat=True)
+        )
+        if not ticket_ids:
+            raise ValidationError("Không có vé chưa thanh toán cho sự kiện này.")
 
-        total_amount = sum(ticket.event.ticket_price for ticket in unpaid_tickets)
+        total_amount = event.ticket_price * len(ticket_ids)
 
         discount_obj = None
-        discount = 0
         if discount_code_id:
             try:
                 discount_obj = DiscountCode.objects.get(
@@ -473,16 +665,13 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIV
                     valid_from__lte=timezone.now(),
                     valid_to__gte=timezone.now()
                 )
-                if discount_obj.max_uses is not None and discount_obj.used_count >= discount_obj.max_uses:
-                    return Response({"error": "Mã giảm giá đã hết lượt sử dụng."}, status=status.HTTP_400_BAD_REQUEST)
-                if discount_obj.user_group != user.get_customer_group().value:
-                    return Response({"error": "Mã giảm giá không áp dụng cho nhóm khách hàng này."}, status=status.HTTP_400_BAD_REQUEST)
-                discount = (total_amount * discount_obj.discount_percentage) / 100
-                total_amount -= discount
-                discount_obj.used_count += 1
-                discount_obj.save()
             except DiscountCode.DoesNotExist:
-                return Response({"error": "Mã giảm giá không hợp lệ hoặc đã hết hạn."}, status=status.HTTP_400_BAD_REQUEST)
+                raise ValidationError("Mã giảm giá không hợp lệ hoặc đã hết hạn.")
+            if discount_obj.max_uses is not None and discount_obj.used_count >= discount_obj.max_uses:
+                raise ValidationError("Mã giảm giá đã hết lượt sử dụng.")
+            if discount_obj.user_group != user.get_customer_group().value:
+                raise ValidationError("Mã giảm giá không áp dụng cho nhóm khách hàng này.")
+            total_amount -= (total_amount * discount_obj.discount_percentage) / 100
 
         payment = Payment(
             user=user,
@@ -492,10 +681,36 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIV
             transaction_id=str(uuid.uuid4()),
             discount_code=discount_obj
         )
-        payment.save()
-        for ticket in (unpaid_tickets):
-            ticket.payment = payment
-            ticket.save()
+        payment.save()  # Payment.save ghi nhận lượt dùng mã giảm giá
+        # Gắn vé vào payment và gia hạn giữ chỗ thêm một TTL để người dùng hoàn tất thanh toán;
+        # điều kiện được kiểm tra lại trong UPDATE, thiếu vé nào thì hủy cả payment
+        now = timezone.now()
+        updated = Ticket.objects.filter(pk__in=ticket_ids, payment__isnull=True).held().update(
+            payment=payment, hold_expires_at=now + TICKET_HOLD_TTL, updated_at=now
+        )
+        if updated != len(ticket_ids):
+            raise ValidationError("Vé đã thay đổi trong lúc tạo thanh toán, vui lòng thử lại.")
+        return payment, total_amount
+
+    @action(detail=False, methods=['post'], url_path='pay-unpaid-tickets')
+    @idempotent('pay_unpaid_tickets')
+    def pay_unpaid_tickets_for_event(self, request):
+        user = request.user
+        event_id = request.data.get('event_id')
+        discount_code_id = request.data.get('discount_code_id')
+        if not event_id:
+            return Response({"error": "Thiếu event_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            event = Event.objects.get(id=event_id)
+        except Event.DoesNotExist:
+            return Response({"error": "Sự kiện không tồn tại."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            with transaction.atomic():
+                payment, total_amount = self._create_payment_for_held_tickets(request, event, discount_code_id)
+        except ValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
 
         notification = Notification(
             event=event,
@@ -527,7 +742,7 @@ class PaymentViewSet(viewsets.ViewSet, generics.ListAPIView, generics.UpdateAPIV
         })
 
 
-class DiscountCodeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,generics.DestroyAPIView):
+class DiscountCodeViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,generics.DestroyAPIView):
     queryset = DiscountCode.objects.filter(is_active=True)
     serializer_class = DiscountCodeSerializer
     pagination_class = ItemPaginator
@@ -564,6 +779,9 @@ class DiscountCodeViewSet(viewsets.ViewSet, generics.ListAPIView, generics.Creat
 
 
 class NotificationViewSet(viewsets.ViewSet):
+    # Bảng thông báo lớn: COUNT(*) lưu cache, has_next lấy từ page_size + 1 dòng
+    count_mode = 'cached'
+
     def get_permissions(self):
         if self.action == 'my_notifications':
             permission_classes = [permissions.IsAuthenticated]
@@ -571,7 +789,7 @@ class NotificationViewSet(viewsets.ViewSet):
             permission_classes = [permissions.AllowAny]
         elif self.action == 'create_notification':
             permission_classes = [IsEventOwnerOrAdmin]
-        elif self.action == 'mark_as_read':
+        elif self.action in ['mark_as_read', 'mark_all_as_read', 'unread_count']:
             permission_classes = [permissions.IsAuthenticated]
         else:
             permission_classes = [IsEventOwnerOrAdmin]
@@ -582,13 +800,13 @@ class NotificationViewSet(viewsets.ViewSet):
         if not request.user.is_authenticated:
             return Response({"error": "Yêu cầu xác thực."}, status=status.HTTP_401_UNAUTHORIZED)
 
-        user_notifications = UserNotification.objects.filter(user=request.user).select_related('notification__event').order_by('-notification__created_at')
-        notifications = [un.notification for un in user_notifications]
+        # Gộp thông báo riêng và thông báo chung, is_read được tính sẵn trong truy vấn
+        user_notifications = inbox.user_notifications(request.user)
 
-        paginator = ItemPaginator()
-        page = paginator.paginate_queryset(notifications, request)
+        paginator = ItemKeysetPaginator()
+        page = paginator.paginate_queryset(user_notifications, request, view=self)
         serializer = NotificationSerializer(
-            page or notifications,
+            page if page is not None else user_notifications,
             many=True,
             context={'request': request}  # Truyền context để get_is_read truy cập request.user
         )
@@ -604,14 +822,14 @@ class NotificationViewSet(viewsets.ViewSet):
             return Response({"error": "Thiếu tham số event_id."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            notifications = Notification.objects.filter(event_id=event_id).order_by('id')
+            notifications = inbox.event_notifications(event_id, request.user)
         except ValueError:
             return Response({"error": "event_id không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
 
-        paginator = ItemPaginator()
-        page = paginator.paginate_queryset(notifications, request)
+        paginator = ItemKeysetPaginator()
+        page = paginator.paginate_queryset(notifications, request, view=self)
         serializer = NotificationSerializer(
-            page or notifications,
+            page if page is not None else notifications,
             many=True,
             context={'request': request}  # Truyền context
         )
@@ -672,22 +890,24 @@ class NotificationViewSet(viewsets.ViewSet):
         except Notification.DoesNotExist:
             return Response({"error": "Không tìm thấy thông báo."}, status=status.HTTP_404_NOT_FOUND)
 
-        user_notification, created = UserNotification.objects.get_or_create(
-            user=request.user,
-            notification=notification,
-            defaults={'is_read': False}
-        )
-        user_notification.is_read = True
-        user_notification.read_at = timezone.now()
-        user_notification.save()
+        inbox.mark_read(request.user, notification)
 
         return Response({"message": "Thông báo đã được đánh dấu là đã đọc."}, status=status.HTTP_200_OK)
 
-class ChatMessageViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView):
+    @action(detail=False, methods=['post'], url_path='mark-all-as-read')
+    def mark_all_as_read(self, request):
+        inbox.mark_all_read(request.user)
+        return Response({"message": "Đã đánh dấu tất cả thông báo là đã đọc."}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({"unread_count": inbox.unread_count(request.user)})
+
+class ChatMessageViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.CreateAPIView, generics.ListAPIView):
     queryset = ChatMessage.objects.all()
     serializer_class = ChatMessageSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = ItemPaginator
+    pagination_class = ItemKeysetPaginator
 
     def get_permissions(self):
         if self.action in ['retrieve', 'update', 'partial_update', 'destroy']:
@@ -739,10 +959,10 @@ class ChatMessageViewSet(viewsets.ViewSet, generics.CreateAPIView, generics.List
 # Override get_queryset để lọc review theo event_id và ưu tiên review của user hiện tại đứng đầu.
 # Override perform_create để kiểm tra user chưa review event mới cho tạo review, nếu đã có thì báo lỗi.
 # Bo vệ quyền sửa/xóa review chỉ cho chủ sở hữu, và đảm bảo mỗi user chỉ được review 1 event 1 lần.
-class ReviewViewSet(viewsets.ViewSet, generics.ListCreateAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
+class ReviewViewSet(SparseFieldsMixin, viewsets.ViewSet, generics.ListCreateAPIView, generics.UpdateAPIView, generics.DestroyAPIView):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
-    pagination_class = ItemPaginator
+    pagination_class = ItemKeysetPaginator
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -753,13 +973,22 @@ class ReviewViewSet(viewsets.ViewSet, generics.ListCreateAPIView, generics.Updat
             return [permissions.IsAuthenticated()]
         return [permissions.AllowAny()]
 
+    def uses_cursor(self):
+        return ItemKeysetPaginator.cursor_query_param in self.request.query_params
+
     def get_queryset(self):
-        """Trả về danh sách review cho sự kiện, ưu tiên review của user hiện tại đứng đầu."""
+        """
+        Trả về danh sách review cho sự kiện, ưu tiên review của user hiện tại đứng đầu.
+        Với ?cursor= thứ tự keyset là (-created_at, -id): review của user hiện tại được bỏ khỏi danh
+        sách và trả riêng trong `own_reviews` ở trang đầu (xem list).
+        """
         event_id = self.request.query_params.get('event_id')
-        queryset = Review.objects.all()
+        queryset = Review.objects.select_related('user')
         if event_id:
             queryset = queryset.filter(event_id=event_id)
         user = self.request.user
+        if user.is_authenticated and self.action == 'list' and self.uses_cursor():
+            return queryset.exclude(user=user)
         if user.is_authenticated:
             from django.db.models import Case, When, Value, IntegerField
             queryset = queryset.annotate(
@@ -771,6 +1000,16 @@ class ReviewViewSet(viewsets.ViewSet, generics.ListCreateAPIView, generics.Updat
             ).order_by('is_current_user')
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.user.is_authenticated and self.uses_cursor() and not request.query_params.get('cursor'):
+            own = Review.objects.select_related('user').filter(user=request.user).order_by('-created_at', '-id')
+            event_id = request.query_params.get('event_id')
+            if event_id:
+                own = own.filter(event_id=event_id)
+            response.data['own_reviews'] = self.get_serializer(self.filter_queryset(own), many=True).data
+        return response
+
     def perform_create(self, serializer):
         """Gán người dùng hiện tại khi tạo review hoặc phản hồi, và tạo thông báo nếu là phản hồi từ organizer."""
         user = self.request.user
@@ -837,7 +1076,7 @@ class ReviewViewSet(viewsets.ViewSet, generics.ListCreateAPIView, generics.Updat
         if user.role != 'organizer' or event.organizer != user:
             raise PermissionDenied("Bạn không có quyền xem đánh giá của sự kiện này.")
 
-        reviews = Review.objects.filter(event=event).prefetch_related('replies')
+        reviews = Review.objects.filter(event=event).select_related('user').prefetch_related('replies')
         page = self.paginate_queryset(reviews)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -848,7 +1087,7 @@ class ReviewViewSet(viewsets.ViewSet, generics.ListCreateAPIView, generics.Updat
 
 
 
-class EventTrendingLogViewSet(viewsets.ViewSet,generics.ListAPIView, generics.RetrieveAPIView):
+class EventTrendingLogViewSet(SparseFieldsMixin, viewsets.ViewSet,generics.ListAPIView, generics.RetrieveAPIView):
     queryset = EventTrendingLog.objects.filter(event__is_active=True)
     serializer_class = EventTrendingLogSerializer
     pagination_class = ItemPaginator
@@ -856,6 +1095,6 @@ class EventTrendingLogViewSet(viewsets.ViewSet,generics.ListAPIView, generics.Re
 
     def retrieve(self, request, *args, **kwargs):
         trending_log = self.get_object()
-        event = trending_log.event
-        serializer = EventDetailSerializer(event)
+        event = with_event_detail(Event.objects.filter(pk=trending_log.event_id), request).get()
+        serializer = EventDetailSerializer(event, context={'request': request})
         return Response(serializer.data)
\ No newline at end of file
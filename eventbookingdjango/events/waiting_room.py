@@ -0,0 +1,188 @@
+# Phòng chờ (hàng đợi vào cửa) cho sự kiện mở bán vé số lượng lớn.
+#
+# Mỗi người vào hàng nhận một số thứ tự (INCR trên Redis hoặc bộ nhớ tiến trình) và một token ký
+# bằng django.core.signing chứa (event, user, số thứ tự, tốc độ vào cửa, giờ mở bán). Kể từ giờ mở
+# bán (Event.sale_opens_at; chưa đặt thì từ lúc người đầu tiên vào hàng), cứ mỗi giây có `admit_rate`
+# số thứ tự được vào cửa, nên xem vị trí và kiểm tra token khi đặt vé không cần truy vấn bảng nào
+# trong DB. Mỗi token chỉ dùng cho một lần đặt vé thành công (consume / restore).
+#
+#   WAITING_ROOM = {
+#       'BACKEND': 'events.waiting_room.RedisQueueStore',
+#       'OPTIONS': {'url': 'redis://localhost:6379/1'},
+#       'ADMIT_RATE': 50,      # số người được vào cửa mỗi giây
+#       'ADMIT_BURST': 100,    # số người đầu tiên được vào ngay
+#       'TOKEN_MAX_AGE': 1800, # token hết hạn sau (giây)
+#   }
+import math
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import signing
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+TOKEN_SALT = 'events.waiting_room'
+
+
+def get_config():
+    config = {'ADMIT_RATE': 50, 'ADMIT_BURST': 100, 'TOKEN_MAX_AGE': 1800}
+    config.update(getattr(settings, 'WAITING_ROOM', {}))
+    return config
+
+
+class LocalQueueStore:
+    """Lưu hàng đợi trong bộ nhớ tiến trình (một worker hoặc dùng cho test)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._used = {}
+
+    def join(self, event_id):
+        """Cấp số thứ tự tiếp theo, trả về (số thứ tự, thời điểm hàng đợi mở)."""
+        with self._lock:
+            seq, opened_at = self._queues.get(event_id, (0, time.time()))
+            self._queues[event_id] = (seq + 1, opened_at)
+            return seq + 1, opened_at
+
+    def opened_at(self, event_id):
+        with self._lock:
+            return self._queues.get(event_id, (0, None))[1]
+
+    def consume(self, event_id, seq):
+        """Đánh dấu số thứ tự đã dùng, trả về False nếu đã dùng trước đó."""
+        with self._lock:
+            used = self._used.setdefault(event_id, set())
+            if seq in used:
+                return False
+            used.add(seq)
+            return True
+
+    def restore(self, event_id, seq):
+        with self._lock:
+            self._used.get(event_id, set()).discard(seq)
+
+    def reset(self, event_id):
+        with self._lock:
+            self._queues.pop(event_id, None)
+            self._used.pop(event_id, None)
+
+
+class RedisQueueStore:
+    """Lưu hàng đợi trên Redis, dùng chung cho mọi worker."""
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='waiting_room', client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _keys(self, event_id):
+        return f'{self.prefix}:{event_id}:seq', f'{self.prefix}:{event_id}:opened_at', f'{self.prefix}:{event_id}:used'
+
+    def join(self, event_id):
+        seq_key, opened_key, _ = self._keys(event_id)
+        pipe = self.client.pipeline()
+        pipe.incr(seq_key)
+        pipe.set(opened_key, time.time(), nx=True)
+        pipe.get(opened_key)
+        seq, _, opened_at = pipe.execute()
+        return seq, float(opened_at)
+
+    def opened_at(self, event_id):
+        value = self.client.get(self._keys(event_id)[1])
+        return float(value) if value is not None else None
+
+    def consume(self, event_id, seq):
+        return bool(self.client.sadd(self._keys(event_id)[2], seq))
+
+    def restore(self, event_id, seq):
+        self.client.srem(self._keys(event_id)[2], seq)
+
+    def reset(self, event_id):
+        self.client.delete(*self._keys(event_id))
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    config = get_config()
+    backend = import_string(config.get('BACKEND', 'events.waiting_room.LocalQueueStore'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    if setting == 'WAITING_ROOM':
+        get_store.cache_clear()
+
+
+def join(event, user):
+    """Cho `user` vào hàng đợi của `event`, trả về token."""
+    seq, _ = get_store().join(event.pk)
+    rate = event.admit_rate or get_config()['ADMIT_RATE']
+    data = {'e': event.pk, 'u': user.pk, 's': seq, 'r': rate}
+    if event.sale_opens_at:
+        data['o'] = event.sale_opens_at.timestamp()
+    return signing.dumps(data, salt=TOKEN_SALT, compress=True)
+
+
+def _load(event_id, user, token):
+    data = signing.loads(token, salt=TOKEN_SALT, max_age=get_config()['TOKEN_MAX_AGE'])
+    if data['e'] != int(event_id) or data['u'] != user.pk:
+        raise signing.BadSignature("Token không thuộc về người dùng hoặc sự kiện này.")
+    return data
+
+
+def get_status(event_id, user, token):
+    """
+    Trả về trạng thái của token: {'position', 'admitted', 'retry_after'}.
+    Raise signing.BadSignature nếu token sai, hết hạn hoặc không thuộc về user/sự kiện này.
+    """
+    data = _load(event_id, user, token)
+    opened_at = get_store().opened_at(data['e'])
+    if opened_at is None:
+        # Hàng đợi đã bị reset: token cũ không còn hiệu lực
+        raise signing.BadSignature("Hàng đợi đã được làm mới, vui lòng vào hàng lại.")
+    # Đồng hồ vào cửa chạy từ giờ mở bán: người vào hàng sớm chỉ giữ số thứ tự, không dùng hết lượt đầu
+    elapsed = time.time() - data.get('o', opened_at)
+    config = get_config()
+    if elapsed < 0:
+        position = data['s']
+        retry_after = math.ceil(-elapsed + max(data['s'] - config['ADMIT_BURST'], 0) / data['r'])
+    else:
+        position = max(data['s'] - config['ADMIT_BURST'] - int(data['r'] * elapsed), 0)
+        retry_after = math.ceil(position / data['r']) if position else 0
+    return {
+        'position': position,
+        'admitted': position == 0,
+        'retry_after': retry_after,
+    }
+
+
+def is_admitted(event_id, user, token):
+    try:
+        return bool(token) and get_status(event_id, user, token)['admitted']
+    except signing.BadSignature:
+        return False
+
+
+def consume(event_id, user, token):
+    """
+    Dùng lượt vào cửa của token cho một lần đặt vé, trả về số thứ tự (để restore nếu đặt vé thất bại)
+    hoặc None nếu chưa đến lượt. Raise signing.BadSignature nếu token sai hoặc đã được dùng.
+    """
+    if not token or not get_status(event_id, user, token)['admitted']:
+        return None
+    seq = _load(event_id, user, token)['s']
+    if not get_store().consume(int(event_id), seq):
+        raise signing.BadSignature("Token hàng đợi đã được sử dụng.")
+    return seq
+
+
+def restore(event_id, seq):
+    """Trả lại lượt vào cửa đã consume khi đặt vé thất bại."""
+    get_store().restore(int(event_id), seq)
@@ -5,10 +5,7 @@ from datetime import datetime
 import django.utils.timezone as timezone
 from django.db import transaction
 import uuid
-import qrcode
-import io
 import base64
-from cloudinary.uploader import upload
 from decimal import Decimal
 
 # Thiết lập môi trường Django
@@ -130,28 +127,9 @@ def load_dummy_data():
             print(f"Event {event.title} đã hết vé, bỏ qua ticket...")
             continue
 
-        # Tạo QR code
-        qr_code = str(uuid.uuid4())
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_code)
-        qr.make(fit=True)
-        img = qr.make_image(fill='black', back_color='white')
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        qr_code_image = buffer.getvalue()
-
-        # Tải lên Cloudinary
-        try:
-            upload_result = upload(qr_code_image, resource_type="image", folder="qr_codes")
-            qr_code_url = upload_result['secure_url']
-        except Exception as e:
-            print(f"Lỗi khi tải QR code lên Cloudinary: {e}, bỏ qua ticket...")
-            continue
-
         ticket = Ticket(
             event=event,
             user=user,
-            qr_code=qr_code_url,
             is_paid=ticket_data.get('is_paid', False),
             is_checked_in=ticket_data.get('is_checked_in', False)
         )
@@ -210,8 +188,7 @@ def load_dummy_data():
                     (discount_code.max_uses is None or discount_code.used_count < discount_code.max_uses)):
                 discount_applied = Decimal(str((total_amount * discount_code.discount_percentage) / 100))
                 final_amount = total_amount - discount_applied
-                discount_code.used_count += 1
-                discount_code.save(update_fields=['used_count'])
+                # Lượt dùng mã được ghi nhận khi lưu Payment
             else:
                 print(f"Mã giảm giá {discount_code.code} không hợp lệ hoặc đã hết lượt sử dụng, bỏ qua áp dụng mã...")
                 discount_code = None